@@ -0,0 +1,181 @@
+"""
+Cache semântico das respostas do chatbot de compliance
+Perguntas parecidas (similaridade dos embeddings acima do limiar) reutilizam
+a resposta e as fontes já geradas, sem nova busca nem chamada à LLM
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from env_flags import env_flag
+
+
+RAG_ANSWER_CACHE = env_flag("RAG_ANSWER_CACHE", default=True)
+ANSWER_CACHE_FILE = ".cache/rag/respostas.json"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("RAG_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("RAG_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "500"))
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class SemanticAnswerCache:
+    def __init__(self, embeddings, fingerprint: Optional[str],
+                 path: str = ANSWER_CACHE_FILE,
+                 threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        """
+        Abre o cache de um índice da política
+
+        Args:
+            embeddings: Embeddings usados nas perguntas (os mesmos do RAG)
+            fingerprint: Identificador do índice (ComplianceChatbot.fingerprint);
+                respostas salvas para outro índice são descartadas
+            path: Arquivo JSON do cache (None = só em memória)
+            threshold: Similaridade (cosseno) mínima para reutilizar a resposta
+            ttl_seconds: Validade de uma resposta
+            max_entries: Respostas mantidas (as menos usadas saem primeiro)
+        """
+        self.embeddings = embeddings
+        self.fingerprint = fingerprint
+        self.path = path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[int, Dict] = {}
+        self._next_id = 0
+        self._index = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('fingerprint') != self.fingerprint:
+            print("[*] Índice da política mudou - cache de respostas descartado")
+            return
+        for entry in data.get('entries', []):
+            self._add(entry)
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': self.fingerprint, 'entries': list(self._entries.values())},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _add(self, entry: Dict):
+        vector = _unit(entry['vector'])
+        if self._index is None:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(len(vector)))
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._index.add_with_ids(vector[None, :], np.array([entry_id], dtype=np.int64))
+
+    def _remove(self, entry_ids: List[int]):
+        if entry_ids:
+            self._index.remove_ids(np.array(entry_ids, dtype=np.int64))
+            for entry_id in entry_ids:
+                del self._entries[entry_id]
+
+    def _evict(self):
+        """Remove respostas vencidas e, acima do limite, as usadas há mais tempo"""
+        now = time.time()
+        expired = [entry_id for entry_id, entry in self._entries.items()
+                   if now - entry['created'] > self.ttl_seconds]
+        self._remove(expired)
+        excess = len(self._entries) - self.max_entries
+        if excess > 0:
+            oldest = sorted(self._entries, key=lambda entry_id: self._entries[entry_id]['last_used'])
+            self._remove(oldest[:excess])
+
+    def embed(self, question: str) -> np.ndarray:
+        """Vetor unitário da pergunta (para reutilizar entre lookup e store)"""
+        return _unit(self.embeddings.embed_query(question))
+
+    def reset(self, fingerprint: Optional[str]):
+        """Descarta as respostas se o índice da política mudou"""
+        with self._lock:
+            if fingerprint == self.fingerprint:
+                return
+            self.fingerprint = fingerprint
+            self._entries.clear()
+            self._index = None
+            self._save()
+
+    def lookup(self, question: str, vector: Optional[np.ndarray] = None) -> Optional[Dict]:
+        """
+        Resposta de uma pergunta parecida já respondida
+
+        Args:
+            question: Pergunta
+            vector: Embedding da pergunta, se já calculado (ver embed)
+
+        Returns:
+            Dict no formato de ComplianceChatbot.ask (com 'cached': True) ou None
+        """
+        vector = self.embed(question) if vector is None else vector
+        with self._lock:
+            self._evict()
+            if not self._entries:
+                self.misses += 1
+                return None
+            scores, ids = self._index.search(vector[None, :], 1)
+            if ids[0][0] == -1 or scores[0][0] < self.threshold:
+                self.misses += 1
+                return None
+            entry = self._entries[int(ids[0][0])]
+            entry['last_used'] = time.time()
+            self.hits += 1
+        return {
+            'query': question,
+            'result': entry['answer'],
+            'source_documents': [Document(page_content=doc['page_content'],
+                                          metadata=doc['metadata'])
+                                 for doc in entry['sources']],
+            'cached': True,
+            'cached_question': entry['question'],
+            'similarity': float(scores[0][0]),
+        }
+
+    def store(self, question: str, result: Dict, vector: Optional[np.ndarray] = None):
+        """Guarda a resposta gerada para uma pergunta"""
+        vector = self.embed(question) if vector is None else vector
+        now = time.time()
+        entry = {
+            'question': question,
+            'answer': result['result'],
+            'sources': [{'page_content': doc.page_content, 'metadata': doc.metadata}
+                        for doc in result.get('source_documents', [])],
+            'vector': [float(x) for x in vector],
+            'created': now,
+            'last_used': now,
+        }
+        with self._lock:
+            self._add(entry)
+            self._evict()
+            self._save()
+
+    def stats(self) -> Dict:
+        """Acertos, falhas e tamanho do cache"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
@@ -0,0 +1,61 @@
+"""
+Estado persistido das auditorias incrementais
+Guarda, por dataset, a marca d'água (até onde os dados já foram auditados)
+e os resultados acumulados das execuções anteriores
+"""
+
+import json
+import os
+from typing import Dict, List
+
+
+STATE_DIR = ".audit_state"
+
+
+def _json_default(value):
+    """Converte escalares numpy/pandas para tipos nativos do JSON"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class AuditState:
+    def __init__(self, dataset: str, state_dir: str = STATE_DIR):
+        """
+        Carrega (ou inicia) o estado de um dataset
+
+        Args:
+            dataset: Nome do dataset (ex: 'transacoes', 'emails')
+            state_dir: Diretório onde os estados são salvos
+        """
+        self.dataset = dataset
+        self.path = os.path.join(state_dir, f"{dataset}.json")
+        self.watermark: Dict = {}
+        self.records: List[Dict] = []
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.watermark = data.get('watermark', {})
+            self.records = data.get('records', [])
+
+    @property
+    def is_new(self) -> bool:
+        """Nenhuma auditoria anterior registrada"""
+        return not self.watermark
+
+    def reset(self):
+        """Descarta marca d'água e resultados (próxima execução audita tudo)"""
+        self.watermark = {}
+        self.records = []
+
+    def save(self):
+        """Grava o estado de forma atômica"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {'watermark': self.watermark, 'records': self.records},
+                f, ensure_ascii=False, indent=2, default=_json_default
+            )
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,201 @@
+"""
+Índice invertido dos emails
+Construído uma vez sobre os emails parseados, responde consultas por
+remetente, destinatário, período e termos sem varrer o dump de novo
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+from keyword_matcher import normalize_text
+
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+                '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y']
+
+# Distância entre campos nas posições dos termos (frases não cruzam campos)
+_FIELD_GAP = 1000
+
+
+def tokenize(text: str) -> List[str]:
+    """Termos normalizados: minúsculas, sem acentos, apenas caracteres de palavra"""
+    return _TOKEN_PATTERN.findall(normalize_text(text, ignore_accents=True))
+
+
+def person_key(value: str) -> str:
+    """
+    Chave de uma pessoa: endereço completo (se tiver @) ou nome normalizado
+
+    "Michael Scott", "michael.scott" e "MICHAEL_SCOTT" viram "michael scott".
+    """
+    value = value.strip().lower()
+    if '@' in value:
+        return value
+    return ' '.join(value.replace('.', ' ').replace('_', ' ').split())
+
+
+def parse_date(value: Union[str, date, datetime, None]) -> Optional[datetime]:
+    """Converte a data de um email (ou de uma consulta) em datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _query_date(value) -> datetime:
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"Data inválida: {value!r} (use AAAA-MM-DD)")
+    return parsed
+
+
+def date_bounds(date_from=None, date_to=None):
+    """
+    Limites (inclusive) de um filtro de datas; data sem hora em date_to
+    inclui o dia inteiro
+    """
+    lower = None if date_from is None else _query_date(date_from)
+    upper = None
+    if date_to is not None:
+        upper = _query_date(date_to)
+        if upper == datetime(upper.year, upper.month, upper.day) \
+                and not isinstance(date_to, datetime):
+            upper = upper.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return lower, upper
+
+
+def person_keys(name: str, address: str) -> Set[str]:
+    """Chaves de um participante: nome, parte local do endereço e endereço completo"""
+    keys = set()
+    if name:
+        keys.add(person_key(name))
+    if address:
+        keys.add(person_key(address))
+        keys.add(person_key(address.split('@')[0]))
+    return keys
+
+
+class EmailIndex:
+    def __init__(self, emails: Iterable[Dict]):
+        """
+        Indexa os emails
+
+        Args:
+            emails: Emails no formato de ConspiracyDetector.parse_emails
+        """
+        self.emails: List[Dict] = emails if isinstance(emails, list) else list(emails)
+        self.by_sender: Dict[str, Set[int]] = defaultdict(set)
+        self.by_recipient: Dict[str, Set[int]] = defaultdict(set)
+        # termo -> {email: posições}; as posições permitem buscar frases
+        self.postings: Dict[str, Dict[int, List[int]]] = defaultdict(dict)
+        dated = []
+
+        for doc_id, email in enumerate(self.emails):
+            for key in person_keys(email['de_nome'], email['de_email']):
+                self.by_sender[key].add(doc_id)
+            for key in person_keys(email['para_nome'], email['para_email']):
+                self.by_recipient[key].add(doc_id)
+
+            # Assunto, corpo e endereço do destinatário (como na busca original)
+            offset = 0
+            for field in (email['assunto'], email['mensagem'], email['para_email']):
+                for position, token in enumerate(tokenize(field), offset):
+                    self.postings[token].setdefault(doc_id, []).append(position)
+                    offset = position + 1
+                offset += _FIELD_GAP
+
+            sent_at = parse_date(email['data'])
+            if sent_at is not None:
+                dated.append((sent_at, doc_id))
+
+        dated.sort()
+        self._dates = [sent_at for sent_at, _ in dated]
+        self._dated_ids = [doc_id for _, doc_id in dated]
+
+    def __len__(self) -> int:
+        return len(self.emails)
+
+    def _people(self, postings: Dict[str, Set[int]], value: str) -> Set[int]:
+        return set(postings.get(person_key(value), ()))
+
+    def _phrase(self, phrase: str) -> Set[int]:
+        """Emails que contêm o termo (ou a sequência de termos, se for frase)"""
+        tokens = tokenize(phrase)
+        if not tokens:
+            return set()
+        candidates = set(self.postings.get(tokens[0], {}))
+        for token in tokens[1:]:
+            candidates &= set(self.postings.get(token, {}))
+        if len(tokens) == 1:
+            return candidates
+
+        matches = set()
+        for doc_id in candidates:
+            following = [set(self.postings[token][doc_id]) for token in tokens[1:]]
+            if any(all(start + i + 1 in positions for i, positions in enumerate(following))
+                   for start in self.postings[tokens[0]][doc_id]):
+                matches.add(doc_id)
+        return matches
+
+    def _date_range(self, date_from, date_to) -> Set[int]:
+        lower, upper = date_bounds(date_from, date_to)
+        start = 0 if lower is None else bisect_left(self._dates, lower)
+        end = len(self._dates) if upper is None else bisect_right(self._dates, upper)
+        return set(self._dated_ids[start:end])
+
+    def search(self, sender: Optional[str] = None, recipient: Optional[str] = None,
+               any_terms: Optional[Iterable[str]] = None,
+               all_terms: Optional[Iterable[str]] = None,
+               date_from=None, date_to=None) -> List[int]:
+        """
+        Posições (na ordem do dump) dos emails que atendem a todos os filtros
+
+        Args:
+            sender: Remetente (nome, "nome.sobrenome" ou endereço completo)
+            recipient: Destinatário (mesmos formatos)
+            any_terms: Pelo menos um destes termos ou frases
+            all_terms: Todos estes termos ou frases
+            date_from: Data inicial (inclusive); emails sem data válida saem
+            date_to: Data final (inclusive)
+        """
+        filters: List[Set[int]] = []
+        if sender is not None:
+            filters.append(self._people(self.by_sender, sender))
+        if recipient is not None:
+            filters.append(self._people(self.by_recipient, recipient))
+        if any_terms is not None:
+            matched = set()
+            for term in any_terms:
+                matched |= self._phrase(term)
+            filters.append(matched)
+        for term in all_terms or ():
+            filters.append(self._phrase(term))
+        if date_from is not None or date_to is not None:
+            filters.append(self._date_range(date_from, date_to))
+
+        if not filters:
+            return list(range(len(self.emails)))
+        # Interseção começando pelo filtro mais seletivo
+        filters.sort(key=len)
+        result = filters[0]
+        for other in filters[1:]:
+            if not result:
+                break
+            result = result & other
+        return sorted(result)
+
+    def query(self, **filters) -> List[Dict]:
+        """Emails que atendem aos filtros de search(), na ordem do dump"""
+        return [self.emails[doc_id] for doc_id in self.search(**filters)]
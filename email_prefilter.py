@@ -0,0 +1,125 @@
+"""
+Pré-filtro local dos emails por embeddings
+Pontua cada email pela similaridade com exemplos de hostilidade/exclusão
+contra o Toby (mesmo modelo MiniLM do Módulo 1) e só deixa seguir para a
+LLM os candidatos mais prováveis
+"""
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from embeddings_provider import EMBEDDING_BATCH_SIZE, get_embeddings
+
+
+EMAIL_PREFILTER_THRESHOLD = float(os.getenv("EMAIL_PREFILTER_THRESHOLD", "0.4"))
+# Máximo de emails que seguem para a LLM (0 = sem limite, só o limiar)
+EMAIL_PREFILTER_TOP_K = int(os.getenv("EMAIL_PREFILTER_TOP_K", "0"))
+
+# Caracteres de cada email usados no embedding (o MiniLM lê ~128 tokens)
+_MAX_EMAIL_CHARS = 1000
+
+HOSTILITY_EXEMPLARS = [
+    "Eu odeio o Toby, ele é a pior pessoa do escritório.",
+    "Vamos deixar o Toby de fora da reunião, não o convidem.",
+    "Ninguém conta nada para o Toby sobre a festa.",
+    "Precisamos nos livrar do Toby de uma vez por todas.",
+    "Quero que o Toby seja demitido ou transferido para bem longe.",
+    "Tenho um plano para sabotar o trabalho do RH.",
+    "O Toby estraga tudo, temos que atrapalhar a vida dele.",
+    "Não deixem o pessoal do RH saber disso, escondam do Toby.",
+    "Vamos fazer o Toby parecer incompetente na frente do chefe.",
+    "I hate Toby, let's keep him out of everything.",
+]
+
+
+def _email_text(email: Dict) -> str:
+    return f"{email['assunto']}\n{email['mensagem']}"[:_MAX_EMAIL_CHARS]
+
+
+class EmbeddingPrefilter:
+    def __init__(self, embeddings=None, exemplars: Optional[List[str]] = None,
+                 threshold: float = EMAIL_PREFILTER_THRESHOLD,
+                 top_k: int = EMAIL_PREFILTER_TOP_K,
+                 batch_size: int = EMBEDDING_BATCH_SIZE):
+        """
+        Configura o pré-filtro
+
+        Args:
+            embeddings: Embeddings LangChain (padrão: os compartilhados do processo)
+            exemplars: Frases de referência de hostilidade/exclusão
+            threshold: Similaridade (cosseno) mínima para seguir para a LLM
+            top_k: Máximo de emails mantidos, pelos maiores scores (0 = todos)
+            batch_size: Emails por chamada ao modelo de embeddings
+        """
+        self.embeddings = embeddings if embeddings is not None else get_embeddings()
+        self.exemplars = list(exemplars or HOSTILITY_EXEMPLARS)
+        self.threshold = threshold
+        self.top_k = top_k
+        self.batch_size = max(1, batch_size)
+        self._exemplar_vectors = None
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[start:start + self.batch_size]))
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        # Garante vetores unitários mesmo que o modelo não normalize
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def score(self, emails: List[Dict]) -> np.ndarray:
+        """Maior similaridade de cada email com os exemplos"""
+        if not emails:
+            return np.zeros(0, dtype=np.float32)
+        if self._exemplar_vectors is None:
+            self._exemplar_vectors = self._embed(self.exemplars)
+        vectors = self._embed([_email_text(email) for email in emails])
+        return (vectors @ self._exemplar_vectors.T).max(axis=1)
+
+    def _selected(self, scores: np.ndarray) -> np.ndarray:
+        """Posições (na ordem original) acima do limiar, limitadas a top_k"""
+        above = np.flatnonzero(scores >= self.threshold)
+        if self.top_k and len(above) > self.top_k:
+            best = np.argsort(-scores[above], kind='stable')[:self.top_k]
+            above = np.sort(above[best])
+        return above
+
+    def filter(self, emails: List[Dict]) -> Tuple[List[Dict], np.ndarray]:
+        """
+        Emails candidatos, na ordem original
+
+        Returns:
+            (emails selecionados, scores de todos os emails de entrada)
+        """
+        scores = self.score(emails)
+        selected = self._selected(scores)
+        print(f"[OK] Pré-filtro por embeddings: {len(selected)} de {len(emails)} emails "
+              f"seguem para a LLM (limiar {self.threshold}"
+              + (f", top {self.top_k})" if self.top_k else ")"))
+        return [emails[i] for i in selected], scores
+
+    def evaluate(self, emails: List[Dict], positives: Iterable[int]) -> Dict:
+        """
+        Mede o pré-filtro em um conjunto rotulado
+
+        Args:
+            emails: Emails avaliados
+            positives: Posições dos emails realmente hostis (ex: os que a LLM
+                apontou numa execução sem o pré-filtro)
+
+        Returns:
+            Dict com recall, precisão, fração mantida e os scores
+        """
+        positives = set(positives)
+        scores = self.score(emails)
+        selected = set(self._selected(scores).tolist())
+        hits = len(selected & positives)
+        return {
+            'recall': hits / len(positives) if positives else 1.0,
+            'precision': hits / len(selected) if selected else 0.0,
+            'kept_fraction': len(selected) / len(emails) if emails else 0.0,
+            'missed': sorted(positives - selected),
+            'scores': scores,
+        }
@@ -0,0 +1,202 @@
+"""
+Pré-processamento dos emails antes da LLM
+Remove o histórico citado de respostas e encaminhamentos, agrupa as
+mensagens em threads (assunto + participantes) e descarta quase-duplicatas
+(MinHash/LSH), informando quantos tokens deixam de ir para os prompts
+"""
+
+import os
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from email_index import person_key, tokenize
+from env_flags import env_flag
+from token_budget import count_tokens
+
+
+EMAIL_PREPROCESS = env_flag("EMAIL_PREPROCESS", default=True)
+
+# Similaridade de Jaccard (estimada) a partir da qual dois emails do mesmo
+# remetente são considerados a mesma mensagem
+DEDUP_THRESHOLD = float(os.getenv("EMAIL_DEDUP_THRESHOLD", "0.85"))
+
+# Assinatura MinHash: NUM_PERM = BANDS x ROWS; com 32 bandas de 4 linhas,
+# pares com Jaccard >= ~0.5 quase sempre caem no mesmo balde
+NUM_PERM = 128
+LSH_BANDS = 32
+LSH_ROWS = NUM_PERM // LSH_BANDS
+SHINGLE_SIZE = 3
+
+# Permutações (a * h + b) mod p, como no datasketch: a e b ocupam os 61 bits,
+# então o produto dá a volta em 64 bits antes do módulo (intencional)
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(7)
+_PERM_A = _rng.randint(1, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+
+# Prefixos de resposta/encaminhamento no assunto (RE:, Fwd:, ENC:, RES: ...)
+_SUBJECT_PREFIX = re.compile(r'^\s*((re|res|resp|fw|fwd|enc|tr)\s*(\[\d+\])?\s*:\s*)+',
+                             re.IGNORECASE)
+
+# Linha a partir da qual o resto do corpo é histórico citado
+_QUOTE_START = re.compile(
+    r'^\s*(-{2,}\s*(original message|mensagem original|forwarded message|'
+    r'mensagem encaminhada)\s*-{2,}'
+    r'|(em|on)\s.+(escreveu|wrote)\s*:)\s*$',
+    re.IGNORECASE
+)
+# Cabeçalho de mensagem citada no estilo Outlook ("De: ..." seguido de
+# "Enviado:"/"Para:"/"Assunto:" nas linhas seguintes)
+_QUOTED_HEADER = re.compile(r'^\s*(de|from)\s*:\s*\S', re.IGNORECASE)
+_QUOTED_HEADER_FIELD = re.compile(r'^\s*(enviad[oa]( em)?|sent|para|to|assunto|subject|data|date)\s*:',
+                                  re.IGNORECASE)
+
+
+def strip_quoted(text: str) -> str:
+    """
+    Corpo sem o histórico citado
+
+    Descarta linhas iniciadas por '>' e tudo a partir de um marcador de
+    resposta ("-----Mensagem original-----", "Em ..., Fulano escreveu:") ou de
+    um cabeçalho de mensagem encaminhada. Se nada sobrar (email só com
+    citação), o texto original é mantido.
+    """
+    lines = text.split('\n')
+    kept = []
+    for i, line in enumerate(lines):
+        if _QUOTE_START.match(line):
+            break
+        if _QUOTED_HEADER.match(line) and any(
+                _QUOTED_HEADER_FIELD.match(following) for following in lines[i + 1:i + 4]):
+            break
+        if line.lstrip().startswith('>'):
+            continue
+        kept.append(line)
+    stripped = '\n'.join(kept).strip()
+    return stripped if stripped else text
+
+
+def normalize_subject(subject: str) -> str:
+    """Assunto sem RE:/Fwd:/ENC:, em minúsculas e sem acentos"""
+    return ' '.join(tokenize(_SUBJECT_PREFIX.sub('', subject)))
+
+
+def _sender_key(email: Dict) -> str:
+    return person_key(email['de_email'].split('@')[0] if email['de_email'] else email['de_nome'])
+
+
+def thread_key(email: Dict) -> Tuple[str, frozenset]:
+    """Thread de um email: assunto normalizado + remetente e destinatário"""
+    participants = {_sender_key(email)}
+    if email['para_email'] or email['para_nome']:
+        participants.add(person_key(email['para_email'].split('@')[0]
+                                    if email['para_email'] else email['para_nome']))
+    return normalize_subject(email['assunto']), frozenset(participants)
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """Assinatura MinHash dos shingles de SHINGLE_SIZE palavras do texto"""
+    words = tokenize(text)
+    if len(words) < SHINGLE_SIZE:
+        shingles = {' '.join(words)}
+    else:
+        shingles = {' '.join(words[i:i + SHINGLE_SIZE])
+                    for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.array([zlib.crc32(s.encode('utf-8')) for s in shingles], dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        permuted = (hashes[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME
+    return (permuted & np.uint64(0xFFFFFFFF)).min(axis=0)
+
+
+def find_near_duplicates(texts: List[str], groups: List[str],
+                         threshold: float = DEDUP_THRESHOLD) -> Dict[int, int]:
+    """
+    Quase-duplicatas via LSH sobre assinaturas MinHash
+
+    Só textos do mesmo grupo (ex: remetente) são comparados. Candidatos que
+    dividem alguma banda têm a similaridade estimada conferida com threshold.
+
+    Returns:
+        {índice da duplicata: índice da primeira ocorrência}
+    """
+    signatures = [minhash_signature(text) for text in texts]
+    buckets = defaultdict(list)
+    duplicates = {}
+    for i, signature in enumerate(signatures):
+        candidates = set()
+        keys = [(groups[i], band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes())
+                for band in range(LSH_BANDS)]
+        for key in keys:
+            candidates.update(buckets[key])
+        original = next((j for j in sorted(candidates)
+                         if np.mean(signatures[j] == signature) >= threshold), None)
+        if original is not None:
+            duplicates[i] = original
+            continue
+        # Só os emails mantidos entram no índice
+        for key in keys:
+            buckets[key].append(i)
+    return duplicates
+
+
+def _email_tokens(email: Dict) -> int:
+    return count_tokens(email['assunto']) + count_tokens(email['mensagem'])
+
+
+def preprocess_emails(emails: List[Dict], threshold: float = DEDUP_THRESHOLD) -> Tuple[List[Dict], Dict]:
+    """
+    Prepara os emails para os prompts
+
+    Os dicionários de entrada não são alterados: a saída traz cópias com o
+    corpo sem histórico citado e a chave 'thread' (posição da thread), em
+    ordem de thread (pela primeira aparição) e, dentro dela, na ordem do dump.
+
+    Args:
+        emails: Emails no formato de ConspiracyDetector.parse_emails
+        threshold: Similaridade mínima para descartar uma quase-duplicata
+
+    Returns:
+        (emails processados, estatísticas com os tokens economizados)
+    """
+    tokens_before = sum(_email_tokens(email) for email in emails)
+    cleaned = []
+    stripped = 0
+    for email in emails:
+        body = strip_quoted(email['mensagem'])
+        stripped += body != email['mensagem']
+        cleaned.append({**email, 'mensagem': body})
+
+    duplicates = find_near_duplicates(
+        [email['assunto'] + '\n' + email['mensagem'] for email in cleaned],
+        [_sender_key(email) for email in cleaned],
+        threshold
+    )
+
+    threads: Dict[Tuple, List[Dict]] = {}
+    for i, email in enumerate(cleaned):
+        if i not in duplicates:
+            threads.setdefault(thread_key(email), []).append(email)
+    result = [{**email, 'thread': n}
+              for n, messages in enumerate(threads.values()) for email in messages]
+
+    tokens_after = sum(_email_tokens(email) for email in result)
+    stats = {
+        'emails_in': len(emails),
+        'emails_out': len(result),
+        'quotes_stripped': stripped,
+        'duplicates': len(duplicates),
+        'threads': len(threads),
+        'tokens_before': tokens_before,
+        'tokens_after': tokens_after,
+        'tokens_saved': tokens_before - tokens_after,
+    }
+    if emails:
+        print(f"[OK] Pré-processamento: {len(emails)} -> {len(result)} emails "
+              f"({stripped} com histórico removido, {len(duplicates)} duplicatas, "
+              f"{len(threads)} threads); ~{stats['tokens_saved']:,} tokens economizados "
+              f"({stats['tokens_saved'] / max(tokens_before, 1):.0%})")
+    return result, stats
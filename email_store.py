@@ -0,0 +1,256 @@
+"""
+Base SQLite dos emails
+Carrega o dump uma única vez (com índice FTS5 para busca textual e índices
+por remetente, destinatário e data) e o atualiza de forma incremental quando
+o dump cresce; os módulos 2 e 3 consultam a base em vez de reler o arquivo
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from email_index import date_bounds, parse_date, person_key, person_keys
+from modulo2_conspiracy_detector import dump_head_hash, iter_email_records, last_block_start
+
+
+EMAIL_STORE_DIR = ".cache/emails"
+
+# 'inicio' (posição do bloco no dump) identifica o email entre atualizações
+_EMAIL_COLUMNS = ['inicio', 'de_nome', 'de_email', 'para_nome', 'para_email', 'data', 'assunto', 'mensagem']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT);
+CREATE TABLE IF NOT EXISTS emails (
+    id INTEGER PRIMARY KEY,
+    inicio INTEGER NOT NULL,
+    de_nome TEXT, de_email TEXT, para_nome TEXT, para_email TEXT,
+    data TEXT, data_iso TEXT, assunto TEXT, mensagem TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_emails_inicio ON emails (inicio);
+CREATE INDEX IF NOT EXISTS idx_emails_data ON emails (data_iso);
+CREATE TABLE IF NOT EXISTS participantes (
+    email_id INTEGER NOT NULL, papel TEXT NOT NULL, chave TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_participantes ON participantes (papel, chave);
+CREATE INDEX IF NOT EXISTS idx_participantes_chave ON participantes (chave);
+"""
+
+# Mesma normalização do EmailIndex: sem acentos, '_' faz parte da palavra
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+    assunto, mensagem, para_email,
+    content='emails', content_rowid='id',
+    tokenize="unicode61 remove_diacritics 2 tokenchars '_'"
+)
+"""
+
+
+def _fts_phrase(term: str) -> str:
+    """Termo como frase FTS5 ("recursos humanos"); 'TX_*' vira busca por prefixo"""
+    prefix = term.endswith('*')
+    phrase = '"' + term.rstrip('*').replace('"', '""') + '"'
+    return phrase + '*' if prefix else phrase
+
+
+class EmailStore:
+    def __init__(self, emails_file: str, store_dir: str = EMAIL_STORE_DIR):
+        """
+        Abre (ou cria) a base de emails de um dump
+
+        Args:
+            emails_file: Dump de emails (formato de data/emails.txt)
+            store_dir: Diretório dos arquivos SQLite
+        """
+        self.emails_file = emails_file
+        source_id = hashlib.sha1(os.path.abspath(emails_file).encode('utf-8')).hexdigest()[:12]
+        os.makedirs(store_dir, exist_ok=True)
+        self.path = os.path.join(store_dir, f"{source_id}.sqlite")
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            try:
+                self._conn.execute(_FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                print(f"[!] FTS5 indisponível no SQLite ({e}) - busca textual via LIKE")
+                self.fts = False
+
+    def _meta(self, key: str, default: str = '') -> str:
+        row = self._conn.execute("SELECT valor FROM meta WHERE chave = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    @property
+    def offset(self) -> int:
+        """
+        Posição (em bytes) do dump já dada como lida: início do último bloco
+        sem separador depois, que é relido na próxima atualização
+        """
+        with self._lock:
+            return int(self._meta('offset', '0'))
+
+    @property
+    def size(self) -> int:
+        """Tamanho do dump na última atualização"""
+        with self._lock:
+            return int(self._meta('tamanho', self._meta('offset', '0')))
+
+    def _clear(self):
+        self._conn.execute("DELETE FROM participantes")
+        self._conn.execute("DELETE FROM emails")
+        if self.fts:
+            self._conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('delete-all')")
+
+    def _delete_from(self, offset: int):
+        """Remove os emails que começam em offset ou depois (para relê-los)"""
+        rows = self._conn.execute(
+            "SELECT id, assunto, mensagem, para_email FROM emails WHERE inicio >= ?", (offset,)
+        ).fetchall()
+        if not rows:
+            return
+        if self.fts:
+            self._conn.executemany(
+                "INSERT INTO emails_fts (emails_fts, rowid, assunto, mensagem, para_email) "
+                "VALUES ('delete', ?, ?, ?, ?)", [tuple(row) for row in rows]
+            )
+        self._conn.executemany("DELETE FROM participantes WHERE email_id = ?",
+                               [(row['id'],) for row in rows])
+        self._conn.execute("DELETE FROM emails WHERE inicio >= ?", (offset,))
+
+    def refresh(self) -> int:
+        """
+        Carrega os emails acrescentados ao dump desde a última atualização
+
+        Se o dump encolheu ou o início dele mudou, a base é refeita do zero.
+        O último bloco lido (sem separador depois) pode ser um email ainda
+        sendo gravado: ele é removido e relido na atualização seguinte.
+
+        Returns:
+            Número de emails inseridos
+        """
+        size = os.path.getsize(self.emails_file)
+        with self._lock, self._conn:
+            offset = int(self._meta('offset', '0'))
+            if size < offset or (offset and self._meta('inicio_sha1')
+                                  != dump_head_hash(self.emails_file, offset)):
+                print("[!] Dump de emails foi reescrito - recriando a base")
+                self._clear()
+                offset = 0
+            elif size == int(self._meta('tamanho', str(offset))):
+                return 0
+
+            self._delete_from(offset)
+            inserted = 0
+            for start, email in iter_email_records(self.emails_file, offset, size):
+                sent_at = parse_date(email['data'])
+                cursor = self._conn.execute(
+                    "INSERT INTO emails (inicio, de_nome, de_email, para_nome, para_email, "
+                    "data, data_iso, assunto, mensagem) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (start, email['de_nome'], email['de_email'], email['para_nome'],
+                     email['para_email'], email['data'],
+                     sent_at.isoformat(sep=' ') if sent_at else None,
+                     email['assunto'], email['mensagem'])
+                )
+                email_id = cursor.lastrowid
+                rows = [(email_id, 'de', key)
+                        for key in person_keys(email['de_nome'], email['de_email'])]
+                rows += [(email_id, 'para', key)
+                         for key in person_keys(email['para_nome'], email['para_email'])]
+                self._conn.executemany(
+                    "INSERT INTO participantes (email_id, papel, chave) VALUES (?, ?, ?)", rows
+                )
+                if self.fts:
+                    self._conn.execute(
+                        "INSERT INTO emails_fts (rowid, assunto, mensagem, para_email) "
+                        "VALUES (?, ?, ?, ?)",
+                        (email_id, email['assunto'], email['mensagem'], email['para_email'])
+                    )
+                inserted += 1
+
+            watermark = last_block_start(self.emails_file, offset, size)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (chave, valor) VALUES (?, ?)",
+                [('offset', str(watermark)), ('tamanho', str(size)),
+                 ('inicio_sha1', dump_head_hash(self.emails_file, watermark))]
+            )
+
+        print(f"[OK] {inserted} emails novos carregados na base ({self.path})")
+        return inserted
+
+    def _terms_condition(self, terms: List[str]) -> Tuple[str, List]:
+        if self.fts:
+            return ("e.id IN (SELECT rowid FROM emails_fts WHERE emails_fts MATCH ?)",
+                    [' OR '.join(_fts_phrase(term) for term in terms)])
+        # Sem FTS5: busca por substring (sensível a acentos)
+        parts, params = [], []
+        for term in terms:
+            pattern = f"%{term.rstrip('*')}%"
+            parts.append("(e.assunto LIKE ? OR e.mensagem LIKE ? OR e.para_email LIKE ?)")
+            params += [pattern] * 3
+        return "(" + " OR ".join(parts) + ")", params
+
+    @staticmethod
+    def _people_condition(role: Optional[str], people: Iterable[str]) -> Tuple[str, List]:
+        keys = sorted({person_key(person) for person in people})
+        placeholders = ", ".join("?" * len(keys)) or "NULL"
+        role_filter = "papel = ? AND " if role else ""
+        sql = (f"e.id IN (SELECT email_id FROM participantes "
+               f"WHERE {role_filter}chave IN ({placeholders}))")
+        return sql, ([role] if role else []) + keys
+
+    def _select(self, conditions: List[Tuple[str, List]], joiner: str,
+                start_offset: int) -> List[Dict]:
+        where = f" {joiner} ".join(sql for sql, _ in conditions) or "1"
+        params = [p for _, condition_params in conditions for p in condition_params]
+        sql = (f"SELECT {', '.join('e.' + c for c in _EMAIL_COLUMNS)} FROM emails e "
+               f"WHERE e.inicio >= ? AND ({where}) ORDER BY e.id")
+        with self._lock:
+            rows = self._conn.execute(sql, [start_offset] + params).fetchall()
+        return [dict(row) for row in rows]
+
+    def query(self, sender: Optional[str] = None, recipient: Optional[str] = None,
+              any_terms: Optional[List[str]] = None, date_from=None, date_to=None,
+              start_offset: int = 0) -> List[Dict]:
+        """
+        Emails que atendem a todos os filtros, na ordem do dump
+
+        Args:
+            sender: Remetente (nome, "nome.sobrenome" ou endereço completo)
+            recipient: Destinatário (mesmos formatos)
+            any_terms: Pelo menos um destes termos ou frases ('TX_*' = prefixo)
+            date_from: Data inicial (inclusive)
+            date_to: Data final (inclusive)
+            start_offset: Só emails a partir desta posição do dump
+        """
+        conditions = []
+        if sender is not None:
+            conditions.append(self._people_condition('de', [sender]))
+        if recipient is not None:
+            conditions.append(self._people_condition('para', [recipient]))
+        if any_terms is not None:
+            conditions.append(self._terms_condition(list(any_terms)))
+        lower, upper = date_bounds(date_from, date_to)
+        if lower is not None:
+            conditions.append(("e.data_iso >= ?", [lower.isoformat(sep=' ')]))
+        if upper is not None:
+            conditions.append(("e.data_iso <= ?", [upper.isoformat(sep=' ')]))
+        return self._select(conditions, "AND", start_offset)
+
+    def related(self, people: Iterable[str], any_terms: Optional[List[str]] = None,
+                start_offset: int = 0) -> List[Dict]:
+        """Emails enviados ou recebidos por alguma das pessoas OU que citam algum termo"""
+        conditions = [self._people_condition(None, people)]
+        if any_terms:
+            conditions.append(self._terms_condition(list(any_terms)))
+        return self._select(conditions, "OR", start_offset)
+
+    def count(self, start_offset: int = 0) -> int:
+        """Número de emails na base (a partir de start_offset)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM emails WHERE inicio >= ?", (start_offset,)
+            ).fetchone()[0]
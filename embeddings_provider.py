@@ -0,0 +1,124 @@
+"""
+Modelo de embeddings compartilhado pelo processo
+O MiniLM é carregado uma única vez, sob demanda (ou antecipadamente em uma
+thread de fundo), e reaproveitado pelo RAG do Módulo 1 e pelo pré-filtro
+de emails
+"""
+
+import os
+import threading
+import time
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# Textos por chamada ao modelo e threads de CPU do PyTorch (0 = padrão do torch)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    Embeddings LangChain com carga preguiçosa do modelo
+
+    O HuggingFaceEmbeddings só é criado na primeira chamada (ou por
+    warm_up); chamadas concorrentes esperam a mesma carga.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME,
+                 batch_size: int = EMBEDDING_BATCH_SIZE,
+                 num_threads: int = EMBEDDING_THREADS):
+        """
+        Args:
+            model_name: Modelo sentence-transformers
+            batch_size: Textos por chamada ao modelo
+            num_threads: Threads de CPU do PyTorch (0 = padrão)
+        """
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.num_threads = num_threads
+        self._model = None
+        self._lock = threading.Lock()
+        self._warmup_thread: Optional[threading.Thread] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model(self):
+        """HuggingFaceEmbeddings normalizados na CPU (carregado uma vez)"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        if self.num_threads > 0:
+            import torch
+            torch.set_num_threads(self.num_threads)
+
+        print("[*] Carregando modelo de embeddings (primeira vez pode demorar)...")
+        start = time.perf_counter()
+        model = HuggingFaceEmbeddings(
+            model_name=self.model_name,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': self.batch_size}
+        )
+        print(f"[OK] Modelo de embeddings carregado em {time.perf_counter() - start:.1f}s")
+        return model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embeddings de vários textos, em lotes de batch_size"""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.model.embed_documents(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.embed_query(text)
+
+    def warm_up(self, background: bool = True):
+        """
+        Carrega o modelo antes do primeiro uso
+
+        Args:
+            background: Carrega em uma thread de fundo e retorna na hora
+        """
+        if self.loaded:
+            return
+        if not background:
+            self.embed_query("aquecimento")
+            return
+        with self._lock:
+            if self._warmup_thread is not None:
+                return
+            self._warmup_thread = threading.Thread(target=self._warm_up_quietly,
+                                                   name="embeddings-warmup", daemon=True)
+            self._warmup_thread.start()
+
+    def _warm_up_quietly(self):
+        try:
+            self.embed_query("aquecimento")
+        except Exception as e:
+            # A falha reaparece (com o erro completo) no primeiro uso real
+            print(f"[!] Não foi possível pré-carregar os embeddings: {e}")
+
+
+_embeddings: Optional[SharedEmbeddings] = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> SharedEmbeddings:
+    """Embeddings únicos do processo (o modelo carrega no primeiro uso)"""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            _embeddings = SharedEmbeddings()
+        return _embeddings
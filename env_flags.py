@@ -0,0 +1,15 @@
+"""
+Leitura das opções booleanas do .env
+Uma única regra para todos os módulos: 1/true/sim/yes ligam; ausente ou
+vazio usa o padrão da opção
+"""
+
+import os
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    """Lê uma opção booleana do .env (1/true/sim/yes)"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "sim", "yes")
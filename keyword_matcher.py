@@ -0,0 +1,143 @@
+"""
+Matcher de múltiplas palavras-chave
+Compila a lista inteira em um autômato (trie convertida em uma única regex)
+para varrer cada descrição uma só vez, independente do tamanho do léxico
+"""
+
+import re
+import unicodedata
+import pandas as pd
+from typing import Dict, Iterable, List, Optional
+
+
+_WORD_CHAR = re.compile(r'\w')
+# Literal não-raw: os caracteres vão crus para a regex, que assim também
+# funciona no RE2 das strings do Arrow (que não aceita o escape \u)
+_COMBINING_MARKS = '[\u0300-\u036f]'
+
+
+def normalize_text(text: str, ignore_accents: bool = False) -> str:
+    """Minúsculas e, opcionalmente, sem acentos (mágica -> magica)"""
+    text = text.lower()
+    if ignore_accents:
+        text = ''.join(
+            ch for ch in unicodedata.normalize('NFKD', text)
+            if not unicodedata.combining(ch)
+        )
+    return text
+
+
+def load_keywords(path: str) -> List[str]:
+    """
+    Carrega uma lista de palavras-chave de um arquivo texto
+
+    Uma palavra (ou expressão) por linha; linhas vazias e iniciadas
+    por '#' são ignoradas.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[str], whole_words: bool = False,
+                 ignore_accents: bool = False):
+        """
+        Compila o matcher para uma lista de palavras-chave
+
+        Args:
+            keywords: Palavras-chave em ordem de prioridade (a primeira da
+                lista que aparecer no texto é a reportada)
+            whole_words: Só casa palavras inteiras ("arma" não casa "armário")
+            ignore_accents: Ignora acentos no texto e nas palavras-chave
+        """
+        self.whole_words = whole_words
+        self.ignore_accents = ignore_accents
+        self.keywords: List[str] = []
+
+        # Trie: cada nó é um dict de caractere -> nó; a chave None marca o
+        # fim de uma palavra e guarda sua posição na lista
+        self._trie: Dict = {}
+        for keyword in keywords:
+            normalized = normalize_text(keyword.strip(), ignore_accents)
+            if not normalized:
+                continue
+            node = self._trie
+            for ch in normalized:
+                node = node.setdefault(ch, {})
+            if None not in node:
+                node[None] = len(self.keywords)
+                self.keywords.append(keyword)
+
+        core = self._trie_pattern(self._trie) if self.keywords else r'(?!)'
+        if whole_words:
+            self.pattern = re.compile(rf'(?<!\w)(?:{core})(?!\w)')
+            self._overlapping = re.compile(rf'(?<!\w)(?=({core})(?!\w))')
+        else:
+            self.pattern = re.compile(core)
+            self._overlapping = re.compile(rf'(?=({core}))')
+
+    @classmethod
+    def _trie_pattern(cls, node: Dict) -> str:
+        """Converte um nó da trie em regex (alternativas gulosas = mais longa primeiro)"""
+        branches = [
+            re.escape(ch) + cls._trie_pattern(child)
+            for ch, child in sorted((k, v) for k, v in node.items() if k is not None)
+        ]
+        if not branches:
+            return ''
+
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if None in node:
+            pattern = '(?:' + pattern + ')?'
+        return pattern
+
+    def normalize(self, text: str) -> str:
+        """Normaliza um texto com as mesmas regras usadas nas palavras-chave"""
+        return normalize_text(text, self.ignore_accents)
+
+    def normalize_series(self, texts: pd.Series) -> pd.Series:
+        """Versão vetorizada de normalize para uma coluna do DataFrame"""
+        texts = texts.str.lower()
+        if self.ignore_accents:
+            texts = texts.str.normalize('NFKD').str.replace(_COMBINING_MARKS, '', regex=True)
+        return texts
+
+    def first_match(self, text: str) -> Optional[str]:
+        """Palavra-chave de maior prioridade presente no texto (ou None)"""
+        return self._first_match_normalized(self.normalize(text))
+
+    def _first_match_normalized(self, text: str) -> Optional[str]:
+        best = None
+
+        # Em cada posição a regex devolve a palavra mais longa; as palavras que
+        # são prefixos dela saem do caminho percorrido na trie
+        for match in self._overlapping.finditer(text):
+            start = match.start()
+            longest = match.group(1)
+            node = self._trie
+            for length, ch in enumerate(longest, 1):
+                node = node[ch]
+                index = node.get(None)
+                if index is None or (best is not None and index >= best):
+                    continue
+                if self.whole_words and length < len(longest) \
+                        and _WORD_CHAR.match(text, start + length):
+                    continue
+                best = index
+            if best == 0:
+                break
+
+        return None if best is None else self.keywords[best]
+
+    def scan(self, texts: pd.Series) -> pd.Series:
+        """
+        Varre uma coluna de textos
+
+        Returns:
+            Series com a palavra-chave encontrada, apenas para as linhas que
+            casaram (mesmo índice da entrada)
+        """
+        normalized = self.normalize_series(texts)
+        candidates = normalized[normalized.str.contains(self.pattern, na=False)]
+        return candidates.map(self._first_match_normalized).astype(object)
@@ -0,0 +1,221 @@
+"""
+Backends alternativos de LLM para execução offline
+- record: repassa as chamadas à LLM real e grava as respostas em disco
+- replay: responde com as gravações, sem rede e de forma determinística
+- synthetic: gera respostas com latência e velocidade de tokens sorteadas,
+  para medir o throughput do pipeline sem chave de API
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (AIMessage, AIMessageChunk, BaseMessage,
+                                     message_to_dict, messages_from_dict)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from token_budget import count_tokens
+
+
+RECORDINGS_FILE = os.getenv("LLM_RECORDINGS_FILE", ".cache/llm/gravacoes.jsonl")
+
+
+def prompt_key(messages: List[BaseMessage]) -> str:
+    """Chave de uma chamada: hash das mensagens (independe do provedor)"""
+    data = json.dumps([message_to_dict(m) for m in messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _result(message: AIMessage) -> ChatResult:
+    return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class RecordingChatModel(BaseChatModel):
+    """Repassa à LLM real (inner) e acrescenta cada resposta ao arquivo de gravações"""
+
+    inner: BaseChatModel
+    path: str = RECORDINGS_FILE
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {'inner': self.inner._identifying_params}
+
+    def _save(self, messages: List[BaseMessage], response: BaseMessage):
+        record = {'key': prompt_key(messages), 'message': message_to_dict(response)}
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        response = self.inner.invoke(messages, stop=stop, **kwargs)
+        self._save(messages, response)
+        return _result(response)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        response = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+        self._save(messages, response)
+        return _result(response)
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Responde com as gravações feitas pelo RecordingChatModel
+
+    Um prompt sem gravação é um erro (o replay nunca inventa respostas). Se o
+    mesmo prompt foi gravado várias vezes, vale a última gravação.
+    """
+
+    path: str = RECORDINGS_FILE
+
+    _responses: Dict[str, Dict] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, __context: Any) -> None:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(
+                f"Gravações não encontradas em {self.path}. "
+                "Execute antes com LLM_BACKEND=record"
+            )
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._responses[record['key']] = record['message']
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay-chat-model"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        key = prompt_key(messages)
+        if key not in self._responses:
+            raise KeyError(f"Prompt sem gravação (chave {key[:12]}); grave-o com LLM_BACKEND=record")
+        return _result(messages_from_dict([self._responses[key]])[0])
+
+
+class SyntheticChatModel(BaseChatModel):
+    """
+    LLM sintética com latência realista
+
+    Para cada prompt sorteia (de forma determinística, pelo hash do prompt):
+    tempo até o primeiro token (lognormal em torno de ttft_ms), velocidade de
+    geração (normal em torno de tokens_per_second, ±20%) e tamanho da resposta
+    (uniforme entre 50% e 150% de output_tokens). A resposta é um JSON válido
+    nos formatos esperados pelos módulos 2 e 3.
+    """
+
+    ttft_ms: float = 300.0
+    tokens_per_second: float = 250.0
+    output_tokens: int = 200
+
+    @property
+    def _llm_type(self) -> str:
+        return "synthetic-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {'ttft_ms': self.ttft_ms, 'tokens_per_second': self.tokens_per_second,
+                'output_tokens': self.output_tokens}
+
+    def _plan(self, messages: List[BaseMessage]) -> Dict:
+        """Sorteia latência, velocidade e texto da resposta para o prompt"""
+        key = prompt_key(messages)
+        rng = random.Random(key)
+        n_tokens = max(1, int(self.output_tokens * rng.uniform(0.5, 1.5)))
+        filler = " ".join(f"t{rng.randrange(1000)}" for _ in range(n_tokens))
+        content = json.dumps({
+            "violations": [],
+            "conspiracy_found": False,
+            "confidence": "baixa",
+            "evidence": [],
+            "summary": f"resposta sintética {key[:8]}: {filler}"
+        }, ensure_ascii=False)
+        return {
+            'ttft': rng.lognormvariate(0, 0.5) * self.ttft_ms / 1000,
+            'rate': max(1.0, rng.gauss(self.tokens_per_second, 0.2 * self.tokens_per_second)),
+            'content': content,
+            'input_tokens': sum(count_tokens(str(m.content)) for m in messages),
+        }
+
+    @staticmethod
+    def _pieces(content: str, n: int) -> List[str]:
+        """Divide a resposta em n pedaços (um por "token" emitido)"""
+        size = max(1, len(content) // n)
+        return [content[i:i + size] for i in range(0, len(content), size)]
+
+    @staticmethod
+    def _usage(plan: Dict, output_tokens: int) -> Dict:
+        return {'input_tokens': plan['input_tokens'], 'output_tokens': output_tokens,
+                'total_tokens': plan['input_tokens'] + output_tokens}
+
+    def _message(self, plan: Dict) -> AIMessage:
+        output_tokens = count_tokens(plan['content'])
+        return AIMessage(content=plan['content'], usage_metadata=self._usage(plan, output_tokens))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        plan = self._plan(messages)
+        message = self._message(plan)
+        time.sleep(plan['ttft'] + message.usage_metadata['output_tokens'] / plan['rate'])
+        return _result(message)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        plan = self._plan(messages)
+        message = self._message(plan)
+        await asyncio.sleep(plan['ttft'] + message.usage_metadata['output_tokens'] / plan['rate'])
+        return _result(message)
+
+    def _chunks(self, plan: Dict) -> List[AIMessageChunk]:
+        output_tokens = count_tokens(plan['content'])
+        chunks = [AIMessageChunk(content=piece)
+                  for piece in self._pieces(plan['content'], output_tokens)]
+        chunks.append(AIMessageChunk(content="", usage_metadata=self._usage(plan, output_tokens)))
+        return chunks
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        plan = self._plan(messages)
+        time.sleep(plan['ttft'])
+        for chunk in self._chunks(plan):
+            if chunk.content:
+                time.sleep(1 / plan['rate'])
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        plan = self._plan(messages)
+        await asyncio.sleep(plan['ttft'])
+        for chunk in self._chunks(plan):
+            if chunk.content:
+                await asyncio.sleep(1 / plan['rate'])
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
+
+
+def synthetic_from_env() -> SyntheticChatModel:
+    """SyntheticChatModel com os parâmetros do .env"""
+    return SyntheticChatModel(
+        ttft_ms=float(os.getenv("LLM_SYNTHETIC_TTFT_MS", "300")),
+        tokens_per_second=float(os.getenv("LLM_SYNTHETIC_TOKENS_PER_SECOND", "250")),
+        output_tokens=int(os.getenv("LLM_SYNTHETIC_OUTPUT_TOKENS", "200"))
+    )
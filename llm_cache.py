@@ -0,0 +1,167 @@
+"""
+Cache persistente das respostas da LLM
+As chains rodam com temperature=0, então o mesmo prompt para o mesmo modelo
+e parâmetros pode reaproveitar a resposta de uma execução anterior
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+
+LLM_CACHE_DIR = ".cache/llm"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+
+def _generation_to_dict(generation: Generation) -> Dict:
+    if isinstance(generation, ChatGeneration):
+        return {'message': message_to_dict(generation.message)}
+    return {'text': generation.text}
+
+
+def _generation_from_dict(data: Dict) -> Generation:
+    if 'message' in data:
+        return ChatGeneration(message=messages_from_dict([data['message']])[0])
+    return Generation(text=data['text'])
+
+
+class DiskLLMCache(BaseCache):
+    """
+    Cache LangChain em SQLite com remoção LRU
+
+    A chave é o sha256 da configuração da LLM (provedor, modelo e parâmetros,
+    serializados pelo LangChain) junto com o prompt renderizado. Quando o
+    número de entradas passa de max_entries, as menos usadas são removidas.
+    """
+
+    def __init__(self, path: str = os.path.join(LLM_CACHE_DIR, "respostas.sqlite"),
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, bypass: bool = False):
+        """
+        Abre (ou cria) o cache
+
+        Args:
+            path: Arquivo SQLite
+            max_entries: Máximo de respostas guardadas
+            bypass: Ignora as respostas guardadas (sempre consulta a LLM),
+                mas continua gravando as novas
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS respostas ("
+                " chave TEXT PRIMARY KEY,"
+                " llm TEXT NOT NULL,"
+                " geracoes TEXT NOT NULL,"
+                " ultimo_uso REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ultimo_uso ON respostas (ultimo_uso)"
+            )
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode('utf-8')).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Resposta guardada para o prompt (None se não houver)"""
+        if self.bypass:
+            self.misses += 1
+            return None
+
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT geracoes FROM respostas WHERE chave = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            try:
+                generations = [_generation_from_dict(data) for data in json.loads(row[0])]
+            except Exception:
+                # Entrada corrompida ou gravada por outra versão do LangChain:
+                # conta como ausente (a nova resposta a substitui)
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE respostas SET ultimo_uso = ? WHERE chave = ?", (time.time(), key)
+                )
+            self.hits += 1
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Guarda a resposta e remove as entradas menos usadas além do limite"""
+        value = json.dumps([_generation_to_dict(generation) for generation in return_val],
+                           ensure_ascii=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respostas (chave, llm, geracoes, ultimo_uso) "
+                "VALUES (?, ?, ?, ?)",
+                (self._key(prompt, llm_string), llm_string, value, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM respostas WHERE chave IN ("
+                " SELECT chave FROM respostas ORDER BY ultimo_uso DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self, **kwargs: Any) -> None:
+        """Remove todas as respostas guardadas"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM respostas")
+
+    def size(self) -> int:
+        """Número de respostas guardadas"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+
+    def stats(self) -> Dict:
+        """Acertos, falhas e ocupação do cache"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': self.size(),
+            'max_entries': self.max_entries,
+        }
+
+
+_shared_caches: Dict[bool, DiskLLMCache] = {}
+_shared_lock = threading.Lock()
+
+
+def get_llm_cache(bypass: bool = False) -> DiskLLMCache:
+    """
+    Cache compartilhado pelo processo
+
+    Args:
+        bypass: Força respostas novas (as respostas obtidas substituem as
+            guardadas); usa o mesmo arquivo, com contadores separados
+    """
+    with _shared_lock:
+        if bypass not in _shared_caches:
+            _shared_caches[bypass] = DiskLLMCache(bypass=bypass)
+        return _shared_caches[bypass]
+
+
+def active_llm_cache() -> Optional[DiskLLMCache]:
+    """Cache compartilhado (sem bypass), se alguma LLM já o usou neste processo"""
+    return _shared_caches.get(False, _shared_caches.get(True))
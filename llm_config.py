@@ -2,25 +2,207 @@
 Configuração centralizada de LLM
 Usa Groq por padrão (grátis e rápido), fallback para OpenAI
 """
+import json
 import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
+from env_flags import env_flag
+
 load_dotenv()
 
-def get_llm():
-    """Retorna LLM configurado"""
+# Máximo de chamadas simultâneas à LLM quando vários prompts são enviados em lote
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+
+# Conexões HTTP mantidas abertas (keep-alive) por cliente da LLM
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+
+# Origens de resposta que não chamam a API (não precisam de chave)
+OFFLINE_BACKENDS = ("replay", "synthetic")
+
+# Uma instância por provedor/modelo/parâmetros, compartilhada pelo processo
+_llm_registry: Dict[Tuple, object] = {}
+_registry_lock = threading.RLock()
+
+# Clientes httpx criados para as instâncias registradas (fechados no fim)
+_http_client_pool: List = []
+
+
+def _response_cache(bypass_cache: bool):
+    """Cache em disco das respostas (LLM_CACHE=0 desativa)"""
+    if not env_flag("LLM_CACHE", default=True):
+        return None
+    from llm_cache import get_llm_cache
+    return get_llm_cache(bypass=bypass_cache or env_flag("LLM_CACHE_BYPASS"))
+
+
+def _http_clients() -> Dict:
+    """
+    Clientes httpx (síncrono e assíncrono) com pool de conexões keep-alive
     
-    # Tentar Groq primeiro (grátis e rápido)
+    O cliente assíncrono fica preso ao event loop em que é usado pela primeira
+    vez; as chamadas assíncronas do projeto rodam no loop do LLMExecutor.
+    """
+    import httpx
+    
+    limits = httpx.Limits(
+        max_connections=LLM_POOL_SIZE,
+        max_keepalive_connections=LLM_POOL_SIZE,
+        keepalive_expiry=120
+    )
+    timeout = httpx.Timeout(120.0, connect=10.0)
+    clients = {
+        'http_client': httpx.Client(limits=limits, timeout=timeout),
+        'http_async_client': httpx.AsyncClient(limits=limits, timeout=timeout)
+    }
+    with _registry_lock:
+        _http_client_pool.extend(clients.values())
+    return clients
+
+
+def _shared_llm(key: Tuple, factory: Callable):
+    """Instância registrada para key (criada uma única vez, mesmo entre threads)"""
+    with _registry_lock:
+        llm = _llm_registry.get(key)
+        if llm is None:
+            llm = factory()
+            _llm_registry[key] = llm
+        return llm
+
+
+def close_llm_clients():
+    """
+    Fecha os clientes httpx (síncronos e assíncronos) e esvazia o registro
+    
+    Os assíncronos são fechados no loop do LLMExecutor, onde foram usados.
+    """
+    with _registry_lock:
+        clients = list(_http_client_pool)
+        _http_client_pool.clear()
+        _llm_registry.clear()
+    if not clients:
+        return
+    
+    from llm_executor import run_sync
+    for client in clients:
+        if hasattr(client, 'aclose'):
+            run_sync(client.aclose())
+        else:
+            client.close()
+
+
+def _groq_llm(cache):
+    """ChatGroq compartilhado (GROQ_BASE_URL aponta para outro servidor, ex: stub local)"""
+    from langchain_groq import ChatGroq
+    
+    def create():
+        print("[*] Usando Groq (Llama 3.3 70B)")
+        return ChatGroq(
+            model="llama-3.3-70b-versatile",
+            temperature=0,
+            max_tokens=8000,
+            cache=cache,
+            **_http_clients()
+        )
+    
+    return _shared_llm(("groq", "llama-3.3-70b-versatile", 0, 8000, id(cache)), create)
+
+
+def _openai_llm(cache):
+    """ChatOpenAI compartilhado (OPENAI_BASE_URL aponta para outro servidor)"""
+    from langchain_openai import ChatOpenAI
+    
+    def create():
+        print("[*] Usando OpenAI (GPT-4o-mini)")
+        return ChatOpenAI(
+            model="gpt-4o-mini",
+            temperature=0,
+            cache=cache,
+            **_http_clients()
+        )
+    
+    return _shared_llm(("openai", "gpt-4o-mini", 0, None, id(cache)), create)
+
+
+def _routed_llm(cache):
+    """Groq e OpenAI atrás do roteador com circuit breaker (o cache fica no roteador)"""
+    from llm_router import RoutedChatModel
+    
+    def create():
+        print("[*] Roteando entre Groq e OpenAI (latência e circuit breaker)")
+        return RoutedChatModel(
+            backends={'groq': _groq_llm(None), 'openai': _openai_llm(None)},
+            hedge=env_flag("LLM_HEDGE"),
+            hedge_after_seconds=float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "10")),
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "3")),
+            cooldown_seconds=float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30")),
+            cache=cache
+        )
+    
+    return _shared_llm(("router", id(cache)), create)
+
+
+def _offline_llm(backend: str):
+    """LLM sem rede: replay das gravações ou sintética"""
+    from llm_backends import ReplayChatModel, synthetic_from_env
+    
+    def create():
+        print(f"[*] Usando LLM offline ({backend})")
+        return ReplayChatModel() if backend == "replay" else synthetic_from_env()
+    
+    return _shared_llm((backend,), create)
+
+
+def get_llm(bypass_cache: bool = False):
+    """
+    Retorna LLM configurado
+    
+    Args:
+        bypass_cache: Ignora as respostas guardadas no cache em disco e
+            consulta a LLM (as novas respostas substituem as antigas)
+    
+    Chamadas com a mesma configuração retornam a mesma instância, que reusa
+    as conexões HTTP (sem novo handshake TLS a cada módulo). Com as duas
+    chaves e LLM_ROUTING=1, retorna o roteador entre Groq e OpenAI.
+    
+    LLM_BACKEND escolhe a origem das respostas: live (padrão), record (LLM
+    real + gravação em disco), replay (gravações) ou synthetic; replay e
+    synthetic não precisam de chave nem usam o cache de respostas.
+    """
+    backend = llm_backend()
+    if backend in OFFLINE_BACKENDS:
+        return _offline_llm(backend)
+    
+    llm = _live_llm(_response_cache(bypass_cache))
+    if backend == "record":
+        from llm_backends import RecordingChatModel
+        return _shared_llm(("record", id(llm)), lambda: RecordingChatModel(inner=llm))
+    if backend != "live":
+        print(f"[!] LLM_BACKEND desconhecido: {backend} - usando live")
+    return llm
+
+
+def llm_backend() -> str:
+    """Origem das respostas configurada em LLM_BACKEND (padrão: live)"""
+    return os.getenv("LLM_BACKEND", "live").strip().lower()
+
+
+def _live_llm(cache):
+    """Groq, OpenAI ou o roteador entre os dois, conforme as chaves configuradas"""
     groq_key = os.getenv("GROQ_API_KEY")
+    openai_key = os.getenv("OPENAI_API_KEY")
+    
+    if groq_key and openai_key and env_flag("LLM_ROUTING"):
+        try:
+            return _routed_llm(cache)
+        except ImportError as e:
+            print(f"[!] Roteamento indisponível ({e}) - usando um provedor só")
+    
+    # Tentar Groq primeiro (grátis e rápido)
     if groq_key:
         try:
-            from langchain_groq import ChatGroq
-            print("[*] Usando Groq (Llama 3.3 70B)")
-            return ChatGroq(
-                model="llama-3.3-70b-versatile",
-                temperature=0,
-                max_tokens=8000
-            )
+            return _groq_llm(cache)
         except ImportError:
             print("[!] langchain-groq não instalado")
             print("[!] Execute: pip install langchain-groq")
@@ -28,16 +210,48 @@ def get_llm():
             print(f"[!] Erro ao conectar Groq: {e}")
     
     # Fallback para OpenAI
-    openai_key = os.getenv("OPENAI_API_KEY")
     if openai_key:
-        from langchain_openai import ChatOpenAI
-        print("[*] Usando OpenAI (GPT-4o-mini)")
-        return ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0
-        )
+        return _openai_llm(cache)
     
     raise ValueError(
         "Nenhuma API key configurada!\n"
         "Configure GROQ_API_KEY ou OPENAI_API_KEY no arquivo .env"
-    )
\ No newline at end of file
+    )
+
+
+def get_provider(runnable) -> str:
+    """
+    Provedor ('groq', 'openai', 'offline', 'router' ou 'default') de uma LLM
+    ou de uma chain que a contém
+    """
+    for step in getattr(runnable, 'steps', None) or [runnable]:
+        inner = getattr(step, 'inner', None)
+        if inner is not None:
+            return get_provider(inner)
+        name = type(step).__name__.lower()
+        if 'synthetic' in name or 'replay' in name:
+            return 'offline'
+        if 'routed' in name:
+            return 'router'
+        if 'groq' in name:
+            return 'groq'
+        if 'openai' in name:
+            return 'openai'
+    return 'default'
+
+
+def parse_json_response(text: str) -> Optional[dict]:
+    """
+    Extrai o objeto JSON de uma resposta da LLM
+
+    Aceita respostas com texto em volta ou dentro de blocos ```json.
+    Retorna None se não houver um JSON válido.
+    """
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
@@ -0,0 +1,306 @@
+"""
+Camada de execução assíncrona das chamadas à LLM
+Limita requisições/tokens por minuto por provedor (token bucket), repete
+chamadas que falham com 429/5xx (backoff exponencial com jitter) e limita
+quantas chamadas ficam em andamento ao mesmo tempo
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from llm_config import LLM_MAX_CONCURRENCY, get_provider
+from llm_telemetry import telemetry
+from token_budget import count_tokens
+
+
+# Limites padrão por provedor (plano grátis da Groq, tier 1 da OpenAI).
+# Podem ser ajustados com <PROVEDOR>_RPM e <PROVEDOR>_TPM (ex: GROQ_TPM=6000).
+PROVIDER_LIMITS = {
+    'groq': {'rpm': 30, 'tpm': 12_000},
+    'openai': {'rpm': 500, 'tpm': 200_000},
+    'default': {'rpm': 60, 'tpm': 100_000},
+    # Backends locais (replay/sintético): sem limite prático
+    'offline': {'rpm': 1_000_000, 'tpm': 1_000_000_000},
+    # Roteador: os limites de cada backend são aplicados dentro dele
+    'router': {'rpm': 1_000_000, 'tpm': 1_000_000_000},
+}
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+# Tokens reservados para a resposta antes de saber o tamanho real
+COMPLETION_TOKENS_ESTIMATE = 512
+
+_TRANSIENT_ERRORS = {'APIConnectionError', 'APITimeoutError', 'ConnectError',
+                     'ConnectTimeout', 'ReadTimeout', 'RemoteProtocolError'}
+
+
+class TokenBucket:
+    """
+    Balde de fichas reabastecido continuamente (capacity por minuto)
+
+    Funciona por reserva: quem pede fichas sempre as recebe, e o saldo pode
+    ficar negativo; o retorno é quanto tempo esperar até o saldo cobrir o
+    pedido. Assim os pedidos são atendidos em ordem de chegada, sem depender
+    do event loop de quem chama.
+    """
+
+    def __init__(self, capacity: float, period_seconds: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period_seconds
+        self.level = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Reserva amount fichas e retorna os segundos de espera"""
+        with self._lock:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, delta: float):
+        """Corrige uma reserva depois do uso real (delta > 0 consome mais)"""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - delta)
+
+
+class ProviderLimiter:
+    def __init__(self, rpm: int, tpm: int):
+        """
+        Limites de um provedor
+
+        Args:
+            rpm: Requisições por minuto
+            tpm: Tokens (prompt + resposta) por minuto
+        """
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def reserve(self, tokens: int) -> float:
+        """Reserva uma requisição de ~tokens e retorna os segundos de espera"""
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+    async def acquire(self, tokens: int):
+        """Espera até que uma requisição de ~tokens caiba nos dois limites"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """Limitador compartilhado por todo o processo para um provedor"""
+    with _limiters_lock:
+        if provider not in _limiters:
+            limits = PROVIDER_LIMITS.get(provider, PROVIDER_LIMITS['default'])
+            prefix = provider.upper()
+            _limiters[provider] = ProviderLimiter(
+                rpm=int(os.getenv(f"{prefix}_RPM", limits['rpm'])),
+                tpm=int(os.getenv(f"{prefix}_TPM", limits['tpm']))
+            )
+        return _limiters[provider]
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    """Status HTTP de um erro dos SDKs (openai/groq/httpx), se houver"""
+    code = getattr(exc, 'status_code', None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, 'response', None)
+    code = getattr(response, 'status_code', None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Erros temporários: limite de taxa (429), erro do servidor (5xx) ou rede"""
+    code = _status_code(exc)
+    if code is not None:
+        return code == 429 or code >= 500
+    return type(exc).__name__ in _TRANSIENT_ERRORS
+
+
+def _retry_after(exc: BaseException) -> float:
+    """Espera pedida pelo provedor no cabeçalho Retry-After (segundos)"""
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _with_telemetry(config: Optional[Dict]) -> Dict:
+    """Garante o handler de telemetria entre os callbacks da chamada"""
+    config = dict(config or {})
+    callbacks = list(config.get('callbacks') or [])
+    if telemetry not in callbacks:
+        callbacks.append(telemetry)
+    config['callbacks'] = callbacks
+    return config
+
+
+def _usage_tokens(result: Any) -> Optional[int]:
+    """Tokens efetivamente usados, quando a resposta informa"""
+    usage = getattr(result, 'usage_metadata', None)
+    if usage:
+        return usage.get('total_tokens')
+    return None
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Event loop em uma thread própria, usado pelas chamadas síncronas"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-executor",
+                             daemon=True).start()
+        return _loop
+
+
+def run_sync(coro):
+    """Executa uma coroutine no loop de fundo e espera o resultado"""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+class LLMExecutor:
+    def __init__(self, runnable, provider: Optional[str] = None,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 prompt_overhead: int = 0):
+        """
+        Envolve uma chain (ou LLM) com limites de taxa, retry e concorrência
+
+        Args:
+            runnable: Chain LangChain (ex: prompt | get_llm())
+            provider: 'groq', 'openai'... (detectado na chain se omitido)
+            max_concurrency: Chamadas em andamento ao mesmo tempo
+            max_retries: Novas tentativas em erros temporários
+            prompt_overhead: Tokens que o input não mostra (ex: documentos
+                recuperados pelo RAG), somados à estimativa de cada chamada
+        """
+        self.runnable = runnable
+        self.provider = provider or get_provider(runnable)
+        self.limiter = get_limiter(self.provider)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.prompt_overhead = prompt_overhead
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    def estimate_tokens(self, input: Any) -> int:
+        """Tokens estimados da chamada: prompt renderizado + resposta"""
+        first = getattr(self.runnable, 'first', None)
+        try:
+            text = first.invoke(input).to_string() if first is not None else str(input)
+        except Exception:
+            text = str(input)
+        return count_tokens(text) + self.prompt_overhead + COMPLETION_TOKENS_ESTIMATE
+
+    async def ainvoke(self, input: Any, config: Optional[Dict] = None) -> Any:
+        """Versão assíncrona de invoke, respeitando os limites do provedor"""
+        config = _with_telemetry(config)
+        estimate = self.estimate_tokens(input)
+        async with self._semaphore():
+            for attempt in range(self.max_retries + 1):
+                await self.limiter.acquire(estimate)
+                try:
+                    result = await self.runnable.ainvoke(input, config)
+                except Exception as e:
+                    if attempt == self.max_retries or not is_retryable(e):
+                        raise
+                    # Backoff exponencial com "full jitter"
+                    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS,
+                                                  BACKOFF_BASE_SECONDS * 2 ** attempt))
+                    delay = max(delay, _retry_after(e))
+                    print(f"[!] {self.provider}: {type(e).__name__} - nova tentativa "
+                          f"em {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                    await asyncio.sleep(delay)
+                    continue
+
+                used = _usage_tokens(result)
+                if used is not None:
+                    self.limiter.tokens.adjust(used - estimate)
+                return result
+
+    async def abatch(self, inputs: List[Any],
+                     config: Optional[Union[Dict, List[Dict]]] = None,
+                     return_exceptions: bool = False) -> List[Any]:
+        """
+        Executa vários inputs em paralelo (até max_concurrency por vez)
+
+        Os resultados seguem a ordem dos inputs; com return_exceptions=True,
+        uma chamada que falhou devolve a exceção em vez de interromper o lote.
+        """
+        configs = config if isinstance(config, list) else [config] * len(inputs)
+        return await asyncio.gather(
+            *(self.ainvoke(item, cfg) for item, cfg in zip(inputs, configs)),
+            return_exceptions=return_exceptions
+        )
+
+    def invoke(self, input: Any, config: Optional[Dict] = None) -> Any:
+        """Chamada síncrona (executada no loop de fundo)"""
+        return run_sync(self.ainvoke(input, config))
+
+    def stream(self, input: Any, config: Optional[Dict] = None) -> Iterator[Any]:
+        """
+        Chamada síncrona em streaming: gera os pedaços da resposta à medida
+        que chegam
+        
+        Respeita os limites do provedor; erros temporários só são repetidos
+        enquanto nenhum pedaço foi entregue (depois disso a exceção sobe).
+        """
+        config = _with_telemetry(config)
+        estimate = self.estimate_tokens(input)
+        for attempt in range(self.max_retries + 1):
+            wait = self.limiter.reserve(estimate)
+            if wait > 0:
+                time.sleep(wait)
+            started, used = False, None
+            try:
+                for chunk in self.runnable.stream(input, config):
+                    started = True
+                    used = _usage_tokens(chunk) or used
+                    yield chunk
+                if used is not None:
+                    self.limiter.tokens.adjust(used - estimate)
+                return
+            except Exception as e:
+                if started or attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS,
+                                              BACKOFF_BASE_SECONDS * 2 ** attempt))
+                delay = max(delay, _retry_after(e))
+                print(f"[!] {self.provider}: {type(e).__name__} - nova tentativa "
+                      f"em {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+
+    def batch(self, inputs: List[Any],
+              config: Optional[Union[Dict, List[Dict]]] = None,
+              return_exceptions: bool = False) -> List[Any]:
+        """Versão síncrona de abatch"""
+        return run_sync(self.abatch(inputs, config, return_exceptions))
@@ -0,0 +1,419 @@
+"""
+Roteamento entre provedores de LLM
+Mede latência e taxa de erro de cada backend (Groq, OpenAI...), abre um
+circuit breaker quando um deles falha seguidamente e envia cada chamada ao
+backend mais saudável, com requisição "hedged" opcional após o p95. Os
+limites de requisições/tokens por minuto valem por backend
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage, BaseMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from llm_executor import COMPLETION_TOKENS_ESTIMATE, _usage_tokens, get_limiter
+from token_budget import count_tokens
+
+
+CLOSED, OPEN, HALF_OPEN = 'fechado', 'aberto', 'meio-aberto'
+
+# Threads das requisições hedged (a primeira resposta vence; a outra termina
+# em segundo plano só para alimentar as estatísticas)
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+
+class BackendStats:
+    """Janela móvel das últimas chamadas de um backend"""
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+
+    def add(self, latency: float, ok: bool):
+        self.samples.append((latency, ok))
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def latency(self, quantile: float) -> Optional[float]:
+        """Quantil da latência das chamadas bem-sucedidas (None sem dados)"""
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(quantile * len(latencies)))]
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        """
+        Circuit breaker de um backend
+
+        Args:
+            failure_threshold: Falhas seguidas que abrem o circuito
+            cooldown_seconds: Tempo aberto antes de liberar uma chamada de teste
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.trial_started = 0.0
+
+    def available(self) -> bool:
+        """Como allow, mas sem reservar a chamada de teste (usado para ordenar)"""
+        now = time.monotonic()
+        if self.state == OPEN:
+            return now - self.opened_at >= self.cooldown_seconds
+        if self.state == HALF_OPEN:
+            return not (self.trial_in_flight and now - self.trial_started < self.cooldown_seconds)
+        return True
+
+    def allow(self) -> bool:
+        """Indica se o backend pode receber uma chamada agora (e reserva a de teste)"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            self.state = HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == HALF_OPEN:
+            # Uma chamada de teste por vez (liberada de novo se a anterior
+            # nunca chegou a ser feita)
+            now = time.monotonic()
+            if self.trial_in_flight and now - self.trial_started < self.cooldown_seconds:
+                return False
+            self.trial_in_flight = True
+            self.trial_started = now
+            return True
+        return self.state == CLOSED
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def failure(self, error_rate: float, samples: int):
+        self.failures += 1
+        self.trial_in_flight = False
+        sustained = samples >= 10 and error_rate >= 0.5
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold or sustained:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+
+class BackendUnavailable(RuntimeError):
+    """O backend escolhido deixou de aceitar chamadas (circuito aberto ou em teste)"""
+
+
+def _estimate_tokens(messages: List[BaseMessage]) -> int:
+    """Tokens estimados de uma chamada: mensagens + resposta"""
+    return sum(count_tokens(str(m.content)) for m in messages) + COMPLETION_TOKENS_ESTIMATE
+
+
+def _as_chunk(message: BaseMessage) -> BaseMessageChunk:
+    """
+    Pedaço de streaming de uma mensagem (backends sem streaming próprio
+    devolvem a resposta inteira como uma AIMessage)
+    """
+    if isinstance(message, BaseMessageChunk):
+        return message
+    return AIMessageChunk(content=message.content,
+                          response_metadata=message.response_metadata,
+                          usage_metadata=getattr(message, 'usage_metadata', None),
+                          id=message.id)
+
+
+class RoutedChatModel(BaseChatModel):
+    """
+    Chat model que distribui as chamadas entre vários backends
+
+    A ordem de tentativa é recalculada a cada chamada: backends com circuito
+    aberto ficam de fora (se todos estiverem abertos, todos são tentados) e os
+    demais são ordenados pela latência mediana penalizada pela taxa de erro.
+    Se um backend falha, o próximo é tentado na mesma chamada.
+
+    Cada backend passa pelo limitador do seu provedor (get_limiter com o
+    nome do backend), então os limites da Groq valem mesmo atrás do roteador.
+    """
+
+    backends: Dict[str, BaseChatModel]
+    hedge: bool = False
+    hedge_after_seconds: float = 10.0
+    failure_threshold: int = 3
+    cooldown_seconds: float = 30.0
+    window: int = 50
+
+    _stats: Dict[str, BackendStats] = PrivateAttr(default_factory=dict)
+    _breakers: Dict[str, CircuitBreaker] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any) -> None:
+        for name in self.backends:
+            self._stats[name] = BackendStats(self.window)
+            self._breakers[name] = CircuitBreaker(self.failure_threshold, self.cooldown_seconds)
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {name: backend._identifying_params for name, backend in self.backends.items()}
+
+    def health(self) -> Dict[str, Dict]:
+        """Estado atual de cada backend (circuito, erros, latências)"""
+        with self._lock:
+            return {
+                name: {
+                    'circuito': self._breakers[name].state,
+                    'taxa_erro': stats.error_rate(),
+                    'p50': stats.latency(0.5),
+                    'p95': stats.latency(0.95),
+                    'chamadas': len(stats.samples),
+                }
+                for name, stats in self._stats.items()
+            }
+
+    def _order(self) -> List[str]:
+        """Backends em ordem de tentativa para a próxima chamada"""
+        with self._lock:
+            names = list(self.backends)
+            available = [name for name in names if self._breakers[name].available()]
+            if not available:
+                return names
+
+            def score(name):
+                stats = self._stats[name]
+                # Sem medições: latência 0, para que o backend seja experimentado
+                return (stats.latency(0.5) or 0.0) * (1 + 4 * stats.error_rate())
+
+            return sorted(available, key=score)
+
+    def _claim(self, name: str):
+        """
+        Reserva a chamada no circuit breaker do backend que vai ser chamado
+
+        Só aqui a chamada de teste de um circuito meio-aberto é ocupada. Se
+        nenhum backend estiver disponível, a chamada segue assim mesmo (como
+        em _order, todos são tentados).
+        """
+        with self._lock:
+            breaker = self._breakers[name]
+            if breaker.allow() or not any(b.available() for b in self._breakers.values()):
+                return
+        raise BackendUnavailable(f"Backend {name} indisponível (circuito {breaker.state})")
+
+    def _record(self, name: str, latency: float, ok: bool):
+        with self._lock:
+            stats = self._stats[name]
+            stats.add(latency, ok)
+            if ok:
+                self._breakers[name].success()
+            else:
+                self._breakers[name].failure(stats.error_rate(), len(stats.samples))
+                print(f"[!] Backend {name} falhou (circuito {self._breakers[name].state})")
+
+    def _hedge_delay(self, name: str) -> float:
+        """p95 do backend (hedge_after_seconds enquanto houver poucas medições)"""
+        with self._lock:
+            stats = self._stats[name]
+            p95 = stats.latency(0.95) if len(stats.samples) >= 5 else None
+        return p95 if p95 is not None else self.hedge_after_seconds
+
+    def _throttle(self, name: str, tokens: int) -> float:
+        """Reserva a chamada no limitador do backend e retorna a espera em segundos"""
+        return get_limiter(name).reserve(tokens)
+
+    def _settle(self, name: str, tokens: int, message):
+        """Corrige a reserva de tokens com o uso informado na resposta"""
+        used = _usage_tokens(message)
+        if used is not None:
+            get_limiter(name).tokens.adjust(used - tokens)
+
+    def _timed(self, name: str, call: Callable[[BaseChatModel], BaseMessage],
+               tokens: int) -> BaseMessage:
+        self._claim(name)
+        time.sleep(self._throttle(name, tokens))
+        start = time.monotonic()
+        try:
+            message = call(self.backends[name])
+        except Exception:
+            self._record(name, time.monotonic() - start, False)
+            raise
+        self._record(name, time.monotonic() - start, True)
+        self._settle(name, tokens, message)
+        return message
+
+    def _hedged(self, primary: str, secondary: str,
+                call: Callable[[BaseChatModel], BaseMessage], tokens: int) -> BaseMessage:
+        """Chama primary; se passar do p95 dele, dispara secondary também"""
+        delay = self._hedge_delay(primary)
+        first = _HEDGE_POOL.submit(self._timed, primary, call, tokens)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeout:
+            print(f"[*] {primary} passou de {delay:.1f}s - disparando {secondary} em paralelo")
+        except Exception:
+            return self._timed(secondary, call, tokens)
+
+        second = _HEDGE_POOL.submit(self._timed, secondary, call, tokens)
+        errors = []
+        for future in as_completed([first, second]):
+            try:
+                return future.result()
+            except Exception as e:
+                errors.append(e)
+        raise errors[-1]
+
+    def _route(self, call: Callable[[BaseChatModel], BaseMessage], tokens: int) -> BaseMessage:
+        order = self._order()
+        last_error = None
+        i = 0
+        while i < len(order):
+            try:
+                if self.hedge and i + 1 < len(order):
+                    return self._hedged(order[i], order[i + 1], call, tokens)
+                return self._timed(order[i], call, tokens)
+            except Exception as e:
+                last_error = e
+                i += 2 if self.hedge and i + 1 < len(order) else 1
+        raise last_error
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        message = self._route(lambda backend: backend.invoke(messages, stop=stop, **kwargs),
+                              _estimate_tokens(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _atimed(self, name: str, call, tokens: int) -> BaseMessage:
+        self._claim(name)
+        await asyncio.sleep(self._throttle(name, tokens))
+        start = time.monotonic()
+        try:
+            message = await call(self.backends[name])
+        except Exception:
+            self._record(name, time.monotonic() - start, False)
+            raise
+        self._record(name, time.monotonic() - start, True)
+        self._settle(name, tokens, message)
+        return message
+
+    async def _ahedged(self, primary: str, secondary: str, call, tokens: int) -> BaseMessage:
+        delay = self._hedge_delay(primary)
+        first = asyncio.ensure_future(self._atimed(primary, call, tokens))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            if first.exception() is None:
+                return first.result()
+            return await self._atimed(secondary, call, tokens)
+
+        print(f"[*] {primary} passou de {delay:.1f}s - disparando {secondary} em paralelo")
+        second = asyncio.ensure_future(self._atimed(secondary, call, tokens))
+        pending, errors = {first, second}, []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    # A outra requisição termina sozinha; o resultado é descartado
+                    for other in pending:
+                        other.add_done_callback(lambda t: t.cancelled() or t.exception())
+                    return task.result()
+                errors.append(task.exception())
+        raise errors[-1]
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        def call(backend):
+            return backend.ainvoke(messages, stop=stop, **kwargs)
+
+        tokens = _estimate_tokens(messages)
+        order = self._order()
+        last_error = None
+        i = 0
+        while i < len(order):
+            hedged = self.hedge and i + 1 < len(order)
+            try:
+                if hedged:
+                    message = await self._ahedged(order[i], order[i + 1], call, tokens)
+                else:
+                    message = await self._atimed(order[i], call, tokens)
+                return ChatResult(generations=[ChatGeneration(message=message)])
+            except Exception as e:
+                last_error = e
+                i += 2 if hedged else 1
+        raise last_error
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        """
+        Streaming pelo primeiro backend disponível (sem hedging)
+
+        Se o backend falhar antes do primeiro pedaço, o próximo é tentado;
+        depois que a resposta começou a chegar, o erro sobe.
+        """
+        tokens = _estimate_tokens(messages)
+        last_error = None
+        for name in self._order():
+            try:
+                self._claim(name)
+            except BackendUnavailable as e:
+                last_error = e
+                continue
+            time.sleep(self._throttle(name, tokens))
+            start, started, used = time.monotonic(), False, None
+            try:
+                for chunk in self.backends[name].stream(messages, stop=stop, **kwargs):
+                    started = True
+                    used = _usage_tokens(chunk) or used
+                    if run_manager and chunk.content:
+                        run_manager.on_llm_new_token(chunk.content)
+                    yield ChatGenerationChunk(message=_as_chunk(chunk))
+            except Exception as e:
+                self._record(name, time.monotonic() - start, False)
+                if started:
+                    raise
+                last_error = e
+                continue
+            self._record(name, time.monotonic() - start, True)
+            if used is not None:
+                get_limiter(name).tokens.adjust(used - tokens)
+            return
+        raise last_error
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        """Versão assíncrona de _stream"""
+        tokens = _estimate_tokens(messages)
+        last_error = None
+        for name in self._order():
+            try:
+                self._claim(name)
+            except BackendUnavailable as e:
+                last_error = e
+                continue
+            await asyncio.sleep(self._throttle(name, tokens))
+            start, started, used = time.monotonic(), False, None
+            try:
+                async for chunk in self.backends[name].astream(messages, stop=stop, **kwargs):
+                    started = True
+                    used = _usage_tokens(chunk) or used
+                    if run_manager and chunk.content:
+                        await run_manager.on_llm_new_token(chunk.content)
+                    yield ChatGenerationChunk(message=_as_chunk(chunk))
+            except Exception as e:
+                self._record(name, time.monotonic() - start, False)
+                if started:
+                    raise
+                last_error = e
+                continue
+            self._record(name, time.monotonic() - start, True)
+            if used is not None:
+                get_limiter(name).tokens.adjust(used - tokens)
+            return
+        raise last_error
@@ -0,0 +1,204 @@
+"""
+Telemetria das chamadas à LLM
+Registra, por chamada, tokens do prompt e da resposta, tempo até o primeiro
+token, latência total e custo estimado, marcados com módulo e etapa
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# Preço (USD por milhão de tokens: prompt, resposta) dos modelos usados
+MODEL_PRICES = {
+    'llama-3.3-70b-versatile': (0.59, 0.79),
+    'gpt-4o-mini': (0.15, 0.60),
+}
+
+
+def _percentile(values: List[float], quantile: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+
+class TelemetryHandler(BaseCallbackHandler):
+    """
+    Callback do LangChain que mede cada chamada de chat model
+
+    O módulo e a etapa vêm do metadata do config da chamada, por exemplo
+    chain.invoke(input, config={"metadata": {"module": "modulo2", "stage": "analise"}}).
+    Chamadas aninhadas (um chat model chamando outro, como no roteador) são
+    contadas uma vez só, pela chamada externa.
+    """
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._active: Dict[UUID, Dict] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, parent_run_id: Optional[UUID] = None,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        params = kwargs.get('invocation_params') or {}
+        with self._lock:
+            if parent_run_id in self._active:
+                return
+            self._active[run_id] = {
+                'module': metadata.get('module', 'desconhecido'),
+                'stage': metadata.get('stage', 'desconhecida'),
+                'model': (metadata.get('ls_model_name') or params.get('model')
+                          or params.get('model_name') or params.get('_type', '')),
+                'start': time.perf_counter(),
+                'first_token': None,
+            }
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            call = self._active.get(run_id)
+            if call is not None and call['first_token'] is None:
+                call['first_token'] = time.perf_counter()
+
+    @staticmethod
+    def _usage(response) -> Dict:
+        """Tokens de prompt/resposta (usage_metadata ou llm_output do provedor)"""
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if usage:
+                    return {'prompt_tokens': usage.get('input_tokens', 0),
+                            'completion_tokens': usage.get('output_tokens', 0)}
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        return {'prompt_tokens': usage.get('prompt_tokens', 0),
+                'completion_tokens': usage.get('completion_tokens', 0)}
+
+    def _finish(self, run_id: UUID, usage: Dict, error: Optional[str]):
+        end = time.perf_counter()
+        with self._lock:
+            call = self._active.pop(run_id, None)
+            if call is None:
+                return
+            prompt_price, completion_price = MODEL_PRICES.get(call['model'], (0.0, 0.0))
+            self.records.append({
+                'timestamp': time.time(),
+                'module': call['module'],
+                'stage': call['stage'],
+                'model': call['model'],
+                'prompt_tokens': usage['prompt_tokens'],
+                'completion_tokens': usage['completion_tokens'],
+                'ttft_s': (call['first_token'] - call['start']) if call['first_token'] else None,
+                'latency_s': end - call['start'],
+                'cost_usd': (usage['prompt_tokens'] * prompt_price
+                             + usage['completion_tokens'] * completion_price) / 1_000_000,
+                'error': error,
+            })
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, self._usage(response), None)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, {'prompt_tokens': 0, 'completion_tokens': 0}, type(error).__name__)
+
+    def _groups(self) -> Dict:
+        groups = defaultdict(list)
+        with self._lock:
+            for record in self.records:
+                groups[(record['module'], record['stage'], record['model'])].append(record)
+        return groups
+
+    def summary_lines(self) -> List[str]:
+        """Tabela por módulo/etapa/modelo para o relatório"""
+        groups = self._groups()
+        if not groups:
+            return ["Nenhuma chamada à LLM registrada."]
+
+        lines = [
+            f"{'Módulo/etapa':<32} {'Chamadas':>8} {'Tokens in':>10} {'Tokens out':>10} "
+            f"{'Lat. média':>10} {'Lat. p95':>9} {'TTFT':>7} {'Custo US$':>10}",
+        ]
+        total_cost = 0.0
+        for (module, stage, model), records in sorted(groups.items()):
+            latencies = [r['latency_s'] for r in records]
+            ttfts = [r['ttft_s'] for r in records if r['ttft_s'] is not None]
+            cost = sum(r['cost_usd'] for r in records)
+            total_cost += cost
+            errors = sum(1 for r in records if r['error'])
+            label = f"{module}/{stage}"
+            lines.append(
+                f"{label:<32} {len(records):>8} "
+                f"{sum(r['prompt_tokens'] for r in records):>10} "
+                f"{sum(r['completion_tokens'] for r in records):>10} "
+                f"{sum(latencies) / len(latencies):>9.2f}s {_percentile(latencies, 0.95):>8.2f}s "
+                f"{(f'{sum(ttfts) / len(ttfts):.2f}s' if ttfts else '-'):>7} {cost:>10.4f}"
+            )
+            lines.append(f"    modelo: {model}" + (f" | erros: {errors}" if errors else ""))
+        lines.append(f"Custo total estimado: US$ {total_cost:.4f}")
+        return lines
+
+    def export_jsonl(self, path: str):
+        """Uma linha JSON por chamada"""
+        with self._lock:
+            records = list(self.records)
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def export_prometheus(self, path: str):
+        """Métricas agregadas no formato texto do Prometheus"""
+        metrics = [
+            ('llm_calls_total', 'counter', 'Chamadas à LLM', lambda rs: len(rs)),
+            ('llm_errors_total', 'counter', 'Chamadas que falharam',
+             lambda rs: sum(1 for r in rs if r['error'])),
+            ('llm_prompt_tokens_total', 'counter', 'Tokens de prompt',
+             lambda rs: sum(r['prompt_tokens'] for r in rs)),
+            ('llm_completion_tokens_total', 'counter', 'Tokens de resposta',
+             lambda rs: sum(r['completion_tokens'] for r in rs)),
+            ('llm_latency_seconds_sum', 'counter', 'Soma das latências',
+             lambda rs: sum(r['latency_s'] for r in rs)),
+            ('llm_cost_usd_total', 'counter', 'Custo estimado em dólares',
+             lambda rs: sum(r['cost_usd'] for r in rs)),
+        ]
+        groups = self._groups()
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (module, stage, model), records in sorted(groups.items()):
+                labels = f'module="{module}",stage="{stage}",model="{model}"'
+                lines.append(f"{name}{{{labels}}} {value(records)}")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+    def export_from_env(self):
+        """Exporta para LLM_TELEMETRY_JSONL / LLM_TELEMETRY_PROMETHEUS, se definidos"""
+        jsonl_path = os.getenv("LLM_TELEMETRY_JSONL")
+        if jsonl_path:
+            self.export_jsonl(jsonl_path)
+            print(f"[*] Telemetria (JSONL) salva em: {jsonl_path}")
+        prometheus_path = os.getenv("LLM_TELEMETRY_PROMETHEUS")
+        if prometheus_path:
+            self.export_prometheus(prometheus_path)
+            print(f"[*] Telemetria (Prometheus) salva em: {prometheus_path}")
+
+
+# Handler único do processo, adicionado pelo LLMExecutor a todas as chamadas
+telemetry = TelemetryHandler()
+
+
+def telemetry_config(module: str, stage: str, config: Optional[Dict] = None) -> Dict:
+    """Config de chamada com o handler de telemetria e as marcas de módulo/etapa"""
+    config = dict(config or {})
+    config['metadata'] = {**config.get('metadata', {}), 'module': module, 'stage': stage}
+    callbacks = list(config.get('callbacks') or [])
+    if telemetry not in callbacks:
+        callbacks.append(telemetry)
+    config['callbacks'] = callbacks
+    return config
@@ -5,9 +5,17 @@ Integra os 3 módulos de análise
 
 import os
 from dotenv import load_dotenv
-from modulo1_rag_compliance import ComplianceChatbot
+from modulo1_rag_compliance import ComplianceChatbot, print_streamed_answer
 from modulo2_conspiracy_detector import ConspiracyDetector
 from modulo3_fraud_detector import FraudDetector
+from audit_state import AuditState
+from email_store import EmailStore
+from email_prefilter import EmbeddingPrefilter
+from embeddings_provider import get_embeddings
+from env_flags import env_flag
+from llm_config import OFFLINE_BACKENDS, close_llm_clients, llm_backend
+from llm_cache import active_llm_cache
+from llm_telemetry import telemetry
 
 
 def print_header(title: str):
@@ -17,28 +25,102 @@ def print_header(title: str):
     print("=" * 80 + "\n")
 
 
+def build_fraud_detector() -> FraudDetector:
+    """Cria o detector de fraudes com as opções definidas no .env"""
+    window_days = os.getenv("SMURFING_WINDOW_DAYS")
+    chunksize = os.getenv("FRAUD_CHUNKSIZE")
+    workers = os.getenv("FRAUD_WORKERS", "1")
+    return FraudDetector(
+        "data/transacoes_bancarias.csv",
+        "data/politica_compliance.txt",
+        smurfing_window_days=int(window_days) if window_days else None,
+        keywords_file=os.getenv("FORBIDDEN_KEYWORDS_FILE") or None,
+        whole_words=env_flag("KEYWORDS_WHOLE_WORDS"),
+        ignore_accents=env_flag("KEYWORDS_IGNORE_ACCENTS"),
+        chunksize=int(chunksize) if chunksize else None,
+        use_cache=env_flag("TRANSACTIONS_CACHE", default=True),
+        workers=0 if workers == "auto" else int(workers)
+    )
+
+
+def build_email_store():
+    """Base SQLite dos emails, atualizada com o que entrou no dump (EMAIL_STORE=0 desliga)"""
+    if not env_flag("EMAIL_STORE", default=True):
+        return None
+    store = EmailStore("data/emails.txt")
+    store.refresh()
+    return store
+
+
+def build_prefilter():
+    """Pré-filtro por embeddings dos emails (opcional, EMAIL_PREFILTER=1)"""
+    if not env_flag("EMAIL_PREFILTER"):
+        return None
+    return EmbeddingPrefilter()
+
+
+def load_fraud_data(detector: FraudDetector):
+    """Carrega transações e política; com AUDIT_INCREMENTAL=1 só a política (as regras leem as linhas novas)"""
+    if env_flag("AUDIT_INCREMENTAL"):
+        detector.load_policy()
+    else:
+        detector.load_data()
+
+
+def run_fraud_rules(detector: FraudDetector):
+    """Regras simples; com AUDIT_INCREMENTAL=1 só as transações novas são avaliadas"""
+    if env_flag("AUDIT_INCREMENTAL"):
+        return detector.check_simple_violations_incremental(AuditState("transacoes"))
+    return detector.check_simple_violations()
+
+
+def run_contextual_analysis(detector: FraudDetector, email_store):
+    """Análise contextual; com AUDIT_INCREMENTAL=1 só as transações suspeitas novas vão para a LLM"""
+    if env_flag("AUDIT_INCREMENTAL"):
+        return detector.check_contextual_violations_incremental(
+            AuditState("transacoes_contexto"), "data/emails.txt", store=email_store
+        )
+    return detector.check_contextual_violations("data/emails.txt", store=email_store)
+
+
+def run_conspiracy_analysis(detector: ConspiracyDetector):
+    """Análise de conspiração; com AUDIT_INCREMENTAL=1 só os emails novos são lidos"""
+    if env_flag("AUDIT_INCREMENTAL"):
+        return detector.analyze_conspiracy_incremental(AuditState("emails"))
+    if detector.store is None:
+        detector.parse_emails()
+    return detector.analyze_conspiracy()
+
+
 def main_menu():
     """Menu principal do sistema"""
     load_dotenv()
     
-    # Verificar se pelo menos uma API key está configurada
+    # Verificar se pelo menos uma API key está configurada (replay e
+    # synthetic respondem sem chamar a API)
+    backend = llm_backend()
     has_groq = os.getenv("GROQ_API_KEY")
     has_openai = os.getenv("OPENAI_API_KEY")
     
-    if not has_groq and not has_openai:
+    if backend in OFFLINE_BACKENDS:
+        print(f"[*] Sistema configurado para respostas offline (LLM_BACKEND={backend})")
+    elif not has_groq and not has_openai:
         print("[!] ERRO: Nenhuma API key encontrada!")
         print("\nPor favor, configure pelo menos uma no arquivo .env:")
         print("  GROQ_API_KEY=gsk-sua-chave-aqui (RECOMENDADO - grátis)")
         print("  OPENAI_API_KEY=sk-sua-chave-aqui")
         print("\nObtenha uma chave Groq em: https://console.groq.com/")
         return
-    
-    # Informar qual será usada
-    if has_groq:
+    elif has_groq:
         print("[*] Sistema configurado para usar Groq (grátis e rápido)")
     else:
         print("[*] Sistema configurado para usar OpenAI")
     
+    # Opcional (EMBEDDINGS_WARMUP=1): carrega o modelo de embeddings em segundo
+    # plano enquanto o menu é usado; as mensagens da carga se misturam ao menu
+    if env_flag("EMBEDDINGS_WARMUP"):
+        get_embeddings().warm_up()
+    
     print_header("SISTEMA DE AUDITORIA DUNDER MIFFLIN")
     print("Bem-vindo ao sistema de compliance e auditoria")
     print("Desenvolvido para Toby Flenderson - Recursos Humanos\n")
@@ -76,16 +158,8 @@ def run_compliance_chatbot():
     
     chatbot = ComplianceChatbot("data/politica_compliance.txt")
     
-    # Verificar se já existe índice
-    if os.path.exists("./faiss_index"):
-        try:
-            chatbot.load_existing_index()
-        except Exception as e:
-            print(f"[!] Erro ao carregar índice: {e}")
-            print("[*] Criando novo índice...")
-            chatbot.load_and_index()
-    else:
-        chatbot.load_and_index()
+    # Carregar o índice, atualizando-o se a política mudou
+    chatbot.sync_index()
     
     chatbot.setup_qa_chain()
     
@@ -102,8 +176,8 @@ def run_compliance_chatbot():
             continue
             
         try:
-            result = chatbot.ask(question)
-            print(f"\n[A] Resposta:\n{result['result']}\n")
+            print_streamed_answer(chatbot, question)
+            print()
         except Exception as e:
             print(f"\n[!] Erro: {e}\n")
 
@@ -112,10 +186,9 @@ def run_conspiracy_detector():
     """Executa o módulo 2: Detector de Conspiração"""
     print_header("MÓDULO 2: DETECTOR DE CONSPIRAÇÃO")
     
-    detector = ConspiracyDetector("data/emails.txt")
-    detector.parse_emails()
-    
-    result = detector.analyze_conspiracy()
+    detector = ConspiracyDetector("data/emails.txt", store=build_email_store(),
+                                  prefilter=build_prefilter())
+    result = run_conspiracy_analysis(detector)
     
     print("\n[*] RESULTADO DA ANÁLISE:")
     print("=" * 80)
@@ -142,14 +215,14 @@ def run_fraud_detector():
     """Executa o módulo 3: Detector de Fraudes"""
     print_header("MÓDULO 3: DETECTOR DE FRAUDES")
     
-    detector = FraudDetector("data/transacoes_bancarias.csv", "data/politica_compliance.txt")
-    detector.load_data()
+    detector = build_fraud_detector()
+    load_fraud_data(detector)
     
     print("\n[*] Analisando transações...")
-    simple_violations = detector.check_simple_violations()
+    simple_violations = run_fraud_rules(detector)
     
     print("\n[*] Analisando contexto de emails...")
-    contextual_result = detector.check_contextual_violations("data/emails.txt")
+    contextual_result = run_contextual_analysis(detector, build_email_store())
     
     report = detector.generate_report(simple_violations, contextual_result)
     
@@ -192,16 +265,17 @@ def run_full_audit():
     
     # Módulo 2: Conspiração
     print("\n[*] [1/2] Analisando conspiração...")
-    detector_conspiracy = ConspiracyDetector("data/emails.txt")
-    detector_conspiracy.parse_emails()
-    conspiracy_result = detector_conspiracy.analyze_conspiracy()
+    email_store = build_email_store()
+    detector_conspiracy = ConspiracyDetector("data/emails.txt", store=email_store,
+                                             prefilter=build_prefilter())
+    conspiracy_result = run_conspiracy_analysis(detector_conspiracy)
     
     # Módulo 3: Fraudes
     print("\n[*] [2/2] Analisando fraudes...")
-    detector_fraud = FraudDetector("data/transacoes_bancarias.csv", "data/politica_compliance.txt")
-    detector_fraud.load_data()
-    simple_violations = detector_fraud.check_simple_violations()
-    contextual_result = detector_fraud.check_contextual_violations("data/emails.txt")
+    detector_fraud = build_fraud_detector()
+    load_fraud_data(detector_fraud)
+    simple_violations = run_fraud_rules(detector_fraud)
+    contextual_result = run_contextual_analysis(detector_fraud, email_store)
     
     # Gerar relatório consolidado
     print("\n[*] Gerando relatório consolidado...")
@@ -228,11 +302,25 @@ def run_full_audit():
     # Estatísticas
     full_report.append("\n\n## ESTATÍSTICAS GERAIS")
     full_report.append("-" * 80)
-    full_report.append(f"Total de transações analisadas: {len(detector_fraud.df)}")
-    full_report.append(f"Total de emails analisados: {len(detector_conspiracy.emails)}")
+    full_report.append(f"Total de transações analisadas: {detector_fraud.n_transactions}")
+    full_report.append(f"Total de emails analisados: {detector_conspiracy.n_emails}")
     full_report.append(f"Violações de compliance detectadas: {len(simple_violations)}")
     full_report.append(f"Emails suspeitos (Michael vs Toby): {len(conspiracy_result.get('relevant_emails', []))}")
     
+    llm_cache = active_llm_cache()
+    if llm_cache is not None:
+        stats = llm_cache.stats()
+        full_report.append(
+            f"Cache de respostas da LLM: {stats['hits']} acertos, {stats['misses']} falhas "
+            f"({stats['entries']}/{stats['max_entries']} entradas)"
+        )
+    
+    # Telemetria das chamadas à LLM
+    full_report.append("\n\n## TELEMETRIA DA LLM")
+    full_report.append("-" * 80)
+    full_report.extend(telemetry.summary_lines())
+    telemetry.export_from_env()
+    
     full_report_text = "\n".join(full_report)
     
     # Mostrar na tela
@@ -249,4 +337,7 @@ def run_full_audit():
 
 
 if __name__ == "__main__":
-    main_menu()
\ No newline at end of file
+    try:
+        main_menu()
+    finally:
+        close_llm_clients()
\ No newline at end of file
@@ -4,13 +4,37 @@ Sistema de consulta sobre políticas de compliance usando RAG
 """
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from llm_config import get_llm
+from embeddings_provider import EMBEDDING_MODEL_NAME, get_embeddings
+from answer_cache import RAG_ANSWER_CACHE, SemanticAnswerCache
+from llm_config import LLM_MAX_CONCURRENCY, get_llm, get_provider
+from llm_executor import LLMExecutor
+from llm_telemetry import telemetry_config
 from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
+import argparse
+import hashlib
+import json
 import os
 import pickle
+import time
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+# Manifesto do índice: modelo de embeddings e hashes dos chunks indexados
+MANIFEST_FILE = "manifest.json"
+
+# Chunks recuperados por pergunta
+RETRIEVAL_K = 4
+
+
+def index_fingerprint(manifest: dict) -> str:
+    """Identifica o conteúdo do índice (muda quando a política ou o modelo mudam)"""
+    data = json.dumps([manifest.get('model'), manifest.get('chunks')])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
 
 
 class ComplianceChatbot:
@@ -26,11 +50,19 @@ class ComplianceChatbot:
         self.persist_dir = persist_dir
         self.vectorstore = None
         self.qa_chain = None
+        self.executor = None
+        self.answer_cache = None
+        self.fingerprint = None
+        self.prompt = None
+        self.llm = None
         
-    def load_and_index(self):
-        """Carrega o documento e cria o índice vetorial"""
-        print("[*] Carregando política de compliance...")
+    def _read_chunks(self) -> Tuple[List[str], List[str]]:
+        """
+        Chunks da política e seus IDs (hash do conteúdo)
         
+        Chunks com texto idêntico recebem sufixo -2, -3... para que o ID
+        continue único no docstore.
+        """
         # Ler arquivo
         with open(self.policy_file, 'r', encoding='utf-8') as f:
             text = f.read()
@@ -43,47 +75,147 @@ class ComplianceChatbot:
         )
         chunks = text_splitter.split_text(text)
         
+        ids, seen = [], {}
+        for chunk in chunks:
+            digest = hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:32]
+            seen[digest] = seen.get(digest, 0) + 1
+            ids.append(digest if seen[digest] == 1 else f"{digest}-{seen[digest]}")
+        return chunks, ids
+    
+    def _metadata(self, position: int, chunk_id: str) -> dict:
+        return {"chunk": position, "source": os.path.basename(self.policy_file),
+                "hash": chunk_id}
+    
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.persist_dir, MANIFEST_FILE)
+    
+    def _read_manifest(self) -> Optional[dict]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _set_fingerprint(self, manifest: dict):
+        """Registra o índice atual; o cache de respostas de outro índice é descartado"""
+        self.fingerprint = index_fingerprint(manifest)
+        if self.answer_cache is not None:
+            self.answer_cache.reset(self.fingerprint)
+    
+    def _save(self, ids: List[str]):
+        """Salva o índice e o manifesto (modelo + IDs dos chunks, em ordem)"""
+        os.makedirs(self.persist_dir, exist_ok=True)
+        self.vectorstore.save_local(self.persist_dir)
+        manifest = {
+            'model': EMBEDDING_MODEL_NAME,
+            'source': os.path.basename(self.policy_file),
+            'chunks': ids,
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        self._set_fingerprint(manifest)
+    
+    def load_and_index(self):
+        """Carrega o documento e cria o índice vetorial"""
+        print("[*] Carregando política de compliance...")
+        chunks, ids = self._read_chunks()
+        
         print(f"[*] Documento dividido em {len(chunks)} chunks")
         
-        # Criar embeddings gratuitos (HuggingFace)
-        print("[*] Carregando modelo de embeddings (primeira vez pode demorar)...")
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # Embeddings gratuitos (HuggingFace), compartilhados pelo processo
+        embeddings = get_embeddings()
         
-        # Criar metadados simples
-        metadatas = [{"chunk": i, "source": "politica_compliance.txt"} 
-                     for i in range(len(chunks))]
+        # Metadados com a posição e o hash do chunk (que também é o ID no docstore)
+        metadatas = [self._metadata(i, chunk_id) for i, chunk_id in enumerate(ids)]
         
         print("[*] Criando índice vetorial...")
         self.vectorstore = FAISS.from_texts(
             texts=chunks,
             embedding=embeddings,
-            metadatas=metadatas
+            metadatas=metadatas,
+            ids=ids
         )
         
         # Salvar índice
-        os.makedirs(self.persist_dir, exist_ok=True)
-        self.vectorstore.save_local(self.persist_dir)
+        self._save(ids)
         
         print("[OK] Índice vetorial criado com sucesso!")
         
-    def load_existing_index(self):
-        """Carrega índice existente"""
+    def load_existing_index(self) -> dict:
+        """
+        Carrega índice existente
+        
+        Returns:
+            Manifesto do índice
+        
+        Raises:
+            ValueError: Índice sem manifesto ou criado com outro modelo de embeddings
+        """
         print("[*] Carregando índice existente...")
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        manifest = self._read_manifest()
+        if manifest is None:
+            raise ValueError("Índice sem manifesto (versão antiga)")
+        if manifest.get('model') != EMBEDDING_MODEL_NAME:
+            raise ValueError(f"Índice criado com outro modelo de embeddings "
+                             f"({manifest.get('model')})")
+        embeddings = get_embeddings()
         self.vectorstore = FAISS.load_local(
             self.persist_dir, 
             embeddings,
             allow_dangerous_deserialization=True
         )
+        self._set_fingerprint(manifest)
         print("[OK] Índice carregado!")
+        return manifest
+    
+    def sync_index(self):
+        """
+        Carrega o índice e o atualiza com as mudanças da política
+        
+        Só os chunks novos ou alterados são gerados de novo; os que saíram do
+        documento são removidos. Sem índice, sem manifesto ou com manifesto de
+        outro modelo, o índice é recriado do zero.
+        """
+        if not os.path.exists(self.persist_dir):
+            self.load_and_index()
+            return
+        try:
+            manifest = self.load_existing_index()
+        except Exception as e:
+            print(f"[!] Índice descartado: {e}")
+            print("[*] Criando novo índice...")
+            self.load_and_index()
+            return
+        
+        chunks, ids = self._read_chunks()
+        indexed = set(manifest.get('chunks', []))
+        current = set(ids)
+        removed = [chunk_id for chunk_id in manifest.get('chunks', []) if chunk_id not in current]
+        added = [i for i, chunk_id in enumerate(ids) if chunk_id not in indexed]
+        
+        if not removed and not added and manifest.get('chunks') == ids:
+            print("[OK] Índice em dia com a política")
+            return
+        
+        print(f"[*] Política alterada: {len(added)} chunks novos, {len(removed)} removidos")
+        if removed:
+            self.vectorstore.delete(removed)
+        if added:
+            self.vectorstore.add_texts(
+                texts=[chunks[i] for i in added],
+                metadatas=[self._metadata(i, ids[i]) for i in added],
+                ids=[ids[i] for i in added]
+            )
+        # Chunks mantidos podem ter mudado de posição no documento
+        for position, chunk_id in enumerate(ids):
+            document = self.vectorstore.docstore.search(chunk_id)
+            if hasattr(document, 'metadata'):
+                document.metadata['chunk'] = position
+        
+        self._save(ids)
+        print("[OK] Índice atualizado!")
         
     def setup_qa_chain(self):
         """Configura a chain de Q&A"""
@@ -108,36 +240,264 @@ Resposta detalhada:"""
         
         # LLM
         llm = get_llm()
+        self.prompt = PROMPT
+        self.llm = llm
         
         # Chain de retrieval
         self.qa_chain = RetrievalQA.from_chain_type(
             llm=llm,
             chain_type="stuff",
             retriever=self.vectorstore.as_retriever(
-                search_kwargs={"k": 4}
+                search_kwargs={"k": RETRIEVAL_K}
             ),
             chain_type_kwargs={"prompt": PROMPT},
             return_source_documents=True
         )
         
+        # O input da chain é só a pergunta; os 4 chunks recuperados (~1000
+        # caracteres cada) entram na estimativa de tokens como overhead
+        self.executor = LLMExecutor(self.qa_chain, provider=get_provider(llm),
+                                    prompt_overhead=1200)
+        
+        # Respostas de perguntas parecidas, válidas enquanto o índice não mudar
+        if RAG_ANSWER_CACHE:
+            self.answer_cache = SemanticAnswerCache(get_embeddings(), self.fingerprint)
+        
         print("[OK] Chain de Q&A configurada!")
         
-    def ask(self, question: str) -> dict:
+    def ask(self, question: str, use_cache: bool = True) -> dict:
         """
         Faz uma pergunta ao chatbot
         
         Args:
             question: Pergunta sobre compliance
+            use_cache: Reutiliza a resposta de uma pergunta parecida, se houver
             
         Returns:
-            Dict com resposta e documentos fonte
+            Dict com resposta e documentos fonte ('cached': True se veio do cache)
         """
         if self.qa_chain is None:
             raise ValueError("Chain não inicializada. Execute setup_qa_chain() primeiro.")
+        
+        vector = None
+        if self.answer_cache is not None:
+            vector = self.answer_cache.embed(question)
+            cached = self.answer_cache.lookup(question, vector) if use_cache else None
+            if cached is not None:
+                return cached
             
-        result = self.qa_chain.invoke({"query": question})
+        result = self.executor.invoke(
+            {"query": question},
+            config=telemetry_config("modulo1_rag", "pergunta")
+        )
+        if self.answer_cache is not None:
+            self.answer_cache.store(question, result, vector)
         return result
 
+    
+    def ask_stream(self, question: str, use_cache: bool = True) -> Iterator[Union[str, dict]]:
+        """
+        Faz uma pergunta recebendo a resposta aos poucos
+        
+        Gera os pedaços de texto (str) à medida que a LLM os produz e, por
+        último, um dict no formato de ask() com as fontes, o tempo até o
+        primeiro token ('ttft_s') e o tempo total ('latency_s').
+        
+        Ex:
+            for piece in chatbot.ask_stream(pergunta):
+                if isinstance(piece, str):
+                    print(piece, end="", flush=True)
+        
+        Args:
+            question: Pergunta sobre compliance
+            use_cache: Reutiliza a resposta de uma pergunta parecida, se houver
+        """
+        if self.qa_chain is None:
+            raise ValueError("Chain não inicializada. Execute setup_qa_chain() primeiro.")
+        
+        start = time.perf_counter()
+        vector = None
+        if self.answer_cache is not None:
+            vector = self.answer_cache.embed(question)
+            cached = self.answer_cache.lookup(question, vector) if use_cache else None
+            if cached is not None:
+                yield cached['result']
+                elapsed = time.perf_counter() - start
+                yield {**cached, 'ttft_s': elapsed, 'latency_s': elapsed}
+                return
+        
+        if vector is not None:
+            docs = self.vectorstore.similarity_search_by_vector(vector.tolist(), k=RETRIEVAL_K)
+        else:
+            docs = self.vectorstore.similarity_search(question, k=RETRIEVAL_K)
+        
+        executor = LLMExecutor(self.prompt | self.llm, provider=get_provider(self.llm))
+        pieces, ttft = [], None
+        for chunk in executor.stream(
+            {"context": "\n\n".join(doc.page_content for doc in docs), "question": question},
+            config=telemetry_config("modulo1_rag", "pergunta_streaming")
+        ):
+            text = chunk.content if isinstance(chunk.content, str) else ""
+            if not text:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            pieces.append(text)
+            yield text
+        
+        result = {'query': question, 'result': "".join(pieces), 'source_documents': docs}
+        if self.answer_cache is not None:
+            self.answer_cache.store(question, result, vector)
+        latency = time.perf_counter() - start
+        yield {**result, 'ttft_s': latency if ttft is None else ttft, 'latency_s': latency}
+    
+    def _search_many(self, vectors: np.ndarray) -> List[List[Document]]:
+        """Top RETRIEVAL_K chunks de várias perguntas em uma única busca no FAISS"""
+        _, positions = self.vectorstore.index.search(vectors, RETRIEVAL_K)
+        results = []
+        for row in positions:
+            docs = []
+            for position in row:
+                if position == -1:
+                    continue
+                document = self.vectorstore.docstore.search(
+                    self.vectorstore.index_to_docstore_id[int(position)]
+                )
+                if isinstance(document, Document):
+                    docs.append(document)
+            results.append(docs)
+        return results
+    
+    def ask_many(self, questions: List[str], max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 use_cache: bool = True) -> List[dict]:
+        """
+        Responde várias perguntas de uma vez
+        
+        Os embeddings das perguntas saem de uma única chamada ao modelo, a
+        busca no FAISS é feita em lote e as gerações vão para a LLM em
+        paralelo (até max_concurrency por vez). Perguntas já respondidas
+        (cache semântico) não geram chamada.
+        
+        Args:
+            questions: Perguntas sobre compliance
+            max_concurrency: Gerações em andamento ao mesmo tempo
+            use_cache: Reutiliza respostas de perguntas parecidas
+            
+        Returns:
+            Um dict por pergunta, na ordem de entrada, no formato de ask();
+            perguntas que falharam trazem 'error' no lugar de 'result'
+        """
+        if self.qa_chain is None:
+            raise ValueError("Chain não inicializada. Execute setup_qa_chain() primeiro.")
+        if not questions:
+            return []
+        
+        vectors = np.asarray(get_embeddings().embed_documents(questions), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        
+        results: List[Optional[dict]] = [None] * len(questions)
+        if self.answer_cache is not None and use_cache:
+            for i, question in enumerate(questions):
+                results[i] = self.answer_cache.lookup(question, vectors[i])
+        pending = [i for i, result in enumerate(results) if result is None]
+        print(f"[*] {len(questions)} perguntas: {len(questions) - len(pending)} do cache, "
+              f"{len(pending)} para a LLM")
+        
+        if pending:
+            sources = self._search_many(vectors[pending])
+            inputs = [
+                {"context": "\n\n".join(doc.page_content for doc in docs),
+                 "question": questions[i]}
+                for i, docs in zip(pending, sources)
+            ]
+            executor = LLMExecutor(self.prompt | self.llm, provider=get_provider(self.llm),
+                                   max_concurrency=max_concurrency)
+            answers = executor.batch(
+                inputs,
+                config=telemetry_config("modulo1_rag", "pergunta_lote"),
+                return_exceptions=True
+            )
+            for i, docs, answer in zip(pending, sources, answers):
+                if isinstance(answer, Exception):
+                    results[i] = {'query': questions[i], 'error': f"{type(answer).__name__}: {answer}"}
+                    continue
+                results[i] = {'query': questions[i], 'result': answer.content,
+                              'source_documents': docs}
+                if self.answer_cache is not None:
+                    self.answer_cache.store(questions[i], results[i], vectors[i])
+        
+        return results
+
+
+def print_streamed_answer(chatbot: ComplianceChatbot, question: str) -> dict:
+    """Imprime a resposta à medida que é gerada, seguida do tempo até o primeiro token"""
+    print("\n[A] Resposta: ", end="", flush=True)
+    result = {}
+    for piece in chatbot.ask_stream(question):
+        if isinstance(piece, str):
+            print(piece, end="", flush=True)
+        else:
+            result = piece
+    origin = " (cache)" if result.get('cached') else ""
+    print(f"\n\n[*] Primeiro token em {result['ttft_s']:.2f}s, "
+          f"resposta completa em {result['latency_s']:.2f}s{origin}")
+    return result
+
+
+def _read_questions(path: str) -> List[str]:
+    """Perguntas de um arquivo texto (uma por linha) ou JSONL (campo "question")"""
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith('.jsonl'):
+                line = json.loads(line)['question']
+            questions.append(line)
+    return questions
+
+
+def answer_file(questions_file: str, output_file: str = "respostas_compliance.jsonl",
+                max_concurrency: int = LLM_MAX_CONCURRENCY, use_cache: bool = True):
+    """
+    Responde um arquivo de perguntas e grava as respostas em JSONL
+    
+    Args:
+        questions_file: Perguntas (.txt, uma por linha, ou .jsonl)
+        output_file: Arquivo JSONL de saída (uma resposta por linha, na ordem das perguntas)
+        max_concurrency: Gerações em paralelo
+        use_cache: Usa o cache semântico de respostas
+    """
+    questions = _read_questions(questions_file)
+    
+    chatbot = ComplianceChatbot("data/politica_compliance.txt")
+    chatbot.sync_index()
+    chatbot.setup_qa_chain()
+    
+    start = time.perf_counter()
+    results = chatbot.ask_many(questions, max_concurrency=max_concurrency, use_cache=use_cache)
+    elapsed = time.perf_counter() - start
+    
+    with open(output_file, 'w', encoding='utf-8') as out:
+        for result in results:
+            record = {
+                'question': result['query'],
+                'answer': result.get('result'),
+                'sources': [{'chunk': doc.metadata.get('chunk'), 'source': doc.metadata.get('source'),
+                             'content': doc.page_content}
+                            for doc in result.get('source_documents', [])],
+                'cached': bool(result.get('cached')),
+            }
+            if 'error' in result:
+                record['error'] = result['error']
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    
+    failed = sum(1 for result in results if 'error' in result)
+    print(f"[OK] {len(results)} perguntas respondidas em {elapsed:.1f}s "
+          f"({len(results) / max(elapsed, 1e-9):.1f}/s, {failed} com erro)")
+    print(f"[*] Respostas salvas em: {output_file}")
+
 
 def demo_chatbot():
     """Demonstração do chatbot"""
@@ -148,16 +508,8 @@ def demo_chatbot():
     # Inicializar
     chatbot = ComplianceChatbot("data/politica_compliance.txt")
     
-    # Verificar se já existe índice
-    if os.path.exists("./faiss_index"):
-        try:
-            chatbot.load_existing_index()
-        except Exception as e:
-            print(f"[!] Erro ao carregar índice: {e}")
-            print("[*] Criando novo índice...")
-            chatbot.load_and_index()
-    else:
-        chatbot.load_and_index()
+    # Carregar o índice, atualizando-o se a política mudou
+    chatbot.sync_index()
     
     chatbot.setup_qa_chain()
     
@@ -168,11 +520,11 @@ def demo_chatbot():
         "Quem pode aprovar despesas entre $50 e $500?",
     ]
     
-    for q in test_questions:
-        print(f"\n[?] Pergunta: {q}")
+    # Respondidas em lote (gerações em paralelo), impressas na ordem
+    for result in chatbot.ask_many(test_questions):
+        print(f"\n[?] Pergunta: {result['query']}")
         print("-" * 60)
-        result = chatbot.ask(q)
-        print(f"[A] Resposta: {result['result']}\n")
+        print(f"[A] Resposta: {result.get('result', result.get('error'))}\n")
     
     # Modo interativo
     print("\n" + "="*60)
@@ -189,9 +541,23 @@ def demo_chatbot():
         if not question:
             continue
             
-        result = chatbot.ask(question)
-        print(f"\n[A] Resposta: {result['result']}")
+        print_streamed_answer(chatbot, question)
 
 
 if __name__ == "__main__":
-    demo_chatbot()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--questions', metavar='ARQUIVO',
+                        help="Responde as perguntas do arquivo (.txt, uma por linha, "
+                             "ou .jsonl com o campo \"question\") em vez da demonstração")
+    parser.add_argument('--output', metavar='ARQUIVO', default="respostas_compliance.jsonl",
+                        help="JSONL de saída")
+    parser.add_argument('--concurrency', type=int, default=LLM_MAX_CONCURRENCY,
+                        help="Gerações em paralelo")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Não usa respostas do cache semântico")
+    args = parser.parse_args()
+
+    if args.questions:
+        answer_file(args.questions, args.output, args.concurrency, not args.no_cache)
+    else:
+        demo_chatbot()
\ No newline at end of file
@@ -3,109 +3,319 @@ Módulo 2: Detector de Conspiração
 Vasculha emails procurando evidências de Michael conspirando contra Toby
 """
 
+import hashlib
+import json
+import mmap
+import os
 import re
-from typing import List, Dict
-from llm_config import get_llm
+from typing import Dict, Iterator, List, Optional, Tuple
+from llm_config import get_llm, parse_json_response
+from llm_executor import LLMExecutor
+from llm_telemetry import telemetry_config
+from audit_state import AuditState
+from email_index import EmailIndex
+from email_preprocess import EMAIL_PREPROCESS, preprocess_emails
+from token_budget import PROMPT_TOKEN_BUDGET, count_tokens, pack_batches
 from langchain.prompts import ChatPromptTemplate
 
 
+EMAIL_SEPARATOR = b'-' * 79
+
+# Trecho inicial do dump usado para detectar que o arquivo foi reescrito
+_HEAD_BYTES = 64 * 1024
+
+MICHAEL_ADDRESS = 'michael.scott'
+
+# Termos (ou frases) que indicam um email sobre o Toby ou o RH
+TOBY_KEYWORDS = [
+    'toby', 'hr', 'recursos humanos', 'flenderson',
+    'conspiração', 'conspirar', 'contra', 'odeia', 'odeio'
+]
+
+# Cabeçalhos de um email, todos em uma única passada; "Mensagem:" encerra
+# o cabeçalho e o resto do bloco (várias linhas) é o corpo
+_HEADER_PATTERN = re.compile(
+    r'^(?P<campo>De|Para|Data|Assunto):[ \t]*(?P<valor>[^\n]*)|^Mensagem:[ \t]*\n',
+    re.MULTILINE
+)
+_ADDRESS_PATTERN = re.compile(r'(.+?)\s*<(.+?)>')
+
+# Níveis de confiança da resposta da LLM, do menor para o maior
+CONFIDENCE_LEVELS = ['baixa', 'média', 'alta']
+
+
+def parse_email_block(raw: bytes) -> Optional[Dict]:
+    """
+    Converte um bloco do dump em email (None se o bloco for inválido)
+    
+    Um bloco válido tem remetente no formato "Nome <endereço>" e a linha
+    "Mensagem:" seguida do corpo.
+    """
+    block = raw.decode('utf-8', errors='replace').replace('\r\n', '\n').strip()
+    if not block or block.startswith('DUMP DE SERVIDOR'):
+        return None
+    
+    fields = {}
+    message = None
+    for match in _HEADER_PATTERN.finditer(block):
+        field = match.group('campo')
+        if field is None:
+            message = block[match.end():].strip()
+            break
+        fields.setdefault(field, match.group('valor').strip())
+    
+    sender = _ADDRESS_PATTERN.match(fields.get('De', ''))
+    if sender is None or message is None:
+        return None
+    recipient = _ADDRESS_PATTERN.match(fields.get('Para', ''))
+    
+    return {
+        'de_nome': sender.group(1).strip(),
+        'de_email': sender.group(2).strip(),
+        'para_nome': recipient.group(1).strip() if recipient else '',
+        'para_email': recipient.group(2).strip() if recipient else '',
+        'data': fields.get('Data', ''),
+        'assunto': fields.get('Assunto', ''),
+        'mensagem': message
+    }
+
+
+def iter_email_records(path: str, start_offset: int = 0,
+                       end_offset: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+    """
+    Percorre o dump via mmap gerando (posição do bloco em bytes, email)
+    
+    Args:
+        path: Arquivo de emails
+        start_offset: Posição inicial da leitura
+        end_offset: Posição final (padrão: tamanho atual do arquivo)
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end_offset is None else min(end_offset, size)
+        if end <= start_offset:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = start_offset
+            while pos < end:
+                next_sep = mm.find(EMAIL_SEPARATOR, pos, end)
+                block_end = end if next_sep == -1 else next_sep
+                email = parse_email_block(mm[pos:block_end])
+                if email is not None:
+                    yield pos, email
+                if next_sep == -1:
+                    break
+                pos = next_sep + len(EMAIL_SEPARATOR)
+
+
+def last_block_start(path: str, start_offset: int, end_offset: int) -> int:
+    """
+    Início do último bloco de [start_offset, end_offset) sem separador depois
+    
+    É até onde o dump pode ser dado como lido: esse bloco pode ser um email
+    ainda sendo gravado, então as leituras incrementais o releem na próxima
+    vez em vez de guardá-lo truncado.
+    """
+    with open(path, 'rb') as f:
+        end = min(end_offset, os.fstat(f.fileno()).st_size)
+        if end <= start_offset:
+            return start_offset
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            separator = mm.rfind(EMAIL_SEPARATOR, start_offset, end)
+    return start_offset if separator == -1 else separator + len(EMAIL_SEPARATOR)
+
+
+def dump_head_hash(path: str, length: int) -> str:
+    """sha1 dos primeiros bytes do dump (até length), para detectar reescritas"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(min(length, _HEAD_BYTES))).hexdigest()
+
+
+def _confidence_rank(value) -> int:
+    """Posição de uma confiança em CONFIDENCE_LEVELS ('media' sem acento vale)"""
+    value = str(value or '').strip().lower().replace('media', 'média')
+    return CONFIDENCE_LEVELS.index(value) if value in CONFIDENCE_LEVELS else 0
+
+
+def reduce_conspiracy_results(results: List) -> str:
+    """
+    Combina as respostas dos lotes no JSON de uma análise única
+    
+    Há conspiração se algum lote a encontrou; a confiança é a maior entre os
+    lotes positivos (ou a menor entre todos, se nenhum encontrou); evidências
+    são concatenadas sem repetição e os resumos ficam identificados por lote.
+    Lotes que falharam ou responderam fora do formato são relatados à parte.
+    
+    Args:
+        results: Mensagens da LLM (ou exceções) na ordem dos lotes
+    """
+    parsed, unparsed, failed = [], [], 0
+    for i, result in enumerate(results, 1):
+        if isinstance(result, Exception):
+            print(f"[!] Lote {i} falhou: {result}")
+            failed += 1
+            continue
+        data = parse_json_response(result.content)
+        if data is None:
+            unparsed.append(result.content)
+        else:
+            parsed.append((i, data))
+    
+    positives = [data for _, data in parsed if data.get('conspiracy_found') is True]
+    ranks = [_confidence_rank(data.get('confidence')) for data in positives] \
+        or [_confidence_rank(data.get('confidence')) for _, data in parsed]
+    confidence = CONFIDENCE_LEVELS[max(ranks) if positives else min(ranks, default=0)]
+    
+    evidence = []
+    for _, data in parsed:
+        for item in data.get('evidence') or []:
+            if item not in evidence:
+                evidence.append(item)
+    
+    if len(results) == 1 and parsed:
+        summary = parsed[0][1].get('summary', '')
+    else:
+        summary = "\n".join(f"Lote {i}/{len(results)}: {data.get('summary', '')}"
+                            for i, data in parsed)
+    if failed:
+        summary += f"\n[{failed} de {len(results)} lotes falharam e não foram analisados]"
+    
+    raw_result = json.dumps({
+        "conspiracy_found": bool(positives),
+        "confidence": confidence,
+        "evidence": evidence,
+        "summary": summary.strip()
+    }, ensure_ascii=False, indent=2)
+    if unparsed:
+        raw_result += "\n\nRespostas fora do formato JSON:\n" + "\n---\n".join(unparsed)
+    return raw_result
+
+
 class ConspiracyDetector:
-    def __init__(self, emails_file: str):
+    def __init__(self, emails_file: str, store=None, prefilter=None):
         """
         Inicializa o detector de conspiração
         
         Args:
             emails_file: Caminho para o arquivo de emails
+            store: EmailStore já carregado (opcional); com ele as consultas
+                vão à base SQLite e o dump não é relido
+            prefilter: EmbeddingPrefilter (opcional); só os emails com maior
+                similaridade a exemplos de hostilidade seguem para a LLM
         """
         self.emails_file = emails_file
+        self.store = store
+        self.prefilter = prefilter
         self.emails = []
+        self.start_offset = 0
+        self.end_offset = 0
+        self._index = None
+        
+    def iter_emails(self, start_offset: int = 0) -> Iterator[Dict]:
+        """
+        Lê o dump sob demanda (mmap), um email por vez
+        
+        Só o bloco atual é decodificado, então a memória não depende do
+        tamanho do arquivo. Blocos sem remetente ou sem mensagem são
+        ignorados. Cada email traz em 'inicio' a posição do seu bloco. Ao
+        final, self.end_offset aponta para o fim do dump lido.
+        
+        Args:
+            start_offset: Posição (em bytes) a partir da qual ler o dump
+        """
+        size = os.path.getsize(self.emails_file)
+        self.end_offset = max(size, start_offset)
+        for start, email in iter_email_records(self.emails_file, start_offset, size):
+            email['inicio'] = start
+            yield email
+    
+    def parse_emails(self, start_offset: int = 0) -> List[Dict]:
+        """
+        Parse do arquivo de emails em estrutura de dados
         
-    def parse_emails(self) -> List[Dict]:
-        """Parse do arquivo de emails em estrutura de dados"""
+        Args:
+            start_offset: Posição (em bytes) a partir da qual ler o dump;
+                usada pela auditoria incremental
+        """
         print("[*] Parseando emails...")
         
-        with open(self.emails_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Dividir por separadores
-        email_blocks = content.split('-------------------------------------------------------------------------------')
-        
-        emails = []
-        for block in email_blocks:
-            block = block.strip()
-            if not block or block.startswith('DUMP DE SERVIDOR'):
-                continue
-                
-            # Extrair campos
-            de_match = re.search(r'De: (.+?) <(.+?)>', block)
-            para_match = re.search(r'Para: (.+?) <(.+?)>', block)
-            data_match = re.search(r'Data: (.+)', block)
-            assunto_match = re.search(r'Assunto: (.+)', block)
-            
-            # Extrair mensagem (tudo após "Mensagem:")
-            msg_match = re.search(r'Mensagem:\s*\n(.+)', block, re.DOTALL)
-            
-            if de_match and msg_match:
-                email = {
-                    'de_nome': de_match.group(1).strip(),
-                    'de_email': de_match.group(2).strip(),
-                    'para_nome': para_match.group(1).strip() if para_match else '',
-                    'para_email': para_match.group(2).strip() if para_match else '',
-                    'data': data_match.group(1).strip() if data_match else '',
-                    'assunto': assunto_match.group(1).strip() if assunto_match else '',
-                    'mensagem': msg_match.group(1).strip()
-                }
-                emails.append(email)
-        
-        self.emails = emails
-        print(f"[OK] {len(emails)} emails parseados")
-        return emails
+        self.emails = list(self.iter_emails(start_offset))
+        print(f"[OK] {len(self.emails)} emails parseados")
+        return self.emails
+    
+    @property
+    def index(self) -> EmailIndex:
+        """Índice invertido dos emails parseados (construído uma vez)"""
+        if self._index is None or self._index.emails is not self.emails:
+            self._index = EmailIndex(self.emails)
+        return self._index
+    
+    def find_emails(self, sender: Optional[str] = None, recipient: Optional[str] = None,
+                    any_terms: Optional[List[str]] = None, date_from=None,
+                    date_to=None) -> List[Dict]:
+        """
+        Consulta os emails pela base SQLite (se houver) ou pelo índice em memória
+        
+        Ex: find_emails(sender="dwight.schrute", any_terms=["jim", "pegadinha"],
+        date_from="2008-01-01")
+        """
+        if self.store is not None:
+            return self.store.query(sender=sender, recipient=recipient, any_terms=any_terms,
+                                    date_from=date_from, date_to=date_to,
+                                    start_offset=self.start_offset)
+        return self.index.query(sender=sender, recipient=recipient, any_terms=any_terms,
+                                date_from=date_from, date_to=date_to)
+    
+    @property
+    def n_emails(self) -> int:
+        """Emails considerados pela análise (na base ou parseados)"""
+        if self.store is not None:
+            return self.store.count(start_offset=self.start_offset)
+        return len(self.emails)
     
     def find_michael_emails_about_toby(self) -> List[Dict]:
         """Encontra emails de/sobre Michael e Toby"""
-        relevant_emails = []
-        
-        keywords = [
-            'toby', 'hr', 'recursos humanos', 'flenderson',
-            'conspiração', 'conspirar', 'contra', 'odeia', 'odeio'
-        ]
+        return self.find_emails(sender=MICHAEL_ADDRESS, any_terms=TOBY_KEYWORDS)
+    
+    def analyze_conspiracy(self, token_budget: int = PROMPT_TOKEN_BUDGET,
+                           preprocess: bool = EMAIL_PREPROCESS) -> Dict:
+        """
+        Usa LLM para analisar se há conspiração
         
-        for email in self.emails:
-            # Emails de Michael
-            is_from_michael = 'michael.scott' in email['de_email'].lower()
-            
-            # Emails para/sobre Toby
-            mentions_toby = any(
-                keyword in email['assunto'].lower() or 
-                keyword in email['mensagem'].lower() or
-                keyword in email['para_email'].lower()
-                for keyword in keywords
-            )
-            
-            if is_from_michael and mentions_toby:
-                relevant_emails.append(email)
+        Map-reduce: os emails relevantes são divididos em lotes que cabem no
+        orçamento de tokens, cada lote é analisado em paralelo (com resposta
+        JSON própria) e os resultados são combinados em um único JSON.
         
-        return relevant_emails
-    
-    def analyze_conspiracy(self) -> Dict:
-        """Usa LLM para analisar se há conspiração"""
+        Args:
+            token_budget: Tokens de emails por prompt
+            preprocess: Remove histórico citado e quase-duplicatas antes
+                de montar os prompts (ver email_preprocess.py)
+        """
         print("\n[*] Analisando conspiração contra Toby...")
         
         relevant_emails = self.find_michael_emails_about_toby()
+        if relevant_emails and self.prefilter is not None:
+            relevant_emails, _ = self.prefilter.filter(relevant_emails)
         
         if not relevant_emails:
             print("[!] Nenhum email relevante encontrado")
             return {
                 "conspiracy_found": False,
                 "evidence": [],
-                "analysis": "Nenhum email de Michael mencionando Toby foi encontrado."
+                "analysis": "Nenhum email de Michael mencionando Toby foi encontrado.",
+                "raw_result": "Nenhum email de Michael mencionando Toby foi encontrado.",
+                "relevant_emails": []
             }
         
         print(f"[*] Encontrados {len(relevant_emails)} emails relevantes")
         
-        # Preparar contexto para a LLM
+        prompt_emails = relevant_emails
+        if preprocess:
+            prompt_emails, _ = preprocess_emails(relevant_emails)
+        
+        # Preparar contexto para a LLM (numeração global, igual em todos os lotes)
         email_texts = []
-        for i, email in enumerate(relevant_emails, 1):
+        for i, email in enumerate(prompt_emails, 1):
             email_text = f"""
 EMAIL #{i}
 De: {email['de_nome']}
@@ -116,7 +326,8 @@ Mensagem: {email['mensagem']}
 """
             email_texts.append(email_text)
         
-        context = "\n---\n".join(email_texts)
+        batches = pack_batches(email_texts, count_tokens, token_budget)
+        print(f"[*] {len(email_texts)} emails em {len(batches)} lotes")
         
         # Prompt para análise
         prompt = ChatPromptTemplate.from_messages([
@@ -142,12 +353,109 @@ Responda em formato JSON:
         llm = get_llm()
         chain = prompt | llm
         
-        result = chain.invoke({"emails": context})
+        inputs = [{"emails": "\n---\n".join(batch)} for batch in batches]
+        results = LLMExecutor(chain).batch(
+            inputs,
+            config=telemetry_config("modulo2_conspiracao", "analise"),
+            return_exceptions=True
+        )
         
         return {
-            "raw_result": result.content,
-            "relevant_emails": relevant_emails
+            "raw_result": reduce_conspiracy_results(results),
+            "relevant_emails": relevant_emails,
+            "batches": len(batches),
+            "failed_batches": sum(1 for r in results if isinstance(r, Exception))
         }
+    
+    def analyze_conspiracy_incremental(self, state: AuditState) -> Dict:
+        """
+        Analisa apenas os emails acrescentados ao dump desde a última execução
+        
+        O dump é tratado como append-only: a marca d'água é a posição (em
+        bytes) do último bloco sem separador depois (um email ainda sendo
+        gravado é analisado de novo, completo, na próxima execução), junto
+        com o tamanho do dump (sem mudança, nada é analisado) e o hash do
+        início do arquivo, que detecta reescritas. Cada análise nova é
+        guardada no histórico de state junto com os emails relevantes; o
+        email relido substitui a versão guardada na execução anterior.
+        
+        Args:
+            state: Estado persistido do dataset de emails
+            
+        Returns:
+            Dict no formato de analyze_conspiracy, com o histórico completo
+        """
+        offset = state.watermark.get('offset', 0)
+        head_hash = state.watermark.get('inicio_sha1')
+        size = os.path.getsize(self.emails_file)
+        if size < state.watermark.get('tamanho', offset) or \
+                (offset and head_hash and head_hash != dump_head_hash(self.emails_file, offset)):
+            print("[!] Dump de emails foi reescrito - analisando tudo novamente")
+            state.reset()
+            offset = 0
+        elif size == state.watermark.get('tamanho'):
+            print("[*] 0 emails novos desde a última auditoria")
+            return self._incremental_result(state)
+        
+        if self.store is not None:
+            self.store.refresh()
+            self.start_offset = offset
+            self.end_offset = self.store.size
+        else:
+            self.parse_emails(start_offset=offset)
+        watermark = last_block_start(self.emails_file, offset, self.end_offset)
+        print(f"[*] {self.n_emails} emails novos desde a última auditoria")
+        
+        if self.n_emails:
+            result = self.analyze_conspiracy()
+            _drop_reread(state, offset)
+            if result.get('relevant_emails'):
+                state.records.append({
+                    'offset_inicio': offset,
+                    'offset_fim': self.end_offset,
+                    'raw_result': result['raw_result'],
+                    'relevant_emails': result['relevant_emails']
+                })
+        state.watermark = {'offset': watermark, 'tamanho': self.end_offset,
+                           'inicio_sha1': dump_head_hash(self.emails_file, watermark)}
+        state.save()
+        return self._incremental_result(state)
+    
+    @staticmethod
+    def _incremental_result(state: AuditState) -> Dict:
+        """Histórico de state no formato de analyze_conspiracy"""
+        if not state.records:
+            return {
+                "raw_result": "Nenhum email de Michael mencionando Toby foi encontrado.",
+                "relevant_emails": []
+            }
+        
+        analyses = [
+            f"[Emails {record['offset_inicio']}-{record['offset_fim']} bytes]\n{record['raw_result']}"
+            for record in state.records
+        ]
+        return {
+            "raw_result": "\n\n".join(analyses),
+            "relevant_emails": [email for record in state.records
+                                for email in record['relevant_emails']]
+        }
+
+
+def _drop_reread(state: AuditState, offset: int):
+    """
+    Tira do histórico os emails que começam em offset ou depois
+    
+    São os relidos pela execução atual (o último bloco da anterior). Um
+    registro que fica sem emails relevantes é descartado: a nova análise
+    o substitui.
+    """
+    records = []
+    for record in state.records:
+        kept = [email for email in record['relevant_emails']
+                if email.get('inicio', -1) < offset]
+        if kept:
+            records.append({**record, 'relevant_emails': kept})
+    state.records = records
 
 
 def demo_conspiracy():
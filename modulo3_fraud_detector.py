@@ -3,154 +3,963 @@ Módulo 3: Detector de Fraudes
 Analisa transações bancárias e identifica quebras de compliance
 """
 
+import hashlib
+import json
+import os
+import re
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Tuple
-from llm_config import get_llm
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Optional
+from llm_config import get_llm, parse_json_response
+from llm_executor import LLMExecutor
+from llm_telemetry import telemetry_config
+from keyword_matcher import KeywordMatcher, load_keywords
+from transactions_cache import CACHE_DIR, TransactionCache, pyarrow_available
+from audit_state import AuditState
+from token_budget import PROMPT_TOKEN_BUDGET, count_tokens, pack_batches
+from modulo2_conspiracy_detector import ConspiracyDetector
+from email_index import person_key, person_keys
+from email_preprocess import EMAIL_PREPROCESS, preprocess_emails
 from langchain.prompts import ChatPromptTemplate
 
 
+# Categorias que normalmente passam de $500 sem Purchase Order
+HIGH_VALUE_EXEMPT_CATEGORIES = ['Viagem', 'Hospedagem']
+
+FORBIDDEN_KEYWORDS = [
+    'arma', 'airsoft', 'katana', 'ninja', 'mágica', 'magic',
+    'algema', 'corrente', 'pombo', 'karaoke', 'discoteca',
+    'vigilância', 'binóculo', 'walkie', 'spy', 'armadilha',
+    'hooters', 'strip'
+]
+
+# Colunas lidas do CSV e seus tipos (evita inferência a cada bloco)
+TRANSACTION_DTYPES = {
+    'id_transacao': str,
+    'funcionario': str,
+    'data': str,
+    'valor': 'float64',
+    'categoria': str,
+    'descricao': str
+}
+
+VIOLATION_COLUMNS = [
+    'id', 'tipo', 'funcionario', 'valor', 'descricao', 'data', 'severidade', 'regra'
+]
+
+# Abaixo disso o custo de subir processos supera o ganho do modo paralelo
+PARALLEL_MIN_ROWS = 100_000
+
+# Ordem dos tipos no resultado (a mesma em que as regras são avaliadas)
+VIOLATION_TYPE_ORDER = {'ALTO_VALOR_SEM_PO': 0, 'ITEM_PROIBIDO': 1, 'SMURFING_SUSPEITO': 2}
+
+
+def _format_dates(dates: pd.Series) -> pd.Series:
+    """Datas já convertidas (cache colunar) voltam ao formato texto do CSV"""
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.dt.strftime('%Y-%m-%d')
+    return dates
+
+
+def _violations_frame(matches: pd.DataFrame, tipo: str, severidade: str,
+                      regra) -> pd.DataFrame:
+    """Monta os registros de violação em bloco a partir das linhas selecionadas"""
+    return pd.DataFrame({
+        'id': matches['id_transacao'],
+        'tipo': tipo,
+        'funcionario': matches['funcionario'],
+        'valor': matches['valor'],
+        'descricao': matches['descricao'],
+        'data': _format_dates(matches['data']),
+        'severidade': severidade,
+        'regra': regra
+    }, index=matches.index, columns=VIOLATION_COLUMNS)
+
+
+def _rule_high_value(df: pd.DataFrame) -> pd.DataFrame:
+    """Regra 1: Despesas > $500 fora das categorias que normalmente passam disso"""
+    mask = (df['valor'] > 500) & ~df['categoria'].isin(HIGH_VALUE_EXEMPT_CATEGORIES)
+    return _violations_frame(
+        df[mask], 'ALTO_VALOR_SEM_PO', 'ALTA',
+        'Seção 1.3 - Despesas acima de $500 requerem Purchase Order'
+    )
+
+
+def _rule_forbidden_items(df: pd.DataFrame, matcher: KeywordMatcher) -> pd.DataFrame:
+    """Regra 2: Itens proibidos (primeira palavra-chave da lista que aparece)"""
+    matched = matcher.scan(df['descricao'])
+    return _violations_frame(
+        df.loc[matched.index], 'ITEM_PROIBIDO', 'CRÍTICA',
+        'Seção 3 - Item proibido detectado: ' + matched
+    )
+
+
+def _rule_smurfing(df: pd.DataFrame, window_days: Optional[int] = None) -> pd.DataFrame:
+    """
+    Regra 3: Smurfing - mesma pessoa dividindo uma compra para ficar abaixo de $500
+    
+    Sem janela, agrupa por funcionário, dia e categoria (comportamento
+    original). Com window_days, usa janelas móveis de N dias por funcionário,
+    atravessando categorias.
+    """
+    if window_days is None:
+        return _smurfing_same_day(df)
+    return _smurfing_rolling_window(df, window_days)
+
+
+def _smurfing_same_day(df: pd.DataFrame) -> pd.DataFrame:
+    """Smurfing no mesmo dia e mesma categoria"""
+    keys = ['funcionario', 'data', 'categoria']
+    grouped = df.groupby(keys, observed=True)
+    groups = grouped['valor'].agg(total='sum', count='count', maior='max')
+    
+    # Total > 500 mas dividido em múltiplas transações, todas < 500
+    mask = (groups['total'] > 500) & (groups['count'] > 1) & (groups['maior'] < 500)
+    
+    # Listas de IDs só para os grupos suspeitos
+    flagged_rows = mask.to_numpy()[grouped.ngroup().to_numpy()]
+    ids = df[flagged_rows].groupby(keys, observed=True)['id_transacao'].agg(list)
+    suspicious = groups[mask].join(ids).reset_index()
+    
+    return pd.DataFrame({
+        'id': suspicious['id_transacao'].str.join(', '),
+        'tipo': 'SMURFING_SUSPEITO',
+        'funcionario': suspicious['funcionario'],
+        'valor': suspicious['total'],
+        'descricao': [f"{count} transações no mesmo dia totalizando ${total:.2f}"
+                      for count, total in zip(suspicious['count'], suspicious['total'])],
+        'data': _format_dates(suspicious['data']),
+        'severidade': 'ALTA',
+        'regra': 'Seção 1.3 - Possível estruturação de compra para evitar aprovação'
+    }, index=suspicious.index, columns=VIOLATION_COLUMNS)
+
+
+def _smurfing_rolling_window(df: pd.DataFrame, window_days: int,
+                             end_from: Optional[pd.Timestamp] = None,
+                             end_before: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """
+    Smurfing em janelas móveis de window_days dias por funcionário
+    
+    Uma única ordenação por (funcionário, dia) seguida de agregados por dia e
+    somas acumuladas: cada janela é resolvida com searchsorted, em O(n log n).
+    Uma janela só é reportada se a janela seguinte do mesmo funcionário não a
+    contiver e também for suspeita (evita repetir o mesmo incidente).
+    
+    end_from/end_before restringem as janelas reportadas pelo dia final
+    (usado no modo streaming, que avalia o arquivo em partes).
+    """
+    if window_days < 1:
+        raise ValueError("window_days deve ser >= 1")
+    
+    ordered = df.assign(_dia=pd.to_datetime(df['data'], errors='coerce').dt.normalize())
+    ordered = ordered[ordered['_dia'].notna()].sort_values(
+        ['funcionario', '_dia'], kind='stable'
+    )
+    
+    # Um registro por funcionário/dia (a ordenação é preservada)
+    days = ordered.groupby(['funcionario', '_dia'], sort=False, observed=True).agg(
+        total=('valor', 'sum'),
+        count=('valor', 'count'),
+        maior=('valor', 'max'),
+        linhas=('valor', 'size')
+    ).reset_index()
+    if days.empty:
+        return pd.DataFrame(columns=VIOLATION_COLUMNS)
+    
+    # Chave (funcionário, dia) em um único inteiro ordenado
+    day_number = (days['_dia'] - days['_dia'].min()).dt.days.to_numpy()
+    employee_code = pd.factorize(days['funcionario'])[0]
+    stride = int(day_number.max()) + window_days + 1
+    key = employee_code.astype(np.int64) * stride + day_number
+    
+    # Primeiro dia de cada janela [dia - N + 1, dia]
+    start = np.searchsorted(key, key - (window_days - 1), side='left')
+    end = np.arange(len(days)) + 1
+    
+    def window_sum(values):
+        cumulative = np.concatenate(([0], np.cumsum(values)))
+        return cumulative[end] - cumulative[start]
+    
+    # Arredonda para centavos: a diferença de somas acumuladas carrega erro de
+    # ponto flutuante que dependeria da ordem/tamanho dos dados
+    total = np.round(window_sum(days['total'].to_numpy()), 2)
+    count = window_sum(days['count'].to_numpy())
+    big_days = window_sum((days['maior'] >= 500).to_numpy().astype(np.int64))
+    
+    # Total > 500 em múltiplas transações, nenhuma >= 500
+    qualifies = (total > 500) & (count > 1) & (big_days == 0)
+    
+    # Suprime janelas contidas na janela seguinte (também suspeita)
+    same_employee_next = np.append(employee_code[1:] == employee_code[:-1], False)
+    next_qualifies = np.append(qualifies[1:], False)
+    next_start = np.append(start[1:], len(days))
+    reported = qualifies & ~(same_employee_next & next_qualifies & (next_start <= start))
+    if end_from is not None:
+        reported &= (days['_dia'] >= end_from).to_numpy()
+    if end_before is not None:
+        reported &= (days['_dia'] < end_before).to_numpy()
+    
+    row_bounds = np.concatenate(([0], np.cumsum(days['linhas'].to_numpy())))
+    all_ids = ordered['id_transacao'].to_numpy()
+    dates = days['_dia'].dt.strftime('%Y-%m-%d').to_numpy()
+    
+    records = []
+    for i in np.flatnonzero(reported):
+        first = start[i]
+        span = f"{dates[first]} a {dates[i]}" if first != i else dates[i]
+        records.append({
+            'id': ', '.join(all_ids[row_bounds[first]:row_bounds[i + 1]]),
+            'tipo': 'SMURFING_SUSPEITO',
+            'funcionario': days['funcionario'].iat[i],
+            'valor': total[i],
+            'descricao': (f"{count[i]} transações em janela de {window_days} dias "
+                          f"totalizando ${total[i]:.2f}"),
+            'data': span,
+            'severidade': 'ALTA',
+            'regra': 'Seção 1.3 - Possível estruturação de compra para evitar aprovação'
+        })
+    
+    return pd.DataFrame(records, columns=VIOLATION_COLUMNS)
+
+
+def _merge_smurfing(frames: List[pd.DataFrame], window_days: Optional[int]) -> pd.DataFrame:
+    """
+    Junta resultados parciais do smurfing na ordem do modo em lote
+    
+    Cada parte já vem ordenada e nenhum (funcionário, dia) aparece em duas
+    partes, então uma ordenação estável por funcionário (e dia) basta.
+    """
+    result = pd.concat(frames, ignore_index=True)
+    keys = ['funcionario'] if window_days else ['funcionario', 'data']
+    return result.sort_values(keys, kind='stable')
+
+
+# Estado de cada processo do modo paralelo (preenchido por _init_worker)
+_worker_state = {}
+
+
+def _init_worker(df: pd.DataFrame, matcher: KeywordMatcher, window_days: Optional[int]):
+    """Recebe o DataFrame uma vez por processo (com fork, sem cópia)"""
+    _worker_state.update(df=df, matcher=matcher, window_days=window_days)
+
+
+def _evaluate_partition(positions: np.ndarray) -> List[pd.DataFrame]:
+    """Avalia as três regras nas linhas de uma partição (roda no processo filho)"""
+    part = _worker_state['df'].take(positions)
+    return [
+        _rule_high_value(part),
+        _rule_forbidden_items(part, _worker_state['matcher']),
+        _rule_smurfing(part, _worker_state['window_days']),
+    ]
+
+
+def _window_end(violation: Dict) -> str:
+    """Último dia de uma violação de smurfing ('AAAA-MM-DD' ou 'início a fim')"""
+    return violation['data'].split(' a ')[-1]
+
+
+def _sort_violations(violations: List[Dict]) -> List[Dict]:
+    """Ordena como check_simple_violations: por regra; smurfing por funcionário e dia"""
+    def key(violation):
+        order = VIOLATION_TYPE_ORDER.get(violation['tipo'], len(VIOLATION_TYPE_ORDER))
+        if violation['tipo'] != 'SMURFING_SUSPEITO':
+            return (order, '', '')
+        return (order, violation['funcionario'], _window_end(violation))
+    return sorted(violations, key=key)
+
+
+def _is_suspicious(df: pd.DataFrame) -> pd.Series:
+    """Transações que merecem análise contextual com emails"""
+    return (df['valor'] > 100) | (df['categoria'].isin(['Diversos', 'Segurança']))
+
+
+# IDs de transação citados no texto dos emails
+TRANSACTION_ID_PREFIX = 'TX_'
+TRANSACTION_ID_PATTERN = re.compile(rf'\b{TRANSACTION_ID_PREFIX}\w+')
+
+
+def _format_transaction(row) -> str:
+    """Linha de uma transação no prompt da análise contextual"""
+    return (
+        f"ID: {row.id_transacao} | "
+        f"Funcionário: {row.funcionario} | "
+        f"Data: {row.data} | "
+        f"Valor: ${row.valor:.2f} | "
+        f"Descrição: {row.descricao}"
+    )
+
+
+def _format_email(email: Dict) -> str:
+    """Email no prompt da análise contextual"""
+    return (
+        f"De: {email['de_nome']} <{email['de_email']}>\n"
+        f"Para: {email['para_nome']} <{email['para_email']}>\n"
+        f"Data: {email['data']}\n"
+        f"Assunto: {email['assunto']}\n"
+        f"Mensagem: {email['mensagem']}"
+    )
+
+
+# Chaves do smurfing no mesmo dia
+_SAME_DAY_KEYS = ['funcionario', 'data', 'categoria']
+
+
+def _same_day_keys(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Chaves (funcionário, dia, categoria) comparáveis entre blocos"""
+    return pd.DataFrame({
+        'funcionario': chunk['funcionario'].astype(str),
+        'data': chunk['data'],
+        'categoria': chunk['categoria'].astype(str),
+    }, index=chunk.index)
+
+
+class _SmurfingStream:
+    """
+    Estado da regra de smurfing entre blocos do modo streaming
+    
+    No mesmo dia/categoria, os totais de cada (funcionário, dia, categoria)
+    são somados entre blocos, em qualquer ordem do arquivo; no fim, só as
+    linhas dos grupos candidatos são relidas para montar as violações.
+    
+    Na janela móvel o arquivo precisa estar em ordem cronológica (como os
+    extratos do banco): um dia só é avaliado quando aparece um dia
+    posterior, e só ficam em memória as linhas ainda necessárias para
+    fechar as janelas pendentes.
+    """
+    
+    def __init__(self, window_days: Optional[int]):
+        self.window_days = window_days
+        self.buffer = None
+        self.last_day = None
+        self.emit_from = None
+        self.frames = []
+        self.day_totals = None
+    
+    def add(self, chunk: pd.DataFrame):
+        """Acrescenta um bloco e avalia os dias que ficaram fechados"""
+        if self.window_days is None:
+            self._add_day_totals(chunk)
+            return
+        
+        days = pd.to_datetime(chunk['data'], errors='coerce').dt.normalize()
+        rows = chunk[['id_transacao', 'funcionario', 'data', 'categoria', 'valor']]
+        rows = rows.assign(_dia=days)[days.notna()]
+        if rows.empty:
+            return
+        
+        if self.last_day is not None and rows['_dia'].min() < self.last_day:
+            raise ValueError(
+                "Arquivo de transações fora de ordem cronológica; a janela móvel "
+                "do smurfing (SMURFING_WINDOW_DAYS) no modo streaming exige linhas "
+                "ordenadas por data"
+            )
+        
+        self.buffer = rows if self.buffer is None else pd.concat([self.buffer, rows])
+        self.last_day = rows['_dia'].max()
+        self._flush(closed_until=self.last_day)
+    
+    def _add_day_totals(self, chunk: pd.DataFrame):
+        """Soma total, contagem e maior valor de cada grupo do dia aos acumulados"""
+        totals = _same_day_keys(chunk).assign(valor=chunk['valor']).groupby(
+            _SAME_DAY_KEYS, sort=False
+        )['valor'].agg(total='sum', count='count', maior='max')
+        if self.day_totals is not None:
+            totals = pd.concat([self.day_totals, totals]).groupby(level=_SAME_DAY_KEYS).agg(
+                total=('total', 'sum'), count=('count', 'sum'), maior=('maior', 'max')
+            )
+        self.day_totals = totals
+    
+    def finish(self, reread=None) -> pd.DataFrame:
+        """
+        Fecha todos os dias pendentes e devolve as violações na ordem do modo em lote
+        
+        Args:
+            reread: Função que lê o arquivo de novo em blocos; necessária no
+                smurfing do mesmo dia para buscar as linhas dos grupos candidatos
+        """
+        if self.window_days is None:
+            return self._finish_same_day(reread)
+        if self.buffer is not None:
+            self._flush(closed_until=None)
+        if not self.frames:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS)
+        
+        return _merge_smurfing(self.frames, self.window_days)
+    
+    def _finish_same_day(self, reread) -> pd.DataFrame:
+        totals = self.day_totals
+        if totals is None:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS)
+        # Folga de um centavo: a soma exata é refeita nas linhas relidas
+        candidates = totals[(totals['count'] > 1) & (totals['maior'] < 500)
+                            & (totals['total'] > 500 - 0.01)].index
+        if candidates.empty:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS)
+        
+        rows = []
+        for chunk in reread():
+            keys = pd.MultiIndex.from_frame(_same_day_keys(chunk))
+            rows.append(chunk[keys.isin(candidates)])
+        return _smurfing_same_day(pd.concat(rows))
+    
+    def _flush(self, closed_until: Optional[pd.Timestamp]):
+        buffer = self.buffer
+        closed = buffer if closed_until is None else buffer[buffer['_dia'] < closed_until]
+        
+        # Uma janela terminando no dia d só é final quando todos os dias até
+        # d + N - 1 estão fechados (a janela seguinte pode contê-la)
+        span = pd.Timedelta(days=self.window_days - 1)
+        end_before = None if closed_until is None else closed_until - span
+        if end_before is not None and self.emit_from is not None:
+            end_before = max(end_before, self.emit_from)
+        
+        self.frames.append(_smurfing_rolling_window(
+            closed, self.window_days, end_from=self.emit_from, end_before=end_before
+        ))
+        if end_before is not None:
+            self.emit_from = end_before
+            self.buffer = buffer[buffer['_dia'] >= end_before - span]
+
+
 class FraudDetector:
-    def __init__(self, transactions_file: str, policy_file: str):
+    def __init__(self, transactions_file: str, policy_file: str,
+                 smurfing_window_days: Optional[int] = None,
+                 keywords_file: Optional[str] = None,
+                 whole_words: bool = False,
+                 ignore_accents: bool = False,
+                 chunksize: Optional[int] = None,
+                 use_cache: bool = False,
+                 cache_dir: str = CACHE_DIR,
+                 workers: int = 1):
         """
         Inicializa o detector de fraudes
         
         Args:
             transactions_file: Caminho para CSV de transações
             policy_file: Caminho para política de compliance
+            smurfing_window_days: Janela móvel (em dias) da regra de smurfing,
+                atravessando categorias. None = mesmo dia e mesma categoria
+            keywords_file: Arquivo com as palavras-chave de itens proibidos
+                (uma por linha). None = lista padrão FORBIDDEN_KEYWORDS
+            whole_words: Itens proibidos só casam palavras inteiras
+            ignore_accents: Itens proibidos ignoram acentos (mágica = magica)
+            chunksize: Se definido, as transações são lidas e avaliadas em
+                blocos desse tamanho (modo streaming) em vez de carregadas
+                inteiras em memória
+            use_cache: Reaproveita um cache colunar (Parquet) do CSV, gerado
+                na primeira leitura e refeito quando o CSV muda
+            cache_dir: Diretório do cache colunar
+            workers: Processos usados nas regras simples. Com mais de 1, as
+                transações são particionadas por hash do funcionário (todas as
+                regras são locais a um funcionário)
         """
         self.transactions_file = transactions_file
         self.policy_file = policy_file
+        self.smurfing_window_days = smurfing_window_days
+        self.chunksize = chunksize
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        
+        self.cache = None
+        if use_cache:
+            if pyarrow_available():
+                self.cache = TransactionCache(transactions_file, TRANSACTION_DTYPES, cache_dir)
+            else:
+                print("[!] pyarrow não instalado - cache colunar desativado")
+                print("[!] Execute: pip install pyarrow")
+        
+        keywords = load_keywords(keywords_file) if keywords_file else FORBIDDEN_KEYWORDS
+        self.forbidden_matcher = KeywordMatcher(
+            keywords, whole_words=whole_words, ignore_accents=ignore_accents
+        )
         self.df = None
+        self.n_transactions = 0
         self.policy_text = None
         
-    def load_data(self):
-        """Carrega transações e política"""
-        print("[*] Carregando transações...")
-        self.df = pd.read_csv(self.transactions_file)
-        print(f"[OK] {len(self.df)} transações carregadas")
+    def load_data(self, columns: Optional[List[str]] = None):
+        """
+        Carrega transações e política
+        
+        Args:
+            columns: Colunas a carregar (padrão: as usadas pelas regras)
+        """
+        if self.chunksize:
+            print(f"[*] Modo streaming: transações lidas em blocos de {self.chunksize} linhas")
+        else:
+            print("[*] Carregando transações...")
+            self.df = self._read_transactions(columns)
+            self.n_transactions = len(self.df)
+            print(f"[OK] {len(self.df)} transações carregadas")
         
+        self.load_policy()
+    
+    def load_policy(self):
+        """Carrega só a política (a auditoria incremental lê apenas as transações novas)"""
         print("[*] Carregando política...")
         with open(self.policy_file, 'r', encoding='utf-8') as f:
             self.policy_text = f.read()
         print("[OK] Política carregada")
     
+    def _read_transactions(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Lê as transações (do cache colunar, se ativo) só com as colunas pedidas"""
+        columns = columns or list(TRANSACTION_DTYPES)
+        if self.cache is not None:
+            return self.cache.read(columns)
+        return pd.read_csv(
+            self.transactions_file,
+            usecols=columns,
+            dtype={column: TRANSACTION_DTYPES[column] for column in columns}
+        )
+    
+    def iter_chunks(self, columns: Optional[List[str]] = None):
+        """Lê as transações em blocos de tamanho fixo, com tipos explícitos"""
+        columns = columns or list(TRANSACTION_DTYPES)
+        chunksize = self.chunksize or 100_000
+        
+        if self.cache is not None:
+            yield from self.cache.iter_batches(chunksize, columns)
+            return
+        
+        reader = pd.read_csv(
+            self.transactions_file,
+            usecols=columns,
+            dtype={column: TRANSACTION_DTYPES[column] for column in columns},
+            chunksize=chunksize
+        )
+        with reader:
+            yield from reader
+    
     def check_simple_violations(self) -> List[Dict]:
         """
         Verifica violações simples de compliance baseadas em regras
         
+        Cada regra é avaliada de forma vetorizada (máscara booleana sobre as
+        colunas) e os registros de violação são montados em bloco.
+        
         Regras verificadas:
         1. Despesas > $500 sem aprovação prévia (Purchase Order)
         2. Itens proibidos (armas, mágica, etc)
         3. Smurfing (divisão de compras grandes)
         """
+        print("\n[*] Verificando violações simples...")
+        
+        if self.df is None and self.chunksize:
+            frames = self._evaluate_rules_streaming()
+        elif self.workers > 1 and len(self.df) >= PARALLEL_MIN_ROWS:
+            frames = self._evaluate_rules_parallel()
+        else:
+            frames = [
+                _rule_high_value(self.df),
+                _rule_forbidden_items(self.df, self.forbidden_matcher),
+                _rule_smurfing(self.df, self.smurfing_window_days),
+            ]
         violations = []
+        for frame in frames:
+            violations.extend(frame.to_dict('records'))
         
-        print("\n[*] Verificando violações simples...")
+        print(f"[!] {len(violations)} violações simples detectadas")
+        return violations
+    
+    def _evaluate_rules_parallel(self) -> List[pd.DataFrame]:
+        """
+        Avalia as regras em um pool de processos, particionando por funcionário
         
-        # Regra 1: Despesas > $500
-        high_value = self.df[self.df['valor'] > 500]
-        for _, row in high_value.iterrows():
-            # Verificar se não é uma categoria que normalmente passa de $500
-            if row['categoria'] not in ['Viagem', 'Hospedagem']:
-                violations.append({
-                    'id': row['id_transacao'],
-                    'tipo': 'ALTO_VALOR_SEM_PO',
-                    'funcionario': row['funcionario'],
-                    'valor': row['valor'],
-                    'descricao': row['descricao'],
-                    'data': row['data'],
-                    'severidade': 'ALTA',
-                    'regra': 'Seção 1.3 - Despesas acima de $500 requerem Purchase Order'
-                })
-        
-        # Regra 2: Itens proibidos
-        forbidden_keywords = [
-            'arma', 'airsoft', 'katana', 'ninja', 'mágica', 'magic',
-            'algema', 'corrente', 'pombo', 'karaoke', 'discoteca',
-            'vigilância', 'binóculo', 'walkie', 'spy', 'armadilha',
-            'hooters', 'strip'
-        ]
+        O resultado é mesclado na mesma ordem da execução serial: regras 1 e 2
+        pela posição da linha, smurfing por funcionário e dia.
+        """
+        print(f"[*] Avaliando regras em {self.workers} processos...")
+        
+        hashes = pd.util.hash_pandas_object(self.df['funcionario'], index=False).to_numpy()
+        partition = hashes % np.uint64(self.workers)
+        tasks = [np.flatnonzero(partition == i) for i in range(self.workers)]
+        tasks = [positions for positions in tasks if len(positions)]
+        
+        with ProcessPoolExecutor(
+            max_workers=len(tasks),
+            initializer=_init_worker,
+            initargs=(self.df, self.forbidden_matcher, self.smurfing_window_days)
+        ) as executor:
+            results = list(executor.map(_evaluate_partition, tasks))
+        
+        high_value = pd.concat([r[0] for r in results]).sort_index(kind='stable')
+        forbidden = pd.concat([r[1] for r in results]).sort_index(kind='stable')
+        smurfing = _merge_smurfing([r[2] for r in results], self.smurfing_window_days)
+        return [high_value, forbidden, smurfing]
+    
+    def _evaluate_rules_streaming(self) -> List[pd.DataFrame]:
+        """Avalia as regras bloco a bloco; só as violações ficam em memória"""
+        if self.smurfing_window_days is not None:
+            self._check_chronological()
+        
+        high_value, forbidden = [], []
+        smurfing = _SmurfingStream(self.smurfing_window_days)
+        self.n_transactions = 0
+        
+        for chunk in self.iter_chunks():
+            self.n_transactions += len(chunk)
+            high_value.append(_rule_high_value(chunk))
+            forbidden.append(_rule_forbidden_items(chunk, self.forbidden_matcher))
+            smurfing.add(chunk)
+        
+        print(f"[OK] {self.n_transactions} transações avaliadas em blocos")
+        return high_value + forbidden + [smurfing.finish(reread=self.iter_chunks)]
+    
+    def _check_chronological(self):
+        """
+        Confere, antes de avaliar qualquer regra, que os blocos estão em ordem
+        cronológica (exigido pela janela móvel do smurfing no modo streaming)
+        
+        Lê só a coluna de datas, nos mesmos blocos da avaliação.
+        """
+        last_day = None
+        for chunk in self.iter_chunks(columns=['data']):
+            days = pd.to_datetime(chunk['data'], errors='coerce').dropna()
+            if days.empty:
+                continue
+            if last_day is not None and days.min().normalize() < last_day:
+                raise ValueError(
+                    "Arquivo de transações fora de ordem cronológica; a janela móvel "
+                    "do smurfing (SMURFING_WINDOW_DAYS) no modo streaming exige linhas "
+                    "ordenadas por data"
+                )
+            last_day = days.max().normalize()
+    
+    def check_simple_violations_incremental(self, state: AuditState) -> List[Dict]:
+        """
+        Verifica violações simples apenas nas transações novas
+        
+        O CSV é tratado como append-only: a marca d'água guarda quantas linhas
+        já foram auditadas e o ID da última. Regras 1 e 2 rodam só nas linhas
+        novas; o smurfing reavalia só os dias tocados por elas (mais a janela
+        anterior). O resultado é mesclado ao histórico salvo em state.
+        
+        Args:
+            state: Estado persistido do dataset de transações
+            
+        Returns:
+            Todas as violações conhecidas (histórico + novas)
+        """
+        print("\n[*] Verificando violações simples (incremental)...")
+        
+        config = self._rules_fingerprint()
+        if not state.is_new and state.watermark.get('config') != config:
+            print("[!] Regras mudaram desde a última auditoria - auditando tudo novamente")
+            state.reset()
+        
+        new_rows = self._new_rows(state)
+        print(f"[*] {len(new_rows)} transações novas desde a última auditoria")
         
-        for _, row in self.df.iterrows():
-            desc_lower = row['descricao'].lower()
-            for keyword in forbidden_keywords:
-                if keyword in desc_lower:
-                    violations.append({
-                        'id': row['id_transacao'],
-                        'tipo': 'ITEM_PROIBIDO',
-                        'funcionario': row['funcionario'],
-                        'valor': row['valor'],
-                        'descricao': row['descricao'],
-                        'data': row['data'],
-                        'severidade': 'CRÍTICA',
-                        'regra': 'Seção 3 - Item proibido detectado: ' + keyword
-                    })
-                    break
-        
-        # Regra 3: Smurfing - mesma pessoa, mesmo dia, valores suspeitos
-        df_grouped = self.df.groupby(['funcionario', 'data', 'categoria']).agg({
-            'valor': ['sum', 'count'],
-            'id_transacao': list,
-            'descricao': list
-        }).reset_index()
-        
-        for _, group in df_grouped.iterrows():
-            total = group[('valor', 'sum')]
-            count = group[('valor', 'count')]
+        if not new_rows.empty:
+            found = (
+                _rule_high_value(new_rows).to_dict('records') +
+                _rule_forbidden_items(new_rows, self.forbidden_matcher).to_dict('records')
+            )
+            smurfing, is_affected = self._smurfing_for_new_rows(new_rows)
+            kept = [v for v in state.records
+                    if not (v['tipo'] == 'SMURFING_SUSPEITO' and is_affected(v))]
             
-            # Se total > 500 mas dividido em múltiplas transações < 500
-            if total > 500 and count > 1:
-                transactions = group[('id_transacao', 'list')]
-                if all(self.df[self.df['id_transacao'] == tid]['valor'].values[0] < 500 
-                       for tid in transactions):
-                    violations.append({
-                        'id': ', '.join(transactions),
-                        'tipo': 'SMURFING_SUSPEITO',
-                        'funcionario': group['funcionario'],
-                        'valor': total,
-                        'descricao': f"{count} transações no mesmo dia totalizando ${total:.2f}",
-                        'data': group['data'],
-                        'severidade': 'ALTA',
-                        'regra': 'Seção 1.3 - Possível estruturação de compra para evitar aprovação'
-                    })
+            print(f"[!] {len(found) + len(smurfing)} violações nas transações novas")
+            state.records = _sort_violations(kept + found + smurfing)
+            state.watermark = {
+                'rows': self.n_transactions,
+                'last_id': str(new_rows['id_transacao'].iat[-1]),
+                'last_date': str(_format_dates(new_rows['data']).iat[-1]),
+                'config': config
+            }
+            state.save()
         
-        print(f"[!] {len(violations)} violações simples detectadas")
+        violations = list(state.records)
+        print(f"[!] {len(violations)} violações simples no histórico")
         return violations
     
-    def check_contextual_violations(self, emails_file: str) -> List[Dict]:
+    def _new_rows(self, state: AuditState) -> pd.DataFrame:
+        """
+        Transações depois da marca d'água de state (lidas sem carregar o arquivo)
+        
+        Se a linha anterior à marca d'água não for a mesma da última execução,
+        o arquivo foi reescrito: state é zerado e todas as linhas são devolvidas.
+        Atualiza n_transactions.
+        """
+        start = state.watermark.get('rows', 0)
+        new_rows = self._read_rows_from(max(start - 1, 0))
+        if start:
+            if new_rows.empty or new_rows['id_transacao'].iat[0] != state.watermark.get('last_id'):
+                print("[!] Arquivo de transações foi reescrito - auditando tudo novamente")
+                state.reset()
+                start = 0
+                new_rows = self._read_rows_from(0)
+            else:
+                new_rows = new_rows.iloc[1:]
+        
+        self.n_transactions = start + len(new_rows)
+        return new_rows
+    
+    def _rules_fingerprint(self) -> Dict:
+        """Configuração das regras; se mudar, o histórico salvo deixa de valer"""
+        keywords = '\n'.join(self.forbidden_matcher.keywords)
+        return {
+            'smurfing_window_days': self.smurfing_window_days,
+            'keywords': hashlib.sha1(keywords.encode('utf-8')).hexdigest(),
+            'whole_words': self.forbidden_matcher.whole_words,
+            'ignore_accents': self.forbidden_matcher.ignore_accents
+        }
+    
+    def _smurfing_for_new_rows(self, new_rows: pd.DataFrame):
+        """
+        Reavalia o smurfing nos dias afetados pelas transações novas
+        
+        Returns:
+            (violações recalculadas, função que diz se uma violação salva
+            pertence aos dias recalculados e deve ser substituída)
+        """
+        first_new = pd.to_datetime(new_rows['data'], errors='coerce').dt.normalize().min()
+        if pd.isna(first_new):
+            return [], lambda violation: False
+        
+        if self.smurfing_window_days is None:
+            new_dates = new_rows['data'].unique()
+            context = self._read_rows_since(first_new)
+            context = context[context['data'].isin(new_dates)]
+            affected = set(_format_dates(pd.Series(new_dates)))
+            return (_smurfing_same_day(context).to_dict('records'),
+                    lambda violation: violation['data'] in affected)
+        
+        # Janelas que terminam até N-1 dias antes podem ser absorvidas pelas
+        # novas; o conteúdo delas começa outros N-1 dias antes
+        span = pd.Timedelta(days=self.smurfing_window_days - 1)
+        recompute_from = first_new - span
+        context = self._read_rows_since(recompute_from - span)
+        cutoff = recompute_from.strftime('%Y-%m-%d')
+        found = _smurfing_rolling_window(
+            context, self.smurfing_window_days, end_from=recompute_from
+        )
+        return (found.to_dict('records'),
+                lambda violation: _window_end(violation) >= cutoff)
+    
+    def _read_rows_from(self, start: int) -> pd.DataFrame:
+        """Transações a partir da posição start (índice = posição no arquivo)"""
+        if self.df is not None:
+            return self.df.iloc[start:]
+        if self.cache is not None:
+            return self.cache.read_from(start)
+        
+        df = pd.read_csv(
+            self.transactions_file,
+            usecols=list(TRANSACTION_DTYPES),
+            dtype=TRANSACTION_DTYPES,
+            skiprows=range(1, start + 1)
+        )
+        df.index = pd.RangeIndex(start, start + len(df))
+        return df
+    
+    def _read_rows_since(self, first_day: pd.Timestamp) -> pd.DataFrame:
+        """Transações com data >= first_day"""
+        if self.cache is not None and self.df is None:
+            return self.cache.read_since(first_day)
+        
+        frames = [self.df] if self.df is not None else self.iter_chunks()
+        parts = [
+            frame[pd.to_datetime(frame['data'], errors='coerce') >= first_day]
+            for frame in frames
+        ]
+        return pd.concat(parts) if parts else pd.DataFrame(columns=list(TRANSACTION_DTYPES))
+    
+    def _suspicious_transactions(self, limit: Optional[int] = None) -> pd.DataFrame:
+        """Seleciona transações para a análise contextual (em blocos no modo streaming)"""
+        if self.df is not None:
+            selected = self.df[_is_suspicious(self.df)]
+            selected = selected if limit is None else selected.head(limit)
+            return selected.assign(data=_format_dates(selected['data']))
+        
+        parts, total = [], 0
+        for chunk in self.iter_chunks():
+            part = chunk[_is_suspicious(chunk)]
+            if limit is not None:
+                part = part.head(limit - total)
+            parts.append(part)
+            total += len(part)
+            if limit is not None and total >= limit:
+                break
+        if not parts:
+            return pd.DataFrame(columns=list(TRANSACTION_DTYPES))
+        selected = pd.concat(parts)
+        return selected.assign(data=_format_dates(selected['data']))
+    
+    def _plan_contextual_batches(self, transactions: pd.DataFrame, emails: List[Dict],
+                                 budget: int) -> List[Dict]:
+        """
+        Distribui transações suspeitas e emails relacionados em prompts
+        
+        Cada funcionário forma uma unidade com suas transações e os emails em
+        que participa ou que citam um dos IDs. Unidades pequenas dividem o
+        mesmo prompt. Unidades que não cabem no orçamento são divididas em
+        blocos de transações em ordem de data (até 1/3 do orçamento), e cada
+        bloco leva os emails mais relevantes que completam o restante:
+        primeiro os que citam um ID do bloco, depois os do funcionário com
+        data mais próxima das transações do bloco.
+        
+        Assim cada transação é enviada uma vez: o custo esperado é o da linha
+        da transação (~35 tokens) mais a sua parte dos emails, ou seja, até
+        ~3x a linha (~100 tokens por transação) nas unidades divididas, em vez
+        de crescer com o número de emails do funcionário.
+        
+        Args:
+            transactions: Transações candidatas (datas já em texto)
+            emails: Emails parseados pelo ConspiracyDetector
+            budget: Tokens de conteúdo por prompt
+        """
+        email_texts = [_format_email(email) for email in emails]
+        email_costs = [count_tokens(text) for text in email_texts]
+        email_days = pd.to_datetime(
+            pd.Series([email['data'] for email in emails], dtype=object), errors='coerce'
+        ).dt.normalize()
+        
+        candidate_ids = set(transactions['id_transacao'])
+        emails_by_person = defaultdict(set)
+        emails_by_id = defaultdict(set)
+        for i, email in enumerate(emails):
+            participants = person_keys(email['de_nome'], email['de_email']) \
+                | person_keys(email['para_nome'], email['para_email'])
+            for person in participants:
+                emails_by_person[person].add(i)
+            for tx_id in TRANSACTION_ID_PATTERN.findall(email['assunto'] + ' ' + email['mensagem']):
+                if tx_id in candidate_ids:
+                    emails_by_id[tx_id].add(i)
+        
+        units = []
+        for employee, group in transactions.groupby('funcionario', sort=False, observed=True):
+            lines = [_format_transaction(row) for row in group.itertuples(index=False)]
+            line_costs = {line: count_tokens(line) for line in lines}
+            related = set(emails_by_person.get(person_key(employee), ()))
+            for tx_id in group['id_transacao']:
+                related |= emails_by_id.get(tx_id, set())
+            related = sorted(related)
+            
+            total = sum(line_costs.values()) + sum(email_costs[i] for i in related)
+            if total <= budget:
+                units.append((lines, related))
+                continue
+            
+            # Unidade grande: blocos de transações próximas no tempo, cada um
+            # com os emails que mais lhe dizem respeito
+            days = pd.to_datetime(group['data'], errors='coerce')
+            ids = group['id_transacao'].to_numpy()
+            rows = [(lines[k], ids[k], days.iat[k])
+                    for k in np.argsort(days.to_numpy(), kind='stable')]  # datas inválidas no fim
+            for chunk in pack_batches(rows, lambda row: line_costs[row[0]], budget // 3):
+                chunk_lines = [line for line, _, _ in chunk]
+                room = budget - sum(line_costs[line] for line in chunk_lines)
+                selected = self._select_chunk_emails(
+                    chunk, related, emails_by_id, email_days, email_costs, room
+                )
+                units.append((chunk_lines, selected))
+        
+        # Empacota as unidades em ordem; emails em comum não são repetidos
+        batches, current = [], None
+        for lines, related in units:
+            lines_cost = sum(count_tokens(line) for line in lines)
+            if current is not None:
+                new_emails = set(related) - current['emails']
+                extra = lines_cost + sum(email_costs[i] for i in new_emails)
+                if current['tokens'] + extra <= budget:
+                    current['lines'].extend(lines)
+                    current['emails'] |= new_emails
+                    current['tokens'] += extra
+                    continue
+                batches.append(current)
+            current = {
+                'lines': list(lines),
+                'emails': set(related),
+                'tokens': lines_cost + sum(email_costs[i] for i in related)
+            }
+        if current is not None:
+            batches.append(current)
+        
+        return [
+            {
+                'transacoes': "\n".join(batch['lines']),
+                'emails': "\n---\n".join(email_texts[i] for i in sorted(batch['emails']))
+                          or "(nenhum email relacionado)",
+                'tokens': batch['tokens']
+            }
+            for batch in batches
+        ]
+    
+    @staticmethod
+    def _select_chunk_emails(chunk: List[Tuple], related: List[int], emails_by_id: Dict,
+                             email_days: pd.Series, email_costs: List[int],
+                             room: int) -> List[int]:
+        """
+        Emails de um bloco de transações, até room tokens
+        
+        Prioridade: emails que citam um ID do bloco e, em seguida, os demais
+        emails da unidade pela distância (em dias) até a transação mais
+        próxima do bloco; emails sem data vão por último.
+        """
+        cited = set()
+        for _, tx_id, _ in chunk:
+            cited |= emails_by_id.get(tx_id, set())
+        
+        tx_days = np.sort(np.array([day.value for _, _, day in chunk if not pd.isna(day)],
+                                   dtype=np.int64))
+        
+        def distance(i):
+            day = email_days.iat[i]
+            if pd.isna(day) or not len(tx_days):
+                return np.inf
+            pos = np.searchsorted(tx_days, day.value)
+            neighbors = tx_days[max(pos - 1, 0):pos + 1]
+            return float(np.abs(neighbors - day.value).min())
+        
+        ranked = sorted(related, key=lambda i: (i not in cited, distance(i), i))
+        selected, used = [], 0
+        for i in ranked:
+            if used + email_costs[i] <= room:
+                selected.append(i)
+                used += email_costs[i]
+        return sorted(selected)
+    
+    def check_contextual_violations(self, emails_file: str,
+                                    token_budget: int = PROMPT_TOKEN_BUDGET,
+                                    store=None,
+                                    preprocess: bool = EMAIL_PREPROCESS,
+                                    transactions: Optional[pd.DataFrame] = None) -> Dict:
         """
         Verifica violações que requerem contexto de emails
         Procura por combinações suspeitas de emails + transações
+        
+        Todas as transações suspeitas são analisadas: o planejador as divide,
+        junto com os emails relacionados, em lotes que cabem em token_budget.
+        Os lotes vão para a LLM em paralelo (até LLM_MAX_CONCURRENCY chamadas).
+        
+        Args:
+            emails_file: Caminho para o arquivo de emails
+            token_budget: Tokens de conteúdo (transações + emails) por prompt
+            store: EmailStore já carregado (opcional); só os emails dos
+                funcionários envolvidos ou que citam transações são lidos
+            preprocess: Remove histórico citado e quase-duplicatas dos
+                emails antes de montar os prompts
+            transactions: Transações a analisar (datas em texto); padrão:
+                todas as suspeitas do arquivo
         """
         print("\n[*] Verificando violações contextuais (com emails)...")
         
-        violations = []
-        
-        # Carregar emails
-        with open(emails_file, 'r', encoding='utf-8') as f:
-            email_content = f.read()
-        
-        # Preparar transações suspeitas para análise
-        suspicious_transactions = self.df[
-            (self.df['valor'] > 100) | 
-            (self.df['categoria'].isin(['Diversos', 'Segurança']))
-        ].head(50)  # Limitar para não explodir o contexto
-        
-        # Criar contexto
-        trans_text = []
-        for _, row in suspicious_transactions.iterrows():
-            trans_text.append(
-                f"ID: {row['id_transacao']} | "
-                f"Funcionário: {row['funcionario']} | "
-                f"Data: {row['data']} | "
-                f"Valor: ${row['valor']:.2f} | "
-                f"Descrição: {row['descricao']}"
-            )
+        suspicious_transactions = self._suspicious_transactions() \
+            if transactions is None else transactions
+        if store is not None:
+            employees = suspicious_transactions['funcionario'].astype(str).unique()
+            emails = store.related(employees, any_terms=[TRANSACTION_ID_PREFIX + '*'])
+            print(f"[*] {len(emails)} emails relacionados na base")
+        else:
+            emails = ConspiracyDetector(emails_file).parse_emails()
+        if preprocess:
+            emails, _ = preprocess_emails(emails)
         
-        context = {
-            "transacoes": "\n".join(trans_text[:30]),
-            "emails": email_content[:8000]  # Limitar tamanho
-        }
+        batches = self._plan_contextual_batches(suspicious_transactions, emails, token_budget)
+        planned_tokens = sum(batch['tokens'] for batch in batches)
+        print(f"[*] {len(suspicious_transactions)} transações em {len(batches)} lotes "
+              f"(~{planned_tokens:,} tokens de conteúdo)")
         
         # Prompt para análise contextual
         prompt = ChatPromptTemplate.from_messages([
@@ -184,16 +993,114 @@ EMAILS CORPORATIVOS:
 Analise e identifique fraudes com evidência clara nos emails.""")
         ])
         
-        llm = get_llm()
-        chain = prompt | llm
+        violations, unparsed, failed = [], [], 0
+        if batches:
+            llm = get_llm()
+            chain = prompt | llm
+            
+            inputs = [{"transacoes": b['transacoes'], "emails": b['emails']} for b in batches]
+            results = LLMExecutor(chain).batch(
+                inputs,
+                config=telemetry_config("modulo3_fraudes", "analise_contextual"),
+                return_exceptions=True
+            )
+            
+            # Junta os resultados dos lotes (uma transação/tipo aparece uma vez)
+            seen = set()
+            for result in results:
+                if isinstance(result, Exception):
+                    print(f"[!] Lote falhou: {result}")
+                    failed += 1
+                    continue
+                data = parse_json_response(result.content)
+                if data is None:
+                    unparsed.append(result.content)
+                    continue
+                for violation in data.get('violations', []):
+                    key = (violation.get('transaction_id'), violation.get('fraud_type'))
+                    if key not in seen:
+                        seen.add(key)
+                        violations.append(violation)
+        
+        analysis = json.dumps({"violations": violations}, ensure_ascii=False, indent=2)
+        if unparsed:
+            analysis += "\n\nRespostas fora do formato JSON:\n" + "\n---\n".join(unparsed)
+        
+        print(f"[OK] Análise contextual concluída ({len(violations)} violações, "
+              f"{failed} lotes com falha)")
+        
+        return {
+            "contextual_analysis": analysis,
+            "violations": violations,
+            "transactions_analyzed": len(suspicious_transactions),
+            "batches": len(batches),
+            "failed_batches": failed
+        }
+    
+    def check_contextual_violations_incremental(self, state: AuditState, emails_file: str,
+                                                token_budget: int = PROMPT_TOKEN_BUDGET,
+                                                store=None,
+                                                preprocess: bool = EMAIL_PREPROCESS) -> Dict:
+        """
+        Análise contextual só das transações suspeitas novas
+        
+        A marca d'água é própria (em state), então uma falha da LLM não faz a
+        análise pular linhas que as regras simples já marcaram. As violações
+        encontradas entram no histórico de state; se algum lote falhar, a
+        marca d'água não avança e as transações novas são refeitas na próxima
+        execução (os lotes que deram certo voltam do cache da LLM).
+        
+        Transações antigas não são reavaliadas quando chegam emails novos
+        sobre elas; para isso, apague o estado (.audit_state/).
+        
+        Args:
+            state: Estado persistido da análise contextual
+            emails_file: Caminho para o arquivo de emails
+            token_budget: Tokens de conteúdo (transações + emails) por prompt
+            store: EmailStore já carregado (opcional)
+            preprocess: Remove histórico citado e quase-duplicatas dos emails
+            
+        Returns:
+            Mesmo formato de check_contextual_violations, com o histórico
+            completo em 'violations'
+        """
+        print("\n[*] Verificando violações contextuais (incremental)...")
+        
+        new_rows = self._new_rows(state)
+        suspicious = new_rows[_is_suspicious(new_rows)]
+        suspicious = suspicious.assign(data=_format_dates(suspicious['data']))
+        print(f"[*] {len(suspicious)} transações suspeitas novas desde a última análise")
+        
+        result = {"transactions_analyzed": 0, "batches": 0, "failed_batches": 0}
+        if not suspicious.empty:
+            result = self.check_contextual_violations(
+                emails_file, token_budget, store=store, preprocess=preprocess,
+                transactions=suspicious
+            )
         
-        result = chain.invoke(context)
+        seen = {(v.get('transaction_id'), v.get('fraud_type')) for v in state.records}
+        for violation in result.get('violations', []):
+            key = (violation.get('transaction_id'), violation.get('fraud_type'))
+            if key not in seen:
+                seen.add(key)
+                state.records.append(violation)
         
-        print("[OK] Análise contextual concluída")
+        if result['failed_batches']:
+            print("[!] Lotes com falha - marca d'água mantida para refazer as transações novas")
+        elif not new_rows.empty:
+            state.watermark = {
+                'rows': self.n_transactions,
+                'last_id': str(new_rows['id_transacao'].iat[-1])
+            }
+        state.save()
         
+        violations = list(state.records)
+        print(f"[!] {len(violations)} violações contextuais no histórico")
         return {
-            "contextual_analysis": result.content,
-            "transactions_analyzed": len(suspicious_transactions)
+            **result,
+            "contextual_analysis": json.dumps({"violations": violations},
+                                              ensure_ascii=False, indent=2),
+            "violations": violations
         }
     
     def generate_report(self, simple_violations: List[Dict], 
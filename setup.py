@@ -80,7 +80,8 @@ def check_dependencies():
     }
     
     optional = {
-        'langchain_groq': 'langchain-groq (RECOMENDADO para usar Groq)'
+        'langchain_groq': 'langchain-groq (RECOMENDADO para usar Groq)',
+        'pyarrow': 'pyarrow (cache colunar das transações)'
     }
     
     missing = []
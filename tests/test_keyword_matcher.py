@@ -0,0 +1,20 @@
+import pandas as pd
+import pytest
+
+from keyword_matcher import KeywordMatcher
+
+
+@pytest.mark.parametrize("dtype", ["string[pyarrow]", object])
+def test_normalize_series_ignore_accents(dtype):
+    matcher = KeywordMatcher(["mágica"], ignore_accents=True)
+    texts = pd.Series(["Compra MÁGICA", "Ação"], dtype=dtype)
+
+    assert matcher.normalize_series(texts).tolist() == ["compra magica", "acao"]
+
+
+@pytest.mark.parametrize("dtype", ["string[pyarrow]", object])
+def test_scan_ignore_accents(dtype):
+    matcher = KeywordMatcher(["mágica", "arma"], whole_words=True, ignore_accents=True)
+    texts = pd.Series(["Show de MAGICA", "armário novo", None, "Arma"], dtype=dtype)
+
+    assert matcher.scan(texts).to_dict() == {0: "mágica", 3: "arma"}
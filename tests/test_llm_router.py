@@ -0,0 +1,179 @@
+import asyncio
+import time
+from typing import Any, List, Optional
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import llm_executor
+from llm_router import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RoutedChatModel
+
+
+class StubBackend(BaseChatModel):
+    """Backend local: responde reply após delay, falhando nas primeiras `failures` chamadas"""
+
+    reply: str
+    failures: int = 0
+    delay: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _answer(self) -> ChatResult:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError(f"{self.reply} fora do ar")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        time.sleep(self.delay)
+        return self._answer()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self._answer()
+
+
+@pytest.fixture(autouse=True)
+def unlimited_backends(monkeypatch):
+    # Os stubs não têm limite de requisições/tokens por minuto
+    for name in ("a", "b"):
+        monkeypatch.setitem(llm_executor._limiters, name,
+                            llm_executor.ProviderLimiter(rpm=1_000_000, tpm=1_000_000_000))
+
+
+def make_router(a: StubBackend, b: StubBackend, **kwargs) -> RoutedChatModel:
+    options = {'failure_threshold': 2, 'cooldown_seconds': 0.1}
+    options.update(kwargs)
+    return RoutedChatModel(backends={'a': a, 'b': b}, **options)
+
+
+def test_falls_back_to_next_backend():
+    a, b = StubBackend(reply="a", failures=1), StubBackend(reply="b")
+    router = make_router(a, b)
+
+    assert router.invoke("oi").content == "b"
+    assert (a.calls, b.calls) == (1, 1)
+    assert router.health()['a']['taxa_erro'] == 1.0
+
+
+def test_async_falls_back_to_next_backend():
+    a, b = StubBackend(reply="a", failures=1), StubBackend(reply="b")
+    router = make_router(a, b)
+
+    assert asyncio.run(router.ainvoke("oi")).content == "b"
+    assert (a.calls, b.calls) == (1, 1)
+
+
+def test_all_backends_failing_raises_last_error():
+    router = make_router(StubBackend(reply="a", failures=5), StubBackend(reply="b", failures=5))
+
+    with pytest.raises(ConnectionError, match="b fora do ar"):
+        router.invoke("oi")
+
+
+def test_breaker_opens_and_skips_backend():
+    a, b = StubBackend(reply="a", failures=100), StubBackend(reply="b")
+    router = make_router(a, b, cooldown_seconds=60)
+
+    for _ in range(3):
+        assert router.invoke("oi").content == "b"
+
+    assert router.health()['a']['circuito'] == OPEN
+    assert a.calls == 2
+
+
+def test_breaker_half_open_recovers():
+    a, b = StubBackend(reply="a", failures=2), StubBackend(reply="b", delay=0.01)
+    router = make_router(a, b)
+    router.invoke("oi")
+    router.invoke("oi")
+    assert router.health()['a']['circuito'] == OPEN
+
+    time.sleep(0.15)
+    # Chamada de teste no backend meio-aberto (sem latência medida, vem primeiro)
+    assert router.invoke("oi").content == "a"
+    assert router.health()['a']['circuito'] == CLOSED
+
+
+def test_breaker_half_open_failure_reopens():
+    a, b = StubBackend(reply="a", failures=3), StubBackend(reply="b", delay=0.01)
+    router = make_router(a, b)
+    router.invoke("oi")
+    router.invoke("oi")
+
+    time.sleep(0.15)
+    assert router.invoke("oi").content == "b"
+    assert a.calls == 3
+    assert router.health()['a']['circuito'] == OPEN
+
+
+def test_half_open_allows_one_trial_at_a_time():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=0.05)
+    breaker.failure(error_rate=1.0, samples=1)
+    assert not breaker.available()
+
+    time.sleep(0.06)
+    # available não reserva a chamada de teste
+    assert breaker.available() and breaker.available()
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    assert not breaker.available()
+
+
+def test_hedge_slow_primary_loses():
+    a, b = StubBackend(reply="a", delay=0.5), StubBackend(reply="b")
+    router = make_router(a, b, hedge=True, hedge_after_seconds=0.05)
+
+    start = time.monotonic()
+    assert router.invoke("oi").content == "b"
+    assert time.monotonic() - start < 0.4
+
+
+def test_hedge_fast_primary_wins_alone():
+    a, b = StubBackend(reply="a"), StubBackend(reply="b")
+    router = make_router(a, b, hedge=True, hedge_after_seconds=0.5)
+
+    assert router.invoke("oi").content == "a"
+    assert b.calls == 0
+
+
+def test_async_hedge_slow_primary_loses():
+    a, b = StubBackend(reply="a", delay=0.5), StubBackend(reply="b")
+    router = make_router(a, b, hedge=True, hedge_after_seconds=0.05)
+
+    async def run():
+        start = time.monotonic()
+        message = await router.ainvoke("oi")
+        return message, time.monotonic() - start
+
+    message, elapsed = asyncio.run(run())
+    assert message.content == "b"
+    assert elapsed < 0.4
+
+
+def test_stream_falls_back_before_first_chunk():
+    a, b = StubBackend(reply="a", failures=1), StubBackend(reply="b")
+    router = make_router(a, b)
+
+    assert "".join(chunk.content for chunk in router.stream("oi")) == "b"
+    assert router.health()['a']['chamadas'] == 1
+
+
+def test_async_stream_falls_back_before_first_chunk():
+    a, b = StubBackend(reply="a", failures=1), StubBackend(reply="b")
+    router = make_router(a, b)
+
+    async def run():
+        return "".join([chunk.content async for chunk in router.astream("oi")])
+
+    assert asyncio.run(run()) == "b"
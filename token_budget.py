@@ -0,0 +1,54 @@
+"""
+Orçamento de tokens dos prompts
+Conta tokens com tiktoken e agrupa itens em lotes que cabem no contexto
+"""
+
+import os
+from functools import lru_cache
+from typing import Callable, List, TypeVar
+
+T = TypeVar('T')
+
+# Tokens disponíveis para o conteúdo variável de cada prompt (sem o template
+# e sem a resposta). O padrão cabe no limite por minuto do plano grátis da Groq.
+PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "6000"))
+
+ENCODING_NAME = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        print(f"[!] tiktoken indisponível ({e}) - usando estimativa de 4 caracteres por token")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Número de tokens de um texto (estimativa se o tiktoken não carregar)"""
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def pack_batches(items: List[T], cost: Callable[[T], int], budget: int) -> List[List[T]]:
+    """
+    Agrupa itens em ordem, sem ultrapassar o orçamento de cada lote
+
+    Um item maior que o orçamento vai sozinho em um lote (quem chama decide
+    se precisa dividi-lo antes).
+    """
+    batches, current, used = [], [], 0
+    for item in items:
+        item_cost = cost(item)
+        if current and used + item_cost > budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += item_cost
+    if current:
+        batches.append(current)
+    return batches
@@ -0,0 +1,298 @@
+"""
+Cache colunar (Parquet) das transações
+Converte o CSV uma única vez em arquivos tipados e os reutiliza enquanto o
+CSV de origem não mudar. Linhas acrescentadas ao final do CSV viram uma nova
+parte do cache; só uma reescrita do arquivo refaz a conversão inteira
+"""
+
+import csv
+import glob
+import hashlib
+import json
+import os
+import pandas as pd
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+CACHE_DIR = ".cache/transacoes"
+MANIFEST_FILE = "manifest.json"
+
+# Colunas com poucos valores distintos, guardadas como categóricas
+CATEGORICAL_COLUMNS = ['funcionario', 'categoria']
+DATE_COLUMNS = ['data']
+# Formato das datas no CSV; fixo para não depender da inferência a cada bloco
+DATE_FORMAT = "%Y-%m-%d"
+
+# Leitura do CSV em blocos deste tamanho ao calcular o hash do trecho convertido
+_HASH_BLOCK_BYTES = 1024 * 1024
+
+# Acima disso as partes acrescentadas são juntadas em um único arquivo
+CACHE_MAX_PARTS = int(os.getenv("TRANSACTIONS_CACHE_MAX_PARTS", "16"))
+
+
+def pyarrow_available() -> bool:
+    """Indica se o pyarrow (necessário para o cache) está instalado"""
+    return pa is not None
+
+
+def _parse_dates(values: pd.Series, column: str) -> pd.Series:
+    """Converte uma coluna de datas no formato DATE_FORMAT (vazios viram NaT)"""
+    dates = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+    invalid = dates.isna() & values.notna() & (values.astype(str).str.strip() != '')
+    if invalid.any():
+        raise ValueError(
+            f"Coluna '{column}' com {int(invalid.sum())} data(s) fora do formato "
+            f"{DATE_FORMAT} (ex: {values[invalid].iloc[0]!r}); cache colunar não gerado"
+        )
+    return dates
+
+
+class TransactionCache:
+    def __init__(self, source_file: str, dtypes: Dict, cache_dir: str = CACHE_DIR):
+        """
+        Inicializa o cache de um arquivo de transações
+
+        Args:
+            source_file: CSV de origem
+            dtypes: Colunas e tipos usados na leitura do CSV
+            cache_dir: Diretório dos arquivos Parquet
+        """
+        if not pyarrow_available():
+            raise ImportError("pyarrow não instalado. Execute: pip install pyarrow")
+
+        self.source_file = source_file
+        self.dtypes = dtypes
+        self.cache_dir = cache_dir
+
+    def _source_id(self) -> str:
+        path = os.path.abspath(self.source_file)
+        return hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]
+
+    @property
+    def directory(self) -> str:
+        """Diretório com as partes Parquet e o manifesto deste CSV"""
+        return os.path.join(self.cache_dir, self._source_id())
+
+    def _read_manifest(self) -> Optional[Dict]:
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict):
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _content_hash(self, length: int) -> str:
+        """sha1 dos primeiros length bytes do CSV (o trecho já convertido)"""
+        digest = hashlib.sha1()
+        with open(self.source_file, 'rb') as f:
+            while length > 0:
+                block = f.read(min(length, _HASH_BLOCK_BYTES))
+                if not block:
+                    break
+                digest.update(block)
+                length -= len(block)
+        return digest.hexdigest()
+
+    def _is_append(self, manifest: Dict, size: int) -> bool:
+        """O CSV só cresceu: trecho convertido intacto e terminando em fim de linha"""
+        converted = manifest['bytes']
+        if size <= converted or converted == 0:
+            return False
+        # Manifestos antigos só tinham o hash do início: o cache é refeito
+        if self._content_hash(converted) != manifest.get('conteudo_sha1'):
+            return False
+        with open(self.source_file, 'rb') as f:
+            f.seek(converted - 1)
+            return f.read(1) == b'\n'
+
+    def _schema(self):
+        fields = []
+        for column, dtype in self.dtypes.items():
+            if column in CATEGORICAL_COLUMNS:
+                fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+            elif column in DATE_COLUMNS:
+                fields.append(pa.field(column, pa.date32()))
+            elif dtype == 'float64':
+                fields.append(pa.field(column, pa.float64()))
+            else:
+                fields.append(pa.field(column, pa.string()))
+        return pa.schema(fields)
+
+    def _write_part(self, name: str, start_byte: int, chunksize: int) -> int:
+        """
+        Converte o CSV a partir de start_byte (início de uma linha) em uma parte
+
+        Returns:
+            Número de linhas convertidas
+        """
+        schema = self._schema()
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".tmp"
+
+        with open(self.source_file, 'r', encoding='utf-8', newline='') as f:
+            header = next(csv.reader([f.readline()]))
+        rows = 0
+        with open(self.source_file, 'rb') as f:
+            f.seek(start_byte)
+            # Conversão em blocos: a memória não depende do tamanho do CSV
+            reader = pd.read_csv(
+                f,
+                header=0 if start_byte == 0 else None,
+                names=None if start_byte == 0 else header,
+                usecols=list(self.dtypes),
+                dtype=self.dtypes,
+                chunksize=chunksize
+            )
+            with reader, pq.ParquetWriter(tmp_path, schema) as writer:
+                for chunk in reader:
+                    for column in DATE_COLUMNS:
+                        chunk[column] = _parse_dates(chunk[column], column)
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer.write_table(table.select(schema.names).cast(schema))
+                    rows += len(chunk)
+        os.replace(tmp_path, path)
+        return rows
+
+    def _compact(self, manifest: Dict) -> Dict:
+        """Junta as partes em um único arquivo (sem reler o CSV)"""
+        schema = self._schema()
+        name = f"parte-{manifest['proxima_parte']:05d}.parquet"
+        path = os.path.join(self.directory, name)
+        with pq.ParquetWriter(path + ".tmp", schema) as writer:
+            for part in manifest['partes']:
+                for batch in pq.ParquetFile(os.path.join(self.directory, part)).iter_batches():
+                    writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        os.replace(path + ".tmp", path)
+        return {**manifest, 'partes': [name], 'proxima_parte': manifest['proxima_parte'] + 1}
+
+    def ensure(self, chunksize: int = 500_000) -> List[str]:
+        """
+        Atualiza o cache para a versão atual do CSV
+
+        Se o CSV só ganhou linhas no final, apenas elas são convertidas (nova
+        parte); se foi reescrito, o cache é refeito do zero.
+
+        Returns:
+            Caminhos das partes Parquet, na ordem do CSV
+        """
+        stat = os.stat(self.source_file)
+        manifest = self._read_manifest()
+        if manifest is not None and manifest['bytes'] == stat.st_size \
+                and manifest['mtime_ns'] == stat.st_mtime_ns:
+            return [os.path.join(self.directory, part) for part in manifest['partes']]
+
+        os.makedirs(self.directory, exist_ok=True)
+        if manifest is not None and self._is_append(manifest, stat.st_size):
+            print("[*] Convertendo transações novas para o cache colunar...")
+            name = f"parte-{manifest['proxima_parte']:05d}.parquet"
+            rows = self._write_part(name, manifest['bytes'], chunksize)
+            manifest = {
+                **manifest,
+                'partes': manifest['partes'] + [name],
+                'proxima_parte': manifest['proxima_parte'] + 1,
+                'linhas': manifest['linhas'] + rows
+            }
+            if len(manifest['partes']) > CACHE_MAX_PARTS:
+                manifest = self._compact(manifest)
+        else:
+            print("[*] Gerando cache colunar das transações...")
+            name = "parte-00000.parquet"
+            rows = self._write_part(name, 0, chunksize)
+            manifest = {'partes': [name], 'proxima_parte': 1, 'linhas': rows}
+
+        manifest.update(bytes=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                        conteudo_sha1=self._content_hash(stat.st_size))
+        self._write_manifest(manifest)
+
+        # Remove partes que saíram do manifesto e caches do formato antigo
+        stale = glob.glob(os.path.join(self.directory, "*.parquet"))
+        stale += glob.glob(os.path.join(self.cache_dir, f"{self._source_id()}-*.parquet"))
+        for path in stale:
+            if os.path.basename(path) not in manifest['partes'] \
+                    or os.path.dirname(path) != self.directory:
+                os.remove(path)
+
+        print(f"[OK] Cache salvo em: {self.directory} ({manifest['linhas']} linhas, "
+              f"{len(manifest['partes'])} parte(s))")
+        return [os.path.join(self.directory, part) for part in manifest['partes']]
+
+    @staticmethod
+    def _to_pandas(table) -> pd.DataFrame:
+        df = table.to_pandas(date_as_object=False)
+        # Categorias em ordem alfabética, como no groupby sobre texto
+        for column in CATEGORICAL_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].cat.set_categories(sorted(df[column].cat.categories))
+        return df
+
+    def _concat(self, tables: List, columns: Optional[List[str]]):
+        if tables:
+            return pa.concat_tables(tables)
+        table = self._schema().empty_table()
+        return table.select(columns) if columns else table
+
+    def read(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Lê o cache inteiro, apenas com as colunas pedidas"""
+        tables = [pq.read_table(path, columns=columns) for path in self.ensure()]
+        df = self._to_pandas(self._concat(tables, columns))
+        df.index = pd.RangeIndex(len(df))
+        return df
+
+    def iter_batches(self, batch_size: int,
+                     columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """Lê o cache em blocos de até batch_size linhas"""
+        offset = 0
+        for path in self.ensure():
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+                df = self._to_pandas(pa.Table.from_batches([batch]))
+                df.index = pd.RangeIndex(offset, offset + len(df))
+                offset += len(df)
+                yield df
+
+    def read_from(self, start: int, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Lê as linhas a partir da posição start (índice = posição no arquivo)
+
+        Só as partes e row groups que contêm essas linhas são lidos, então o
+        custo é proporcional às linhas novas.
+        """
+        tables, offset = [], 0
+        for path in self.ensure():
+            parquet_file = pq.ParquetFile(path)
+            for group in range(parquet_file.num_row_groups):
+                n_rows = parquet_file.metadata.row_group(group).num_rows
+                if offset + n_rows > start:
+                    table = parquet_file.read_row_group(group, columns=columns)
+                    tables.append(table.slice(max(start - offset, 0)))
+                offset += n_rows
+
+        df = self._to_pandas(self._concat(tables, columns))
+        df.index = pd.RangeIndex(start, start + len(df))
+        return df
+
+    def read_since(self, first_day: pd.Timestamp,
+                   columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Lê as linhas com data >= first_day (usa as estatísticas dos row groups)"""
+        tables = [
+            pq.read_table(path, columns=columns,
+                          filters=[(DATE_COLUMNS[0], '>=', first_day.date())])
+            for path in self.ensure()
+        ]
+        return self._to_pandas(self._concat(tables, columns))
+
+    def count_rows(self) -> int:
+        """Número de transações, lido dos metadados do Parquet"""
+        return sum(pq.ParquetFile(path).metadata.num_rows for path in self.ensure())